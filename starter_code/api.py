@@ -0,0 +1,332 @@
+import hmac
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context, url_for
+
+from booking import free_slots, month_window
+from bulk import KINDS, READERS, import_records
+from genres import genre_criteria, genre_facets, requested_genres
+from geo import nearby_shows, requested_point
+from models import db, Artist, Show, Venue, DEFAULT_SHOW_DURATION
+from pagination import parse_datetime_arg, encode_show_cursor, decode_show_cursor, page_size
+from validation import to_datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+api = Blueprint('api', __name__)
+
+VENUE_FIELDS = ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'website',
+                'facebook_link', 'seeking_talent', 'seeking_description', 'updated_at')
+ARTIST_FIELDS = ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'website',
+                 'facebook_link', 'seeking_venue', 'seeking_description', 'updated_at')
+SHOW_FIELDS = ('id', 'start_time', 'end_time', 'artist_id', 'venue_id', 'updated_at')
+
+# Rows fetched per round trip when streaming an export from a server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+# Rejected rows echoed back in a bulk import response
+MAX_REPORTED_REJECTS = 1000
+
+# Bounds on a free slots request
+FREE_SLOTS_MAX_VENUES = 100
+FREE_SLOTS_MAX_DAYS = 92
+
+
+#----------------------------------------------------------------------------#
+# Serialization.
+#----------------------------------------------------------------------------#
+
+def encode_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('Cannot serialize {!r}'.format(type(value)))
+
+
+def dumps(obj):
+    """Encode obj as JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=encode_default, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(obj, status=200, headers=None):
+    return Response(dumps(obj), status=status, headers=headers, mimetype='application/json')
+
+
+@api.errorhandler(400)
+def bad_request(error):
+    return json_response({'error': error.description}, 400)
+
+
+@api.errorhandler(404)
+def not_found(error):
+    return json_response({'error': 'Not found'}, 404)
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def requested_fields(allowed, required):
+    """ Sparse fieldset from ?fields=a,b.
+
+    The keyset columns in required are always returned, because the cursor is
+    built from them.
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return list(allowed)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = set(names).difference(allowed)
+    if unknown:
+        abort(400, 'Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    return list(required) + [name for name in names if name not in required]
+
+
+def entity_criteria(model):
+    # Venues and artists filter on city, state and genre (all given genres must match, or any with match=any)
+    criteria = []
+    if request.args.get('city'):
+        criteria.append(model.city == request.args['city'])
+    if request.args.get('state'):
+        criteria.append(model.state == request.args['state'])
+    genres, match = requested_genres()
+    return criteria + genre_criteria(model.genres, genres, match)
+
+
+def entity_query(model, fields):
+    query = db.session.query(*[getattr(model, name) for name in fields])
+    return query.filter(*entity_criteria(model)).order_by(model.id)
+
+
+def show_query(fields):
+    query = db.session.query(*[getattr(Show, name) for name in fields])
+    venue_id = request.args.get('venue_id', type=int)
+    if venue_id is not None:
+        query = query.filter(Show.venue_id == venue_id)
+    artist_id = request.args.get('artist_id', type=int)
+    if artist_id is not None:
+        query = query.filter(Show.artist_id == artist_id)
+    start = parse_datetime_arg('from')
+    if start is not None:
+        query = query.filter(Show.start_time >= start)
+    end = parse_datetime_arg('to')
+    if end is not None:
+        query = query.filter(Show.start_time < end)
+    return query.order_by(Show.start_time, Show.id)
+
+
+def page_response(endpoint, rows, fields, limit, cursor_for):
+    # One extra row was fetched to find out whether there is a next page
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        args = request.args.to_dict(flat=False)
+        args['after'] = cursor_for(rows[-1])
+        next_url = url_for(endpoint, _external=True, **args)
+
+    headers = {'Link': '<{}>; rel="next"'.format(next_url)} if next_url else None
+    return json_response({
+        'data': [dict(zip(fields, row)) for row in rows],
+        'next': next_url
+    }, headers=headers)
+
+
+def stream_ndjson(query, fields, filename):
+    # Rows are pulled through a server-side cursor in batches, so memory stays
+    # flat however many rows are exported
+    def generate():
+        for row in query.yield_per(EXPORT_BATCH_SIZE):
+            yield dumps(dict(zip(fields, row))) + b'\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename={}'.format(filename)}
+    )
+
+
+def list_entities(model, allowed, endpoint):
+    fields = requested_fields(allowed, ['id'])
+    limit = page_size('API_PAGE_SIZE', 'API_MAX_PAGE_SIZE', 'limit')
+    query = entity_query(model, fields)
+    after = request.args.get('after')
+    if after:
+        try:
+            query = query.filter(model.id > int(after))
+        except ValueError:
+            abort(400, 'Invalid cursor')
+    rows = query.limit(limit + 1).all()
+    return page_response(endpoint, rows, fields, limit, lambda row: row.id)
+
+
+def free_slots_response(venue_ids):
+    # From ?from= (the start of the current month, UTC) to ?to= (the end of that month); gaps
+    # shorter than ?min_minutes= (the default show length) are left out
+    start = parse_datetime_arg('from')
+    start = to_datetime(start) if start else month_window(datetime.now(timezone.utc))[0]
+    end = parse_datetime_arg('to')
+    end = to_datetime(end) if end else month_window(start)[1]
+    if not start < end <= start + timedelta(days=FREE_SLOTS_MAX_DAYS):
+        abort(400, 'to must be after from, and at most {} days after it'.format(FREE_SLOTS_MAX_DAYS))
+    min_minutes = request.args.get('min_minutes', int(DEFAULT_SHOW_DURATION.total_seconds() // 60), type=int)
+    if min_minutes < 1:
+        abort(400, 'min_minutes must be positive')
+    slots = free_slots(venue_ids, start, end, timedelta(minutes=min_minutes))
+    return start, end, slots
+
+
+def genre_counts(model):
+    facets = genre_facets(model, entity_criteria(model))
+    return json_response({'data': [{'genre': genre, 'count': count} for genre, count in facets]})
+
+
+def get_entity(model, allowed, entity_id):
+    fields = requested_fields(allowed, ['id'])
+    row = db.session.query(*[getattr(model, name) for name in fields]).\
+        filter(model.id == entity_id).\
+        first()
+    if row is None:
+        abort(404)
+    return json_response(dict(zip(fields, row)))
+
+
+#----------------------------------------------------------------------------#
+# Endpoints.
+#----------------------------------------------------------------------------#
+
+@api.route('/venues')
+def list_venues():
+    return list_entities(Venue, VENUE_FIELDS, 'api.list_venues')
+
+
+@api.route('/venues/export')
+def export_venues():
+    fields = requested_fields(VENUE_FIELDS, ['id'])
+    return stream_ndjson(entity_query(Venue, fields), fields, 'venues.ndjson')
+
+
+@api.route('/venues/genres')
+def venue_genres():
+    return genre_counts(Venue)
+
+
+@api.route('/venues/<int:venue_id>')
+def get_venue(venue_id):
+    return get_entity(Venue, VENUE_FIELDS, venue_id)
+
+
+@api.route('/venues/<int:venue_id>/free-slots')
+def venue_free_slots(venue_id):
+    start, end, slots = free_slots_response([venue_id])
+    if venue_id not in slots:
+        abort(404)
+    return json_response({'from': start, 'to': end, 'data': [slot._asdict() for slot in slots[venue_id]]})
+
+
+@api.route('/venues/free-slots')
+def venues_free_slots():
+    # The free slots of several venues at once: ?venue_id=1&venue_id=2...
+    venue_ids = request.args.getlist('venue_id', type=int)
+    if not 0 < len(venue_ids) <= FREE_SLOTS_MAX_VENUES:
+        abort(400, 'Give 1 to {} venue_id arguments'.format(FREE_SLOTS_MAX_VENUES))
+    start, end, slots = free_slots_response(venue_ids)
+    return json_response({'from': start, 'to': end, 'data': [
+        {'venue_id': venue_id, 'slots': [slot._asdict() for slot in venue_slots]}
+        for venue_id, venue_slots in sorted(slots.items())
+    ]})
+
+
+@api.route('/artists')
+def list_artists():
+    return list_entities(Artist, ARTIST_FIELDS, 'api.list_artists')
+
+
+@api.route('/artists/export')
+def export_artists():
+    fields = requested_fields(ARTIST_FIELDS, ['id'])
+    return stream_ndjson(entity_query(Artist, fields), fields, 'artists.ndjson')
+
+
+@api.route('/artists/genres')
+def artist_genres():
+    return genre_counts(Artist)
+
+
+@api.route('/artists/<int:artist_id>')
+def get_artist(artist_id):
+    return get_entity(Artist, ARTIST_FIELDS, artist_id)
+
+
+@api.route('/shows')
+def list_shows():
+    fields = requested_fields(SHOW_FIELDS, ['id', 'start_time'])
+    limit = page_size('API_PAGE_SIZE', 'API_MAX_PAGE_SIZE', 'limit')
+    query = show_query(fields)
+    after = request.args.get('after')
+    if after:
+        query = query.filter(db.tuple_(Show.start_time, Show.id) > decode_show_cursor(after))
+    rows = query.limit(limit + 1).all()
+    return page_response('api.list_shows', rows, fields, limit,
+                         lambda row: encode_show_cursor(row.start_time, row.id))
+
+
+@api.route('/shows/export')
+def export_shows():
+    fields = requested_fields(SHOW_FIELDS, ['id', 'start_time'])
+    return stream_ndjson(show_query(fields), fields, 'shows.ndjson')
+
+
+@api.route('/shows/nearby')
+def list_nearby_shows():
+    # One page of the nearest shows; widen ?radius= rather than paging for more
+    point = requested_point()
+    if point is None:
+        abort(400, 'lat and lon are required')
+    limit = page_size('API_PAGE_SIZE', 'API_MAX_PAGE_SIZE', 'limit')
+    start = parse_datetime_arg('from') or datetime.now(timezone.utc)
+    shows = nearby_shows(*point, start=start, end=parse_datetime_arg('to'), limit=limit)
+    return json_response({'data': [show._asdict() for show in shows]})
+
+
+@api.route('/shows/<int:show_id>')
+def get_show(show_id):
+    return get_entity(Show, SHOW_FIELDS, show_id)
+
+
+def bulk_authorized():
+    token = current_app.config.get('BULK_API_TOKEN')
+    if not token:
+        abort(404)
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode('utf-8'), token.encode('utf-8'))
+
+
+@api.route('/bulk/<kind>', methods=['POST'])
+def bulk_import(kind):
+    # Stream a CSV (text/csv) or NDJSON body straight into the import pipeline
+    if kind not in KINDS:
+        abort(404)
+    if not bulk_authorized():
+        return json_response({'error': 'Unauthorized'}, 401, {'WWW-Authenticate': 'Bearer'})
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    rejects = []
+
+    def reject(line, record, errors):
+        if len(rejects) < MAX_REPORTED_REJECTS:
+            rejects.append({'line': line, 'errors': errors})
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+    try:
+        result = import_records(kind, READERS[fmt](stream), reject)
+    except UnicodeDecodeError:
+        # Bad lines are rejected one by one, but a body that isn't UTF-8 can't be read on
+        db.session.rollback()
+        abort(400, 'The {} body is not UTF-8'.format(fmt))
+    return json_response({'inserted': result.inserted, 'rejected': result.rejected, 'rejects': rejects})
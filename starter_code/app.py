@@ -3,9 +3,9 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
 import sys
+from bisect import bisect_left
+from datetime import datetime, timezone
 from flask import (
   Flask, 
   render_template, 
@@ -15,7 +15,8 @@ from flask import (
   redirect, 
   url_for, 
   abort, 
-  jsonify
+  jsonify,
+  make_response
 )
 
 from flask_moment import Moment
@@ -24,6 +25,39 @@ import logging
 from logging import Formatter, FileHandler
 from forms import *
 from models import *
+from search import search_entities
+from booking import BookingError, book_show
+from calendars import artist_feed, artist_feed_version, city_feed, city_feed_version, venue_feed, venue_feed_version
+from validation import validate_show
+from readmodels import ShowTile, artist_items, artist_page, fetch, show_tile_query, venue_areas, venue_page
+from dates import format_datetime
+from genres import facet_links, genre_criteria, genre_facets, requested_genres
+from geo import geocode_command, locate, nearby_shows, requested_point
+from pagination import parse_datetime_arg, encode_show_cursor, decode_show_cursor, page_size
+from api import api
+from bulk import import_command
+from counters import count_new_shows, counts_command, uncount_shows
+from jobs import worker_command
+from assets import assets, assets_command
+from snapshot import snapshot_command
+from tasks import warm_pages
+from dbpool import init_pool_instrumentation
+from routing import router
+from instrumentation import instrumentation
+from cache import (
+  cache,
+  conditional_get,
+  venue_page_keys,
+  artist_page_keys,
+  show_page_keys,
+  page_key,
+  city_calendar_key,
+  venue_version,
+  artist_version,
+  venues_version,
+  artists_version,
+  shows_version
+)
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -33,20 +67,25 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db.init_app(app)
+init_pool_instrumentation(app)
+router.init_app(app)
+instrumentation.init_app(app)
+cache.init_app(app)
+assets.init_app(app)
 migrate = Migrate(app, db)
+app.register_blueprint(api, url_prefix='/api/v1')
+app.cli.add_command(import_command)
+app.cli.add_command(counts_command)
+app.cli.add_command(worker_command)
+app.cli.add_command(geocode_command)
+app.cli.add_command(assets_command)
+app.cli.add_command(snapshot_command)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
-
+# Compiled patterns and memoized values, in the request's locale and time zone (see dates.py)
 app.jinja_env.filters['datetime'] = format_datetime
 
 #----------------------------------------------------------------------------#
@@ -64,94 +103,64 @@ def index():
 
 
 @app.route('/venues')
+@conditional_get(venues_version)
+@cache.cached_page('venues')
 def venues():
-   # Get data on the venues and populate the data list.  Grouped by City amd State
-  # Create A list of dictionaries, where city, state, and venues are dictionary keys
-  # Looped over both venues and places and appended the matching states and cities to locals 
-  
-  locals =[]
-  venues = Venue.query.all()
-  places = Venue.query.distinct(Venue.city, Venue.state).all()
-
-  for place in places:
-    for venue in venues:
-      if venue.city == place.city and venue.state == place.state:
-        locals.append({
-          'city': place.city,
-          'state': place.state,
-          'venues': [{
-          'id': venue.id,
-          'name': venue.name,
-          'num_upcoming_shows': len([show for show in venue.show if show.start_time > str(datetime.now())])
-          }]
-        })
-  
-  return render_template('pages/venues.html', areas=locals, venues=venues )
+  # Get data on the venues and populate the data list.  Grouped by City and State
+  # One query returns every venue with its upcoming show count, read from the maintained counters,
+  # as Area/VenueItem tuples (see readmodels.py)
+  # ?genre= narrows the listing (see genres.py); the genre links show the counts within the current filter
+  genres, match = requested_genres()
+  criteria = genre_criteria(Venue.genres, genres, match)
+  areas = venue_areas(criteria)
 
+  genre_links = facet_links('venues', genre_facets(Venue, criteria), genres, match)
+  return render_template('pages/venues.html', areas=areas, genres=genres, genre_links=genre_links)
 
-@app.route('/venues/search', methods=['POST'])
+
+@app.route('/venues/search')
 def search_venues():
   # Search for venues which match the search term input non case sensitive
-  # Use filter, not filter_by when doing LIKE search (i=insensitive to case)
-  
-  search = request.form.get('search_term', '')
-  response = Venue.query.filter(Venue.name.ilike(f'%{search}%')).all()
-  
-  data = {}
+  # Results are ranked and limited to one page; "City, ST" searches by location
+  # A GET with the term in the query string, so searches are read from a replica like the other pages
+  # and don't pin the visitor to the primary (see routing.py)
 
-  for results in response:
-    data['count'] = len(response)
+  search = request.args.get('search_term', '')
+  page = max(request.args.get('page', 1, type=int), 1)
+  response, count = search_entities(Venue, search, page, app.config['SEARCH_PER_PAGE'])
+
+  data = {
+    'count': count,
+    'page': page,
+    'pages': -(-count // app.config['SEARCH_PER_PAGE'])
+  }
 
   return render_template('pages/search_venues.html', results=response, search_term=search, data=data)
 
 
 @app.route('/venues/<int:venue_id>')
+@conditional_get(venue_version)
+@cache.cached_page('venue:{venue_id}')
 def show_venue(venue_id):
-   # Shows the venue page with the given venue_id
-  # Join Show, Artist and Venue tables to filter results which match venue to artist by id
-  # Fltering results will allow us to match upcoming shows and past shows to correct artists and venue
-  venue = Venue.query.get(venue_id)
-  
-  past = db.session.query(Artist, Show).join(Show).join(Venue).\
-    filter(
-      Show.venue_id == venue_id, 
-      Show.artist_id == Artist.id, 
-      Show.start_time < str(datetime.now())
-      ).\
-      all()
-  past_shows = []
-  past_shows_count = 0
- 
-  upcoming = db.session.query(Artist, Show).join(Show).join(Venue).\
-    filter(
-      Show.venue_id == venue_id, 
-      Show.artist_id == Artist.id, 
-      Show.start_time > str(datetime.now())
-      ).\
-      all()
-  upcoming_shows = []
-  upcoming_shows_count = 0
-
-
-  for artist, show in past:
-      past_shows.append({
-        'artist_id': artist.id,
-        'artist_name': artist.name,
-        'artist_image_link': artist.image_link,
-        'start_time': str(show.start_time)
-      })
-      past_shows_count += 1
-  for artist, show in upcoming:
-      upcoming_shows.append({
-        'artist_id': artist.id,
-        'artist_name': artist.name,
-        'artist_image_link': artist.image_link,
-        'start_time': str(show.start_time)
-      })
-      upcoming_shows_count += 1
+  # Shows the venue page with the given venue_id
+  # The venue's columns and its shows (ordered by start_time, with their artist's name and image) are
+  # two round trips in total, then the shows are split at the current time
+  venue, shows = venue_page(venue_id)
+  if venue is None:
+    abort(404)
+
+  split = bisect_left([show.start_time for show in shows], datetime.now(timezone.utc))
+  past_shows, upcoming_shows = shows[:split], shows[split:]
 
   return render_template('pages/show_venue.html', venue=venue , past_shows=past_shows, upcoming_shows=upcoming_shows,
-  past_shows_count=past_shows_count, upcoming_shows_count=upcoming_shows_count)
+  past_shows_count=len(past_shows), upcoming_shows_count=len(upcoming_shows))
+
+
+@app.route('/venues/<int:venue_id>/calendar.ics')
+@conditional_get(venue_feed_version)
+def venue_calendar(venue_id):
+  # The venue's shows as an iCalendar feed to subscribe to; rebuilt only when they change (see calendars.py)
+  return venue_feed(venue_id)
 
 
 #  Create Venue
@@ -176,9 +185,12 @@ def create_venue_submission():
       new_venue = Venue(name=form.name.data, city=form.city.data, state=form.state.data, address=form.address.data,
       phone=form.phone.data, genres=form.genres.data, image_link=form.image_link.data, website=form.website.data,
       facebook_link=form.facebook_link.data, seeking_talent=form.seeking_talent.data, seeking_description=form.seeking_description.data)
+      locate(new_venue)
       
       db.session.add(new_venue)
+      warm_pages(url_for('venues'))
       db.session.commit()
+      cache.delete_many(page_key('venues'))
       flash('Venue ' + form.name.data + ' was successfully listed!')
     except ValueError as e:
       print(e)
@@ -191,16 +203,20 @@ def create_venue_submission():
   return render_template('pages/home.html', form=form)
 
 
-@app.route('/venues/<venue_id>', methods=['POST'])
+@app.route('/venues/<int:venue_id>', methods=['POST'])
 def delete_venue(venue_id):
   # First get the venue id that has been requested to delete 
   # Then commit the delete to the database and notify the user if successfull
   # Catch and notify of any errors
   error = False
   try:
-    venues = Venue.query.get.first_or_404(venue_id)
+    venues = Venue.query.get_or_404(venue_id)
+    stale_pages = venue_page_keys(venue_id)
+    # Its shows stay behind without a venue, so they come off the artists' counters
+    uncount_shows(Show.venue_id == venue_id)
     db.session.delete(venues)
     db.session.commit()
+    cache.delete_many(*stale_pages)
     flash('The Venue has been successfully deleted!')
     return render_template('pages/home.html')
   except:
@@ -215,68 +231,54 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional_get(artists_version)
+@cache.cached_page('artists')
 def artists():
-  artists = Artist.query.all()
-  
-  return render_template('pages/artists.html', artists=artists )
+  # Same genre filter and links as venues()
+  genres, match = requested_genres()
+  criteria = genre_criteria(Artist.genres, genres, match)
+  artists = artist_items(criteria)
+  genre_links = facet_links('artists', genre_facets(Artist, criteria), genres, match)
+
+  return render_template('pages/artists.html', artists=artists, genres=genres, genre_links=genre_links)
 
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search')
 def search_artists():
   # Similar code and same functionality as search_venue()
-  search = search_term=request.form.get('search_term', '')
-  response = Artist.query.filter(Artist.name.ilike(f'%{search}%')).all()
+  search = request.args.get('search_term', '')
+  page = max(request.args.get('page', 1, type=int), 1)
+  response, count = search_entities(Artist, search, page, app.config['SEARCH_PER_PAGE'])
 
-  data = {}
-  for i in response:
-      data['count'] = len(response)
-  
-  return render_template('pages/search_artists.html', results=response, search_term=search , data=data)
+  data = {
+    'count': count,
+    'page': page,
+    'pages': -(-count // app.config['SEARCH_PER_PAGE'])
+  }
+
+  return render_template('pages/search_artists.html', results=response, search_term=search, data=data)
 
 @app.route('/artists/<int:artist_id>')
+@conditional_get(artist_version)
+@cache.cached_page('artist:{artist_id}')
 def show_artist(artist_id):
-  # Simmilar code and same functionality as show_venue() 
-  artist = Artist.query.get(artist_id)
-   
-  past = db.session.query(Venue, Show).join(Show).join(Artist).\
-    filter(
-      Show.artist_id == artist_id, 
-      Show.venue_id == Venue.id, 
-      Show.start_time < str(datetime.now())
-      ).\
-      all()
-  past_shows = []
-  past_shows_count = 0
- 
-  upcoming = db.session.query(Venue, Show).join(Show).join(Artist).\
-    filter(
-      Show.artist_id == artist_id, 
-      Show.venue_id == Venue.id, 
-      Show.start_time > str(datetime.now())
-      ).\
-      all()
-  upcoming_shows = []
-  upcoming_shows_count = 0
-  
-  for venue, show in past:
-    past_shows.append({
-      'venue_id': venue.id,
-      'venue_name': venue.name,
-      'venue_image_link': venue.image_link,
-      'start_time': str(show.start_time)
-    })
-    past_shows_count += 1
-  for venue, show in upcoming:
-    upcoming_shows.append({
-      'venue_id': venue.id,
-      'venue_name': venue.name,
-      'venue_image_link': venue.image_link,
-      'start_time': str(show.start_time)
-    })
-    upcoming_shows_count += 1
+  # Simmilar code and same functionality as show_venue()
+  artist, shows = artist_page(artist_id)
+  if artist is None:
+    abort(404)
+
+  split = bisect_left([show.start_time for show in shows], datetime.now(timezone.utc))
+  past_shows, upcoming_shows = shows[:split], shows[split:]
 
   return render_template('pages/show_artist.html', artist=artist , past_shows=past_shows, upcoming_shows=upcoming_shows,
-  past_shows_count=past_shows_count, upcoming_shows_count=upcoming_shows_count)
+  past_shows_count=len(past_shows), upcoming_shows_count=len(upcoming_shows))
+
+
+@app.route('/artists/<int:artist_id>/calendar.ics')
+@conditional_get(artist_feed_version)
+def artist_calendar(artist_id):
+  # Same as venue_calendar(), for the artist's shows
+  return artist_feed(artist_id)
 
 
 #  Update
@@ -307,10 +309,12 @@ def edit_artist_submission(artist_id):
       artist.genres = form.genres.data
       artist.image_link = form.image_link.data
       artist.facebook_link = form.facebook_link.data
-      artist.seeking_talent = form.seeking_talent.data
+      artist.seeking_venue = form.seeking_venue.data
       artist.seeking_description = form.seeking_description.data
 
+      warm_pages(url_for('show_artist', artist_id=artist_id), url_for('artists'))
       db.session.commit()
+      cache.delete_many(*artist_page_keys(artist_id))
       flash('Artist ' + form.name.data + ' was successfully updated!')
     except ValueError as e:
       print(e)
@@ -339,6 +343,8 @@ def edit_venue_submission(venue_id):
   venue = Venue.query.get(venue_id)
   if form.validate_on_submit():
     try:
+      # Taken before the edit, so the calendar of a city the venue moves out of is refreshed too
+      stale_pages = venue_page_keys(venue_id)
       venue.name = form.name.data
       venue.city = form.city.data
       venue.state = form.state.data
@@ -349,8 +355,11 @@ def edit_venue_submission(venue_id):
       venue.facebook_link = form.facebook_link.data
       venue.seeking_talent = form.seeking_talent.data
       venue.seeking_description = form.seeking_description.data
+      locate(venue)
       
+      warm_pages(url_for('show_venue', venue_id=venue_id), url_for('venues'))
       db.session.commit()
+      cache.delete_many(*stale_pages, city_calendar_key(form.city.data, form.state.data))
       flash('Venue ' + form.name.data + ' was successfully updated!')
     except ValueError as e:
       print(e)
@@ -383,7 +392,9 @@ def create_artist_submission():
       seeking_venue=form.seeking_venue.data, seeking_description=form.seeking_description.data)
       
       db.session.add(new_artist)
+      warm_pages(url_for('artists'))
       db.session.commit()
+      cache.delete_many(page_key('artists'))
       flash('Venue ' + form.name.data + ' was successfully committed!')
     except ValueError as e:
       print(e)
@@ -401,24 +412,71 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional_get(shows_version)
 def shows():
-  # Join the Show table with Artist and Venue by their id
-  # Then add each show by id and name to the data list in the form of a dictionary
-  shows = Show.query.join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id).all()
+  # Keyset-paginate the shows on (start_time, id) so each page is an index range scan,
+  # no matter how deep into the table the page is
+  # Only the columns the template needs are selected, as ShowTile tuples (see readmodels.py)
+  per_page = page_size('SHOWS_PER_PAGE', 'SHOWS_MAX_PER_PAGE')
+
+  filters = {
+    key: request.args.get(key)
+    for key in ('from', 'to', 'city', 'genre')
+    if request.args.get(key)
+  }
+
+  query = show_tile_query()
+
+  start = parse_datetime_arg('from')
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  end = parse_datetime_arg('to')
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  if 'city' in filters:
+    query = query.filter(Venue.city == filters['city'])
+  if 'genre' in filters:
+    # @> rather than = ANY(), which can't use the genre GIN index
+    query = query.filter(genres_contain(Artist.genres, [filters['genre']]))
+
+  cursor = request.args.get('after')
+  if cursor:
+    query = query.filter(db.tuple_(Show.start_time, Show.id) > decode_show_cursor(cursor))
+
+  # Fetch one extra row to find out whether there is a next page
+  data = fetch(ShowTile, query.order_by(Show.start_time, Show.id).limit(per_page + 1))
+
+  next_url = None
+  if len(data) > per_page:
+    data = data[:per_page]
+    last = data[-1]
+    next_url = url_for('shows', after=encode_show_cursor(last.start_time, last.id),
+                       per_page=per_page, **filters)
+
+  response = make_response(render_template('pages/shows.html', shows=data, next_url=next_url))
+  if next_url:
+    response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+  return response
+
+@app.route('/shows/calendar.ics')
+@conditional_get(city_feed_version)
+def city_calendar():
+  # The shows at every venue in ?city= and ?state=, as an iCalendar feed
+  return city_feed()
+
+@app.route('/shows/nearby')
+def nearby_shows_page():
+  # Upcoming shows (or those between ?from= and ?to=) at venues within ?radius= km of ?lat=&lon=, nearest first
+  # Without a point the page only shows the search form
+  point = requested_point()
+  shows = []
+  if point is not None:
+    start = parse_datetime_arg('from') or datetime.now(timezone.utc)
+    shows = nearby_shows(*point, start=start, end=parse_datetime_arg('to'),
+                         limit=page_size('SHOWS_PER_PAGE', 'SHOWS_MAX_PER_PAGE'))
+
+  return render_template('pages/shows_nearby.html', shows=shows, point=point)
 
-  data = []
-
-  for show in shows:
-    data.append({
-      'venue_id': show.venue_id,
-      'venue_name': show.venue.name,
-      'artist_id': show.artist_id,
-      'artist_name': show.artist.name,
-      'artist_image_link': show.artist.image_link,
-      'start_time': str(show.start_time)
-    })
-
-  return render_template('pages/shows.html', shows=data)
 
 @app.route('/shows/create')
 def create_shows():
@@ -428,14 +486,28 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # Same functionality as create_venue_submission()
+  # The artist and the venue must exist and both be free for the whole show (see booking.py);
+  # a refused booking goes back to the form with the reasons
   form = ShowForm(request.form, csrf_enabled=False)
   
   if form.validate_on_submit():
     try:
-      show = Show(artist_id=form.artist_id.data, venue_id=form.venue_id.data, start_time=form.start_time.data)
-      db.session.add(show)
+      row, errors = validate_show({'artist_id': form.artist_id.data, 'venue_id': form.venue_id.data,
+                                   'start_time': form.start_time.data, 'duration_minutes': form.duration_minutes.data})
+      if errors:
+        raise BookingError(errors)
+      show_id = book_show(**row)
+      count_new_shows([show_id])
+      warm_pages(url_for('venues'), url_for('show_venue', venue_id=row['venue_id']),
+                 url_for('show_artist', artist_id=row['artist_id']))
       db.session.commit()
+      cache.delete_many(*show_page_keys(row['artist_id'], row['venue_id']))
       flash('Show was successfully created!')
+    except BookingError as e:
+      db.session.rollback()
+      for message in e.errors.values():
+        flash(message)
+      return render_template('forms/new_show.html', form=form), 409
     except ValueError as e:
       print(e)
       db.session.rollback()
@@ -0,0 +1,228 @@
+""" Static asset bundles and precompiled templates.
+
+`flask assets build` runs at deploy time. It concatenates and minifies the
+files of each bundle in BUNDLES, writes the result to static/dist/ under a
+name that carries a hash of its content, next to pre-compressed .gz and .br
+copies, and records bundle -> file in static/dist/manifest.json. It also
+compiles every template into Jinja bytecode in JINJA_BYTECODE_DIR.
+
+Templates link bundles with asset_urls(): the hashed file once the manifest
+exists, the individual source files before the first build. A hashed file
+never changes, so it is served with a far-future Cache-Control and in the
+best encoding the client accepts.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import brotli
+import click
+import rcssmin
+import rjsmin
+from flask import abort, current_app, request, safe_join, send_from_directory, url_for
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+
+# Bundle name -> source files under static/, in load order. The bundles live in static/dist/,
+# as deep as static/css/, so relative url(../fonts/...) references keep working.
+BUNDLES = {
+    'site.css': [
+        'css/bootstrap.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    # layouts/form.html adds the Bootstrap theme
+    'form.css': [
+        'css/bootstrap.css',
+        'css/bootstrap-theme.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    # Modernizr sets its classes on <html> before the page renders, so it loads in <head>
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+    ],
+    'site.js': [
+        'js/libs/jquery-1.11.1.min.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/libs/moment.min.js',
+        'js/plugins.js',
+        'js/script.js',
+    ],
+    # Only for IE < 9, behind a conditional comment
+    'respond.js': [
+        'js/libs/respond-1.4.2.min.js',
+    ],
+}
+
+MANIFEST = 'manifest.json'
+
+# Pre-compressed copies, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+def minify(name, sources):
+    if name.endswith('.css'):
+        return '\n'.join(rcssmin.cssmin(source, keep_bang_comments=True) for source in sources)
+    # A file that doesn't end its last statement would run into the next one
+    return ';\n'.join(rjsmin.jsmin(source, keep_bang_comments=True) for source in sources)
+
+
+def compressed(data):
+    """{suffix: bytes} for the encodings that make data smaller."""
+    copies = {
+        '.gz': gzip.compress(data, 9),
+        '.br': brotli.compress(data, quality=11),
+    }
+    return {suffix: copy for suffix, copy in copies.items() if len(copy) < len(data)}
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    # Keyed by template name without the absolute path, so bytecode built in one directory (the
+    # deploy's build directory) is found from another; a changed source still misses on its checksum
+
+    def get_cache_key(self, name, filename=None):
+        return super(TemplateBytecodeCache, self).get_cache_key(name)
+
+
+class Assets(object):
+    """ Serves the built bundles and points Jinja at the template bytecode.
+
+    The manifest is read once, in init_app; run `flask assets build` before
+    starting the app to pick up changed sources.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.dist = os.path.join(app.static_folder, 'dist')
+        self.manifest = self.load_manifest()
+        bytecode_dir = app.config.get('JINJA_BYTECODE_DIR')
+        if bytecode_dir and os.path.isdir(bytecode_dir):
+            app.jinja_env.bytecode_cache = TemplateBytecodeCache(bytecode_dir)
+        # More specific than Flask's /static/<path:filename>, so it matches first
+        app.add_url_rule('/static/dist/<path:filename>', 'static_dist', self.send_dist)
+        app.jinja_env.globals['asset_urls'] = self.urls
+        app.extensions['assets'] = self
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.dist, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def urls(self, bundle):
+        """URLs to link for a bundle: the built file, or its sources before the first build."""
+        if bundle in self.manifest:
+            return [url_for('static_dist', filename=self.manifest[bundle])]
+        return [url_for('static', filename=source) for source in BUNDLES[bundle]]
+
+    def send_dist(self, filename):
+        path = safe_join(self.dist, filename)
+        if filename == MANIFEST or not os.path.isfile(path):
+            abort(404)
+        served, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                served, encoding = filename + suffix, name
+                break
+        response = send_from_directory(self.dist, served, mimetype=mimetypes.guess_type(filename)[0])
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        # The name changes with the content, so the browser never needs to revalidate
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+        return response
+
+    def build(self):
+        """ Write every bundle, its compressed copies and the manifest to static/dist/.
+
+        Returns {bundle: sizes in bytes}. The previous build's files are kept,
+        as pages cached before a deploy still link them; older ones are removed.
+        """
+        os.makedirs(self.dist, exist_ok=True)
+        previous = self.load_manifest()
+        manifest = {}
+        sizes = {}
+        keep = {MANIFEST}
+        for filename in previous.values():
+            keep.update(filename + suffix for suffix in ('', '.gz', '.br'))
+        for bundle, paths in BUNDLES.items():
+            sources = []
+            for path in paths:
+                with open(os.path.join(self.static_folder, path), encoding='utf-8') as f:
+                    sources.append(f.read())
+            data = minify(bundle, sources).encode('utf-8')
+            stem, extension = os.path.splitext(bundle)
+            filename = '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:12], extension)
+            copies = dict(compressed(data), **{'': data})
+            for suffix, copy in copies.items():
+                with open(os.path.join(self.dist, filename + suffix), 'wb') as f:
+                    f.write(copy)
+                keep.add(filename + suffix)
+            manifest[bundle] = filename
+            sizes[bundle] = {
+                'sources': sum(len(source.encode('utf-8')) for source in sources),
+                'minified': len(data),
+                'gzip': len(copies.get('.gz', data)),
+                'br': len(copies.get('.br', data)),
+            }
+        for name in os.listdir(self.dist):
+            if name not in keep:
+                os.remove(os.path.join(self.dist, name))
+        with open(os.path.join(self.dist, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        self.manifest = manifest
+        return sizes
+
+
+def compile_templates(app, bytecode_dir):
+    """Compile every template into bytecode_dir; returns how many there were."""
+    os.makedirs(bytecode_dir, exist_ok=True)
+    environment = app.jinja_env
+    environment.bytecode_cache = TemplateBytecodeCache(bytecode_dir)
+    environment.bytecode_cache.clear()
+    if environment.cache is not None:
+        environment.cache.clear()
+    names = environment.list_templates()
+    for name in names:
+        # Loading through the bytecode cache compiles the template and stores the code
+        environment.get_template(name)
+    return len(names)
+
+
+assets = Assets()
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+assets_command = AppGroup('assets', help='Build the static bundles and template bytecode.')
+
+
+@assets_command.command('build')
+def build_command():
+    """Bundle, minify, fingerprint and compress the static assets; precompile the templates."""
+    for bundle, size in sorted(assets.build().items()):
+        click.echo('{:<12} {:>8} -> {:>8} bytes minified, {:>7} gzip, {:>7} br  ({})'.format(
+            bundle, size['sources'], size['minified'], size['gzip'], size['br'], assets.manifest[bundle]))
+    bytecode_dir = current_app.config.get('JINJA_BYTECODE_DIR')
+    if bytecode_dir:
+        click.echo('Compiled {} templates into {}'.format(compile_templates(current_app, bytecode_dir), bytecode_dir))
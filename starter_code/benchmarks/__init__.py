@@ -0,0 +1,22 @@
+""" Benchmarks and load tests for Fyyur.
+
+    python -m benchmarks generate --venues 1000 --artists 2000 --shows 50000
+    python -m benchmarks micro --baseline benchmarks/results/baseline.json
+    python -m benchmarks load --users 20 --duration 60
+    python -m benchmarks genres     # after generate --venues 100000 --artists 100000
+    python -m benchmarks nearby     # after generate --venues 1000000 --shows 1000000
+    python -m benchmarks booking    # after generate --venues 10000 --artists 20000 --shows 1000000
+    python -m benchmarks calendars  # after generate --venues 10000 --artists 20000 --shows 1000000
+    python -m benchmarks snapshot   # after generate --venues 10000 --artists 20000 --shows 1000000
+    python -m benchmarks jobs --jobs 2000 --concurrency 1,2,4,8
+    python -m benchmarks serving --clients 1,8,64
+    python -m benchmarks frontend --runs 10
+    python -m benchmarks tiles --tiles 10000
+    python -m benchmarks rows --rows 100000   # after generate --venues 100000 --artists 100000 --shows 100000
+    python -m benchmarks compare OLD.json NEW.json
+
+Runs are written to benchmarks/results/ as JSON. Copy a run to
+results/baseline.json to have later runs (and `fab test`) flag regressions
+in latency, query count, errors, import, job, row or snapshot throughput,
+page weight or peak memory.
+"""
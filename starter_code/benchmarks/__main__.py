@@ -0,0 +1,374 @@
+""" python -m benchmarks <command>; run from starter_code/.
+
+Every command but tiles needs a database that may be wiped, given with --database-url
+or BENCH_DATABASE_URL. It is never the app's own DATABASE_URL.
+"""
+import sys
+from datetime import timezone
+
+import click
+
+from benchmarks import (booking, calendars, datagen, frontend, genres, jobs, load, micro, nearby, results, rows, scaling,
+                        search, serving, snapshot, tiles)
+from benchmarks.harness import bench_app
+
+
+database_option = click.option('--database-url', envvar='BENCH_DATABASE_URL', required=True,
+                               help='Benchmark database; generate drops and recreates its tables.')
+
+
+def report(kind, data, parameters, output, baseline):
+    path = results.save(kind, data, parameters, output)
+    click.echo('Results written to {}'.format(path))
+    if baseline:
+        regressions = results.compare(results.load(baseline), results.load(path))
+        for regression in regressions:
+            click.echo('REGRESSION {}'.format(regression), err=True)
+        if regressions:
+            sys.exit(1)
+        click.echo('No regressions against {}'.format(baseline))
+
+
+@click.group()
+def cli():
+    """Fyyur benchmarks."""
+
+
+@cli.command()
+@database_option
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=2000, show_default=True)
+@click.option('--shows', default=50000, show_default=True)
+@click.option('--seed', default=0, show_default=True)
+@click.option('--anchor', type=click.DateTime(), help='Date the past/upcoming split is built around; today by default.')
+def generate(database_url, venues, artists, shows, seed, anchor):
+    """Reset the benchmark database and fill it with generated data."""
+    app = bench_app(database_url)
+    if anchor is not None:
+        anchor = anchor.replace(tzinfo=timezone.utc)
+    with app.app_context():
+        description = datagen.populate(venues, artists, shows, seed, anchor)
+    click.echo('Generated {venues} venues, {artists} artists and {shows} shows (seed {seed}, anchor {anchor}).'.format(
+        **description))
+
+
+@cli.command('micro')
+@database_option
+@click.option('--iterations', default=50, show_default=True)
+@click.option('--warmup', default=5, show_default=True)
+@click.option('--cache', 'cache_type', type=click.Choice(['null', 'simple']), default='null', show_default=True,
+              help="'null' measures the views themselves, 'simple' the cached pages.")
+@click.option('--only', multiple=True, help='Run only the named scenario; repeatable.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/micro-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def micro_command(database_url, iterations, warmup, cache_type, only, output, baseline):
+    """Time every view through the test client."""
+    app = bench_app(database_url, cache_type)
+    data = micro.run(app, iterations, warmup, only)
+    for name, summary in data.items():
+        click.echo('{:<28} p50 {:>9.3f}ms  p95 {:>9.3f}ms  queries {}'.format(
+            name, summary['p50_ms'], summary['p95_ms'], summary.get('queries', '-')))
+    report('micro', data, {'iterations': iterations, 'warmup': warmup, 'cache': cache_type}, output, baseline)
+
+
+@cli.command('load')
+@database_option
+@click.option('--users', default=10, show_default=True)
+@click.option('--duration', default=30.0, show_default=True, help='Seconds.')
+@click.option('--wait', default=0.0, show_default=True, help='Maximum think time between requests, in seconds.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--cache', 'cache_type', type=click.Choice(['null', 'simple']), default='simple', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/load-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def load_command(database_url, users, duration, wait, seed, cache_type, output, baseline):
+    """Run the read/write mix against a local server."""
+    app = bench_app(database_url, cache_type)
+    data = load.run(app, users, duration, seed, wait)
+    for name, summary in data['tasks'].items():
+        click.echo('{:<16} n {:>6}  p50 {:>9.3f}ms  p99 {:>9.3f}ms  errors {}'.format(
+            name, summary['n'], summary['p50_ms'], summary['p99_ms'], summary['errors']))
+    click.echo('{} requests/s'.format(data['tasks']['total']['requests_per_second']))
+    for bind, pool in data['pools'].items():
+        click.echo('pool {}: {} checkouts, max wait {:.1f}ms, {} timeouts'.format(
+            bind, pool['checkouts'], pool['checkout_wait_seconds_max'] * 1000, pool['checkout_timeouts']))
+    parameters = {'users': users, 'duration': duration, 'wait': wait, 'seed': seed, 'cache': cache_type}
+    report('load', data, parameters, output, baseline)
+
+
+@cli.command('genres')
+@database_option
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/genres-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def genres_command(database_url, iterations, output, baseline):
+    """Time the genre filters and facets and check they use the GIN indexes; exits 1 if not."""
+    app = bench_app(database_url)
+    data = genres.run(app, iterations)
+    unindexed = []
+    for name, summary in data.items():
+        click.echo('{:<28} {:>7} rows  p50 {:>9.3f}ms  p95 {:>9.3f}ms  {}'.format(
+            name, summary['matches'], summary['p50_ms'], summary['p95_ms'],
+            'index' if summary['index_used'] else 'no index'))
+        if summary['index_required'] and not summary['index_used']:
+            unindexed.append(name)
+    report('genres', data, {'iterations': iterations}, output, baseline)
+    if unindexed:
+        click.echo('NOT INDEXED {}'.format(', '.join(unindexed)), err=True)
+        sys.exit(1)
+
+
+@cli.command('search')
+@database_option
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--sqlite/--no-sqlite', default=True, show_default=True, help='Also time the SQLite FTS5 fallback.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/search-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def search_command(database_url, iterations, sqlite, output, baseline):
+    """Time venue and artist searches and check they use the search indexes; exits 1 if not."""
+    app = bench_app(database_url)
+    data = search.run(app, iterations, sqlite)
+    unindexed = []
+    for name, summary in data.items():
+        click.echo('{:<28} {:>7} of {:>8} names  p50 {:>9.3f}ms  p95 {:>9.3f}ms  {}'.format(
+            name, summary['matches'], summary['names'], summary['p50_ms'], summary['p95_ms'],
+            {True: 'index', False: 'no index'}.get(summary.get('index_used'), '')))
+        if summary.get('index_used') is False:
+            unindexed.append(name)
+    report('search', data, {'iterations': iterations, 'sqlite': sqlite}, output, baseline)
+    if unindexed:
+        click.echo('NOT INDEXED {}'.format(', '.join(unindexed)), err=True)
+        sys.exit(1)
+
+
+@cli.command('nearby')
+@database_option
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/nearby-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def nearby_command(database_url, iterations, output, baseline):
+    """Time radius searches for shows and check they use the geohash index; exits 1 if not."""
+    app = bench_app(database_url)
+    data = nearby.run(app, iterations)
+    unindexed = []
+    for name, summary in data.items():
+        if name.endswith('_scan'):
+            click.echo('{:<26} p50 {:>9.3f}ms  p95 {:>9.3f}ms  (full scan)'.format(
+                name, summary['p50_ms'], summary['p95_ms']))
+            continue
+        click.echo('{:<26} p50 {:>9.3f}ms  p95 {:>9.3f}ms  {:>3} shows  {}'.format(
+            name, summary['p50_ms'], summary['p95_ms'], summary['found'],
+            'index' if summary['index_used'] else 'no index'))
+        if not summary['index_used']:
+            unindexed.append(name)
+    report('nearby', data, {'iterations': iterations}, output, baseline)
+    if unindexed:
+        click.echo('NOT INDEXED {}'.format(', '.join(unindexed)), err=True)
+        sys.exit(1)
+
+
+@cli.command('booking')
+@database_option
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/booking-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def booking_command(database_url, iterations, output, baseline):
+    """Time bookings and free-slot lookups and check the lookups use the show index; exits 1 if not."""
+    app = bench_app(database_url)
+    data = booking.run(app, iterations)
+    unindexed = []
+    for name, summary in data.items():
+        if 'slots' not in summary:
+            click.echo('{:<28} p50 {:>9.3f}ms  p95 {:>9.3f}ms'.format(name, summary['p50_ms'], summary['p95_ms']))
+            continue
+        click.echo('{:<28} p50 {:>9.3f}ms  p95 {:>9.3f}ms  {:>3} venues  {:>5} slots  {}'.format(
+            name, summary['p50_ms'], summary['p95_ms'], summary['venues'], summary['slots'],
+            {True: 'index', False: 'no index'}.get(summary.get('index_used'), '(overlap filter)')))
+        if summary.get('index_used') is False:
+            unindexed.append(name)
+    report('booking', data, {'iterations': iterations}, output, baseline)
+    if unindexed:
+        click.echo('NOT INDEXED {}'.format(', '.join(unindexed)), err=True)
+        sys.exit(1)
+
+
+@cli.command('calendars')
+@database_option
+@click.option('--subscribers', default=calendars.SUBSCRIBERS, show_default=True)
+@click.option('--passes', default=3, show_default=True, help='Polling intervals after the first subscription.')
+@click.option('--changes', default=50, show_default=True, help='Shows booked before each pass.')
+@click.option('--interval', default=calendars.INTERVAL, show_default=True, help='Polling interval, in seconds.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/calendars-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def calendars_command(database_url, subscribers, passes, changes, interval, seed, output, baseline):
+    """Simulate calendar subscribers polling their feeds with ETags; books shows between passes."""
+    app = bench_app(database_url, 'simple')
+    data = calendars.run(app, subscribers, passes, changes, interval, seed)
+    for name, summary in data.items():
+        click.echo('{:<10} {:>6} requests  {:>6} ok  {:>6} not modified  p50 {:>8.3f}ms  p95 {:>8.3f}ms  '
+                   'busy {:>7.2f}s ({:.1%} of a core every {}s)  errors {}'.format(
+                       name, summary['requests'], summary['ok'], summary['not_modified'], summary['p50_ms'],
+                       summary['p95_ms'], summary['busy_seconds'], summary['core_share'], interval, summary['errors']))
+    parameters = {'subscribers': subscribers, 'passes': passes, 'changes': changes, 'interval': interval, 'seed': seed}
+    report('calendars', data, parameters, output, baseline)
+
+
+@cli.command('snapshot')
+@database_option
+@click.option('--workers', default='1,2,4', show_default=True, help='Comma-separated rendering process counts.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/snapshot-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def snapshot_command(database_url, workers, output, baseline):
+    """Time a full static snapshot and the incremental rebuild after one show changes."""
+    app = bench_app(database_url)
+    levels = [int(level) for level in workers.split(',')]
+    data = snapshot.run(app, levels)
+    for name, summary in data.items():
+        click.echo('{:<16} {:>6} pages rendered in {:>8.2f}s  {:>7.1f} pages/s  failed {}'.format(
+            name, summary['rendered'], summary['seconds'], summary['pages_per_second'] or 0, summary['failed']))
+    report('snapshot', data, {}, output, baseline)
+
+
+@cli.command('jobs')
+@database_option
+@click.option('--jobs', 'count', default=2000, show_default=True, help='Jobs per concurrency level.')
+@click.option('--concurrency', default='1,2,4,8', show_default=True, help='Comma-separated worker counts.')
+@click.option('--work-ms', default=0, show_default=True, help='Simulated I/O per job, in milliseconds.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/jobs-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def jobs_command(database_url, count, concurrency, work_ms, output, baseline):
+    """Measure background worker throughput; needs the Job table, e.g. from generate."""
+    app = bench_app(database_url)
+    levels = [int(level) for level in concurrency.split(',')]
+    data = jobs.run(app, count, levels, work_ms)
+    for name, summary in data.items():
+        click.echo('{:>3} workers  {:>8.1f} jobs/s  errors {}'.format(
+            summary['concurrency'], summary['jobs_per_second'], summary['errors']))
+    report('jobs', data, {'jobs': count, 'work_ms': work_ms}, output, baseline)
+
+
+@cli.command('serving')
+@database_option
+@click.option('--modes', default=','.join(serving.MODES), show_default=True, help='Comma-separated serving modes.')
+@click.option('--clients', default='1,8,64', show_default=True, help='Comma-separated concurrency levels.')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds per mode and level.')
+@click.option('--workers', default=1, show_default=True, help='gunicorn worker processes.')
+@click.option('--threads', default=8, show_default=True, help='Threads per gthread worker.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/serving-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def serving_command(database_url, modes, clients, duration, workers, threads, seed, output, baseline):
+    """Compare requests/s and latency of the dev server, gthread and gevent."""
+    app = bench_app(database_url)
+    modes = modes.split(',')
+    levels = [int(level) for level in clients.split(',')]
+    data = serving.run(app, database_url, modes, levels, duration, workers, threads, seed)
+    for name, summary in data.items():
+        click.echo('{:<14} {:>8.1f} requests/s  p50 {:>9.3f}ms  p99 {:>9.3f}ms  errors {}'.format(
+            name, summary['requests_per_second'], summary['p50_ms'] or 0, summary['p99_ms'] or 0, summary['errors']))
+    parameters = {'duration': duration, 'workers': workers, 'threads': threads, 'seed': seed}
+    report('serving', data, parameters, output, baseline)
+
+
+@cli.command('frontend')
+@database_option
+@click.option('--runs', default=10, show_default=True, help='Fresh processes per cold-start mode.')
+@click.option('--path', default='/venues', show_default=True, help='Page whose first request is timed.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/frontend-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def frontend_command(database_url, runs, path, output, baseline):
+    """Measure page weight and cold-start first-request time, with and without the asset build."""
+    app = bench_app(database_url)
+    data = frontend.run(app, database_url, runs, path)
+    for name, summary in data.items():
+        if name.startswith('weight-'):
+            click.echo('{:<22} {:>3} requests  {:>9} bytes  (css {}, js {}, images {}, html {}; {} missing)'.format(
+                name, summary['requests'], summary['total_bytes'], summary['css_bytes'], summary['js_bytes'],
+                summary['image_bytes'], summary['html_bytes'], summary['missing']))
+        else:
+            click.echo('{:<22} first request p50 {:>9.3f}ms  warm {:>7.3f}ms  import {:>8.3f}ms'.format(
+                name, summary['p50_ms'], summary['warm_ms'], summary['import_ms']))
+    report('frontend', data, {'runs': runs, 'path': path}, output, baseline)
+
+
+@cli.command('tiles')
+@click.option('--tiles', 'count', default=tiles.TILES, show_default=True, help='Show tiles per render.')
+@click.option('--iterations', default=10, show_default=True)
+@click.option('--warmup', default=2, show_default=True)
+@click.option('--only', multiple=True, help='Run only the named scenario; repeatable.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/tiles-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def tiles_command(count, iterations, warmup, only, output, baseline):
+    """Time rendering the shows page with many tiles, with each datetime filter."""
+    from app import app
+
+    data = tiles.run(app, iterations, warmup, count, only)
+    for name, summary in data.items():
+        click.echo('{:<18} p50 {:>9.3f}ms  p95 {:>9.3f}ms  {:>7.3f}us per tile'.format(
+            name, summary['p50_ms'], summary['p95_ms'], summary['us_per_tile']))
+    report('tiles', data, {'tiles': count, 'iterations': iterations, 'warmup': warmup}, output, baseline)
+
+
+@cli.command('rows')
+@database_option
+@click.option('--rows', 'count', default=rows.ROWS, show_default=True, help='Rows each scenario loads.')
+@click.option('--iterations', default=5, show_default=True)
+@click.option('--only', multiple=True, help='Run only the named scenario; repeatable.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/rows-<time>.json by default.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier run to flag regressions against.')
+def rows_command(database_url, count, iterations, only, output, baseline):
+    """Compare rows/s and peak memory of loading entities, column rows and read models."""
+    app = bench_app(database_url)
+    data = rows.run(app, iterations, count, only)
+    for name, summary in data.items():
+        click.echo('{:<18} {:>7} rows  p50 {:>9.3f}ms  {:>11.1f} rows/s  peak {:>7.1f}MB  {:>7.1f} bytes/row'.format(
+            name, summary['rows'], summary['p50_ms'], summary.get('rows_per_second', 0),
+            summary['peak_bytes'] / 1e6, summary['bytes_per_row'] or 0))
+    report('rows', data, {'rows': count, 'iterations': iterations}, output, baseline)
+
+
+@cli.command('scaling')
+@database_option
+@click.option('--sizes', default=','.join(str(size) for size in scaling.SIZES), show_default=True,
+              help='Comma-separated numbers of shows to measure at.')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=2000, show_default=True)
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--warmup', default=3, show_default=True)
+@click.option('--tolerance', default=scaling.TOLERANCE, show_default=True,
+              help='Allowed growth of p50 and peak memory from the smallest size to the largest.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file; results/scaling-<time>.json by default.')
+def scaling_command(database_url, sizes, venues, artists, iterations, warmup, tolerance, output):
+    """Check /shows stays flat in time and memory as the Show table grows; resets the database, exits 1 if not flat."""
+    app = bench_app(database_url)
+    sizes = [int(size) for size in sizes.split(',')]
+    data = scaling.run(app, sizes, venues, artists, iterations, warmup)
+    for shows, summaries in sorted(data['sizes'].items(), key=lambda item: int(item[0])):
+        for name, summary in summaries.items():
+            click.echo('{:>8} shows  {:<12} p50 {:>9.3f}ms  p95 {:>9.3f}ms  peak {:>7.2f}MB  status {}'.format(
+                shows, name, summary['p50_ms'], summary['p95_ms'], summary['peak_bytes'] / 1e6,
+                ','.join(str(status) for status in summary['status'])))
+    parameters = {'sizes': sizes, 'venues': venues, 'artists': artists, 'iterations': iterations, 'warmup': warmup,
+                  'tolerance': tolerance}
+    report('scaling', data, parameters, output, None)
+    problems = scaling.flatness(data, tolerance)
+    for problem in problems:
+        click.echo('NOT FLAT {}'.format(problem), err=True)
+    if problems:
+        sys.exit(1)
+    click.echo('Flat from {} to {} shows'.format(min(data['sizes'], key=int), max(data['sizes'], key=int)))
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, current):
+    """Flag regressions of CURRENT against BASELINE; exits 1 if there are any."""
+    regressions = results.compare(results.load(baseline), results.load(current))
+    for regression in regressions:
+        click.echo('REGRESSION {}'.format(regression))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    cli()
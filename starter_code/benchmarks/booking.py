@@ -0,0 +1,90 @@
+""" Booking shows and finding free slots against a million existing shows.
+
+Meant for a large data set, e.g. `generate --venues 10000 --artists 20000
+--shows 1000000`. Free slots for this month are looked up for the busiest
+venue, a typical one and a batch of the 100 busiest, each EXPLAINed to
+check the shows come from the (venue_id, start_time) index. For comparison,
+the overlap scenario finds the same slots with a plain overlap filter,
+which reads every earlier show of the venue. Bookings are timed in a free
+slot and onto an existing show, and rolled back.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from booking import BUSY_TIMES, BookingError, book_show, free_slots, gaps, month_window
+from models import db, Show, DEFAULT_SHOW_DURATION
+from benchmarks.harness import plan_indexes, summarize
+
+
+INDEX = 'ix_Show_venue_id_start_time'
+
+BATCH = 100
+
+
+def overlap_slots(venue_id, start, end):
+    # Every show ending after start: correct without relying on shows not overlapping, but unbounded below
+    bookings = db.session.query(Show.start_time, Show.end_time).\
+        filter(Show.venue_id == venue_id, Show.start_time < end, Show.end_time > start).\
+        order_by(Show.start_time).\
+        all()
+    return gaps(bookings, start, end, DEFAULT_SHOW_DURATION)
+
+
+def timed(func, iterations):
+    func()
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def booking(artist_id, venue_id, start_time):
+    def book():
+        try:
+            book_show(artist_id, venue_id, start_time)
+        except BookingError:
+            pass
+        finally:
+            db.session.rollback()
+    return book
+
+
+def run(app, iterations=20):
+    """{scenario: summary}; free-slot scenarios also give the slots found and the plan's index use."""
+    data = {}
+    start, end = month_window(datetime.now(timezone.utc))
+    with app.app_context():
+        counts = db.session.query(Show.venue_id, db.func.count(Show.id)).\
+            group_by(Show.venue_id).\
+            order_by(db.func.count(Show.id).desc(), Show.venue_id).\
+            all()
+        busiest, typical = counts[0][0], counts[len(counts) // 2][0]
+        batch = [venue_id for venue_id, _ in counts[:BATCH]]
+
+        for name, venue_ids in (('free-slots-busiest', [busiest]), ('free-slots-typical', [typical]),
+                                ('free-slots-batch', batch)):
+            slots = free_slots(venue_ids, start, end)
+            summary = summarize(timed(lambda: free_slots(venue_ids, start, end), iterations))
+            plan = plan_indexes(BUSY_TIMES.params(venue_ids=venue_ids, start=start, end=end))
+            summary.update(venues=len(venue_ids), slots=sum(len(found) for found in slots.values()),
+                           index_used=INDEX in plan)
+            data[name] = summary
+        summary = summarize(timed(lambda: overlap_slots(busiest, start, end), iterations))
+        summary.update(venues=1, slots=len(overlap_slots(busiest, start, end)))
+        data['free-slots-busiest-overlap'] = summary
+
+        # Past the last show, where the venue and the artist are both free
+        free_at = db.session.query(db.func.max(Show.end_time)).scalar() + timedelta(days=1)
+        artist_id = db.session.query(Show.artist_id).filter(Show.venue_id == busiest).limit(1).scalar()
+        taken = db.session.query(Show.start_time).\
+            filter(Show.venue_id == busiest, Show.start_time >= start).\
+            order_by(Show.start_time).\
+            limit(1).\
+            scalar()
+        db.session.rollback()
+        data['book'] = summarize(timed(booking(artist_id, busiest, free_at), iterations))
+        data['book-clash'] = summarize(timed(booking(artist_id, busiest, taken), iterations))
+        db.session.remove()
+    return data
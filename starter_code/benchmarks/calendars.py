@@ -0,0 +1,112 @@
+""" Calendar subscribers polling their iCalendar feeds every few minutes.
+
+Meant for a large data set, e.g. `generate --venues 10000 --artists 20000
+--shows 1000000`. Each subscriber follows one venue, artist or city feed,
+the busy ones more often, and polls it with the ETag of its last copy, as
+calendar apps do. The first pass subscribes every one of them; each later
+pass is one polling interval, after `changes` new shows were booked (which
+changes the feeds of their venue, artist and city). Requests go through the
+test client one at a time, so a pass's busy time over the interval is the
+share of one core that polling costs.
+"""
+import random
+import time
+from collections import Counter
+from datetime import timedelta, timezone
+from urllib.parse import urlencode
+
+from models import db, Artist, Show, Venue
+from benchmarks.datagen import popularity
+from benchmarks.harness import summarize
+
+
+SUBSCRIBERS = 10000
+INTERVAL = 300
+# Share of the subscribers following venue, artist and city feeds
+FEED_KINDS = (('venue', 0.45), ('artist', 0.45), ('city', 0.10))
+
+
+def feeds(app, rng, count):
+    """Feed paths of count subscribers."""
+    with app.app_context():
+        venue_ids = [venue_id for venue_id, in db.session.query(Venue.id).order_by(Venue.id)]
+        artist_ids = [artist_id for artist_id, in db.session.query(Artist.id).order_by(Artist.id)]
+        cities = db.session.query(Venue.city, Venue.state).\
+            group_by(Venue.city, Venue.state).\
+            order_by(db.func.count(Venue.id).desc(), Venue.state, Venue.city).\
+            all()
+        db.session.remove()
+    pools = {
+        'venue': (['/venues/{}/calendar.ics'.format(venue_id) for venue_id in venue_ids], popularity(len(venue_ids))),
+        'artist': (['/artists/{}/calendar.ics'.format(artist_id) for artist_id in artist_ids],
+                   popularity(len(artist_ids))),
+        'city': (['/shows/calendar.ics?' + urlencode({'city': city, 'state': state}) for city, state in cities],
+                 popularity(len(cities))),
+    }
+    kinds = rng.choices([kind for kind, _ in FEED_KINDS], weights=[share for _, share in FEED_KINDS], k=count)
+    return [rng.choices(pools[kind][0], cum_weights=pools[kind][1])[0] for kind in kinds]
+
+
+def book_changes(app, client, rng, count):
+    # New shows at popular venues with popular artists, after every booked one, through the form so the
+    # app clears the feeds they change
+    with app.app_context():
+        venue_ids = [venue_id for venue_id, in db.session.query(Venue.id).order_by(Venue.id)]
+        artist_ids = [artist_id for artist_id, in db.session.query(Artist.id).order_by(Artist.id)]
+        start = db.session.query(db.func.max(Show.end_time)).scalar().astimezone(timezone.utc)
+        db.session.remove()
+    venue_weights, artist_weights = popularity(len(venue_ids)), popularity(len(artist_ids))
+    booked = 0
+    for i in range(count):
+        response = client.post('/shows/create', data={
+            'artist_id': rng.choices(artist_ids, cum_weights=artist_weights)[0],
+            'venue_id': rng.choices(venue_ids, cum_weights=venue_weights)[0],
+            'start_time': (start + timedelta(hours=3 * (i + 1))).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        booked += response.status_code == 200
+    return booked
+
+
+def poll(client, paths, etags, interval):
+    """One pass over the subscribers; etags is updated in place."""
+    seconds = {200: [], 304: []}
+    statuses = Counter()
+    for subscriber, path in enumerate(paths):
+        headers = {'If-None-Match': etags[subscriber]} if subscriber in etags else None
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        statuses[response.status_code] += 1
+        seconds.setdefault(response.status_code, []).append(elapsed)
+        if response.status_code == 200:
+            etags[subscriber] = response.headers['ETag']
+    busy = sum(sum(values) for values in seconds.values())
+    summary = summarize([value for values in seconds.values() for value in values])
+    summary.update(
+        requests=len(paths),
+        feeds=len(set(paths)),
+        ok=statuses[200],
+        not_modified=statuses[304],
+        errors=sum(count for status, count in statuses.items() if status not in (200, 304)),
+        ok_p50_ms=summarize(seconds[200])['p50_ms'],
+        not_modified_p50_ms=summarize(seconds[304])['p50_ms'],
+        busy_seconds=round(busy, 3),
+        core_share=round(busy / interval, 4),
+    )
+    return summary
+
+
+def run(app, subscribers=SUBSCRIBERS, passes=3, changes=50, interval=INTERVAL, seed=0):
+    """{'subscribe': summary, 'poll-1': summary, ...}."""
+    rng = random.Random(seed)
+    paths = feeds(app, rng, subscribers)
+    rng.shuffle(paths)
+    client = app.test_client()
+    etags = {}
+    data = {'subscribe': poll(client, paths, etags, interval)}
+    for number in range(1, passes + 1):
+        booked = book_changes(app, client, rng, changes)
+        data['poll-{}'.format(number)] = summary = poll(client, paths, etags, interval)
+        summary['booked'] = booked
+    return data
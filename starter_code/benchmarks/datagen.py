@@ -0,0 +1,221 @@
+""" Deterministic synthetic data for the benchmarks.
+
+The same seed, counts and anchor always produce the same rows. Cities and
+genres follow a skewed popularity distribution, a few venues and artists get
+most of the shows, and shows start in the evening, more often at weekends,
+spread over the year before and the months after the anchor date. No two
+shows overlap at a venue or for an artist, as the exclusion constraints on
+Show require.
+"""
+import random
+from datetime import datetime, time, timedelta, timezone
+
+from booking import Schedule
+from counters import rebuild_show_counts
+from geo import encode, gazetteer, place_key
+from models import db, Artist, Show, Venue
+from validation import GENRE_NAMES
+
+
+# (city, state, relative weight)
+CITIES = (
+    ('New York', 'NY', 30), ('Los Angeles', 'CA', 18), ('San Francisco', 'CA', 12), ('Chicago', 'IL', 10),
+    ('Austin', 'TX', 8), ('Nashville', 'TN', 8), ('Seattle', 'WA', 6), ('New Orleans', 'LA', 6),
+    ('Portland', 'OR', 4), ('Denver', 'CO', 4), ('Atlanta', 'GA', 4), ('Boston', 'MA', 3),
+    ('Miami', 'FL', 3), ('Detroit', 'MI', 2), ('Minneapolis', 'MN', 2), ('Burlington', 'VT', 1),
+)
+
+GENRE_WEIGHTS = {
+    'Rock n Roll': 14, 'Pop': 12, 'Hip-Hop': 11, 'Alternative': 9, 'Jazz': 8, 'Electronic': 8, 'R&B': 7,
+    'Country': 6, 'Blues': 5, 'Folk': 5, 'Soul': 5, 'Punk': 4, 'Heavy Metal': 4, 'Funk': 3, 'Reggae': 3,
+    'Classical': 2, 'Instrumental': 2, 'Musical Theatre': 1, 'Other': 1,
+}
+GENRE_CHOICES = [genre for genre in GENRE_NAMES if genre in GENRE_WEIGHTS]
+
+ADJECTIVES = ('Velvet', 'Electric', 'Golden', 'Midnight', 'Crimson', 'Silver', 'Hollow', 'Neon', 'Wild',
+              'Blue', 'Rusty', 'Broken', 'Lucky', 'Paper', 'Copper', 'Quiet')
+NOUNS = ('Lounge', 'Room', 'Hall', 'Garage', 'Tavern', 'Loft', 'Cellar', 'Parlor', 'Stage', 'Factory')
+BANDS = ('Wolves', 'Echoes', 'Satellites', 'Rivers', 'Machines', 'Ghosts', 'Saints', 'Tigers', 'Lanterns',
+         'Comets', 'Strangers', 'Horses')
+STREETS = ('Main St', 'Market St', 'Broadway', 'Mission St', 'Elm Ave', 'Oak St', '2nd Ave', 'Union Sq')
+
+# Phone numbers are allocated from disjoint ranges so venues and artists never collide
+VENUE_PHONES = 2000000000
+ARTIST_PHONES = 6000000000
+
+SHOW_HOURS = (18, 19, 19, 20, 20, 20, 21, 21, 22, 23)
+SHOW_MINUTES = (60, 90, 120, 120, 180)
+
+# Draws per show before giving up on more shows than the venues and artists have evenings for
+MAX_DRAWS_PER_SHOW = 20
+
+# Venues are scattered around their city's centre with this standard deviation, in degrees (~9km)
+VENUE_SPREAD = 0.08
+
+
+def phone(base, index):
+    number = '{:010d}'.format(base + index)
+    return '{}-{}-{}'.format(number[:3], number[3:6], number[6:])
+
+
+def default_anchor():
+    """Midnight UTC today, so a day's runs see the same past/upcoming split."""
+    return datetime.combine(datetime.now(timezone.utc).date(), time(), timezone.utc)
+
+
+def popularity(count, skew=0.8):
+    # Zipf-like cumulative weights: the first ids are the busiest
+    total = 0.0
+    cumulative = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+class DataGenerator(object):
+    def __init__(self, seed=0, anchor=None):
+        self.seed = seed
+        self.anchor = anchor or default_anchor()
+        self.city_weights = [weight for _, _, weight in CITIES]
+        self.genre_weights = [GENRE_WEIGHTS[genre] for genre in GENRE_CHOICES]
+
+    def rng(self, kind):
+        # One stream per kind, so changing the number of venues doesn't reshuffle the artists
+        return random.Random('{}:{}'.format(self.seed, kind))
+
+    def genres(self, rng):
+        picked = []
+        for genre in rng.choices(GENRE_CHOICES, self.genre_weights, k=rng.choice((1, 1, 2, 2, 3))):
+            if genre not in picked:
+                picked.append(genre)
+        return picked
+
+    def entity(self, rng, index, kind):
+        city, state, _ = rng.choices(CITIES, self.city_weights)[0]
+        slug = '{}s/{}'.format(kind, index)
+        if kind == 'venue':
+            name = 'The {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS))
+        else:
+            name = '{} {}'.format(rng.choice(ADJECTIVES), rng.choice(BANDS))
+        seeking = rng.random() < 0.3
+        record = {
+            'name': '{} #{}'.format(name, index),
+            'city': city,
+            'state': state,
+            'address': '{} {}'.format(rng.randint(1, 2000), rng.choice(STREETS)),
+            'phone': phone(VENUE_PHONES if kind == 'venue' else ARTIST_PHONES, index),
+            'genres': self.genres(rng),
+            'image_link': 'https://images.fyyur.example/{}.jpg'.format(slug),
+            'website': 'https://fyyur.example/{}'.format(slug),
+            'facebook_link': 'https://www.facebook.com/fyyur.{}.{}'.format(kind, index),
+            'seeking_description': 'Looking for new {}!'.format('talent' if kind == 'venue' else 'venues')
+                                   if seeking else None,
+        }
+        record['seeking_talent' if kind == 'venue' else 'seeking_venue'] = seeking
+        return record
+
+    def locate(self, rng, record):
+        latitude, longitude = gazetteer()[place_key(record['city'], record['state'])]
+        latitude = round(latitude + rng.gauss(0, VENUE_SPREAD), 6)
+        longitude = round(longitude + rng.gauss(0, VENUE_SPREAD), 6)
+        return dict(record, latitude=latitude, longitude=longitude, geohash=encode(latitude, longitude))
+
+    def venues(self, count):
+        rng = self.rng('venues')
+        # Coordinates come from their own stream, so the other columns are the same as before they existed
+        places = self.rng('venue-locations')
+        return (self.locate(places, self.entity(rng, index, 'venue')) for index in range(count))
+
+    def artists(self, count):
+        rng = self.rng('artists')
+        return (self.entity(rng, index, 'artist') for index in range(count))
+
+    def start_time(self, rng):
+        # 60% of shows are in the past year, the rest in the next six months; Fridays and Saturdays are busiest
+        while True:
+            if rng.random() < 0.6:
+                day = -rng.randint(1, 365)
+            else:
+                day = rng.randint(0, 180)
+            date = self.anchor + timedelta(days=day)
+            if date.weekday() in (4, 5) or rng.random() < 0.5:
+                break
+        return date + timedelta(hours=rng.choice(SHOW_HOURS), minutes=rng.choice((0, 0, 30)))
+
+    def shows(self, count, venue_ids, artist_ids):
+        # A draw that clashes with a show already placed is dropped, so the busiest venues and
+        # artists fill up and the rest take the overflow
+        rng = self.rng('shows')
+        venue_weights = popularity(len(venue_ids))
+        artist_weights = popularity(len(artist_ids))
+        venues = Schedule()
+        artists = Schedule()
+        placed = 0
+        for _ in range(count * MAX_DRAWS_PER_SHOW):
+            if placed == count:
+                break
+            venue_id = rng.choices(venue_ids, cum_weights=venue_weights)[0]
+            artist_id = rng.choices(artist_ids, cum_weights=artist_weights)[0]
+            start_time = self.start_time(rng)
+            end_time = start_time + timedelta(minutes=rng.choice(SHOW_MINUTES))
+            if venues.clashes(venue_id, start_time, end_time) or not artists.book(artist_id, start_time, end_time):
+                continue
+            venues.book(venue_id, start_time, end_time)
+            placed += 1
+            yield {
+                'venue_id': venue_id,
+                'artist_id': artist_id,
+                'start_time': start_time,
+                'end_time': end_time,
+            }
+
+
+#----------------------------------------------------------------------------#
+# Loading.
+#----------------------------------------------------------------------------#
+
+def reset_schema():
+    """Drop and recreate every table. Only ever point this at a benchmark database."""
+    db.drop_all()
+    db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    db.session.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    db.session.commit()
+    db.create_all()
+
+
+def insert_batches(table, rows, batch_size=1000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert().values(batch))
+            batch = []
+    if batch:
+        db.session.execute(table.insert().values(batch))
+    db.session.commit()
+
+
+def populate(venues, artists, shows, seed=0, anchor=None):
+    """ Reset the schema and load a generated data set; returns its description.
+
+    Must run inside an app context bound to the benchmark database.
+    """
+    generator = DataGenerator(seed, anchor)
+    reset_schema()
+    insert_batches(Venue.__table__, generator.venues(venues))
+    insert_batches(Artist.__table__, generator.artists(artists))
+    venue_ids = [venue_id for venue_id, in db.session.query(Venue.id).order_by(Venue.id)]
+    artist_ids = [artist_id for artist_id, in db.session.query(Artist.id).order_by(Artist.id)]
+    insert_batches(Show.__table__, generator.shows(shows, venue_ids, artist_ids))
+    # Fewer than asked for if the venues and artists were fully booked
+    shows = db.session.query(db.func.count(Show.id)).scalar()
+    rebuild_show_counts()
+    db.session.remove()
+    # VACUUM also merges the GIN indexes' pending lists, which bulk inserts leave long and slow to search
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute('SET statement_timeout = 0')
+        connection.execute('VACUUM ANALYZE')
+        connection.execute('RESET statement_timeout')
+    return {'venues': venues, 'artists': artists, 'shows': shows, 'seed': seed,
+            'anchor': generator.anchor.isoformat()}
@@ -0,0 +1,112 @@
+""" Page weight and cold-start time, before and after `flask assets build`.
+
+Page weight fetches a page and every same-origin stylesheet, script and
+image it links, the way a browser with an empty cache would, accepting
+br and gzip; 'sources' links the individual static files, 'bundled' the
+built bundles. Cold start runs each sample in a fresh interpreter and
+times its first request, with templates compiled from source or loaded
+from precompiled bytecode.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.harness import summarize
+
+
+PAGES = ('/', '/venues')
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Conditional comments only load for old IE
+COMMENT = re.compile(r'<!--.*?-->', re.S)
+
+LINKED = re.compile(r'<(?:link|script|img)\b[^>]*?(?:href|src)="(/[^/"][^"]*)"')
+
+KINDS = {'.css': 'css', '.js': 'js', '.jpg': 'image', '.png': 'image', '.gif': 'image', '.svg': 'image'}
+
+# One sample: import the app, then time its first request
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from benchmarks.harness import bench_app
+app = bench_app(sys.argv[1])
+client = app.test_client()
+imported = time.perf_counter()
+status = client.get(sys.argv[2]).status_code
+first = time.perf_counter()
+client.get(sys.argv[2])
+second = time.perf_counter()
+print(json.dumps({'status': status, 'import': imported - started, 'first': first - imported,
+                  'second': second - first}))
+"""
+
+
+def page_weight(client, path):
+    """Requests and bytes transferred, by kind, to load path with an empty cache."""
+    response = client.get(path)
+    html = COMMENT.sub('', response.get_data(as_text=True))
+    weight = {'requests': 1, 'html_bytes': len(response.get_data()), 'css_bytes': 0, 'js_bytes': 0,
+              'image_bytes': 0, 'missing': 0}
+    for url in sorted(set(LINKED.findall(html))):
+        if not url.startswith('/static/'):
+            continue
+        asset = client.get(url, headers={'Accept-Encoding': 'br, gzip'})
+        weight['requests'] += 1
+        if asset.status_code != 200:
+            weight['missing'] += 1
+            continue
+        kind = KINDS.get(os.path.splitext(url.split('?')[0])[1], 'image')
+        weight[kind + '_bytes'] += len(asset.get_data())
+    weight['total_bytes'] = sum(value for key, value in weight.items() if key.endswith('_bytes'))
+    return weight
+
+
+def cold_starts(database_url, path, runs, bytecode_dir):
+    env = dict(os.environ, JINJA_BYTECODE_DIR=bytecode_dir, CACHE_TYPE='null', REQUEST_LOG='false')
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', CHILD, database_url, path], cwd=APP_DIR, env=env)
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    summary = summarize([sample['first'] for sample in samples])
+    summary['errors'] = sum(1 for sample in samples if sample['status'] != 200)
+    summary['import_ms'] = round(sorted(sample['import'] for sample in samples)[len(samples) // 2] * 1000, 3)
+    summary['warm_ms'] = round(sorted(sample['second'] for sample in samples)[len(samples) // 2] * 1000, 3)
+    return summary
+
+
+def run(app, database_url, runs=10, path='/venues'):
+    """ {'weight-<mode>-<page>': weight, 'cold-start-<mode>': summary}.
+
+    Builds the bundles first if static/dist/ has no manifest yet.
+    """
+    from assets import compile_templates
+
+    assets = app.extensions['assets']
+    if not assets.manifest:
+        assets.build()
+    data = {}
+    built = assets.manifest
+    client = app.test_client()
+    try:
+        for mode, manifest in (('sources', {}), ('bundled', built)):
+            assets.manifest = manifest
+            for page in PAGES:
+                name = 'weight-{}-{}'.format(mode, page.strip('/') or 'home')
+                data[name] = dict(page_weight(client, page), mode=mode, page=page)
+    finally:
+        assets.manifest = built
+
+    bytecode_cache = app.jinja_env.bytecode_cache
+    with tempfile.TemporaryDirectory() as bytecode_dir:
+        try:
+            compile_templates(app, bytecode_dir)
+        finally:
+            app.jinja_env.bytecode_cache = bytecode_cache
+        for mode, directory in (('source', ''), ('bytecode', bytecode_dir)):
+            data['cold-start-{}'.format(mode)] = dict(cold_starts(database_url, path, runs, directory),
+                                                     mode=mode, page=path)
+    return data
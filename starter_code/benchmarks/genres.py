@@ -0,0 +1,59 @@
+""" The genre filters and facets at scale, with their query plans.
+
+Meant for a large data set, e.g. `generate --venues 100000 --artists 100000`.
+Every filter is timed as a listing query and as a facet count, and EXPLAINed:
+the selective filters must be answered from the genre GIN indexes. A filter
+on a genre that most rows have may rightly be planned as a sequential scan,
+so those are reported but not required to use the index.
+"""
+import time
+
+from genres import genre_criteria, genre_facets
+from models import db, Artist, Venue
+from benchmarks.harness import plan_indexes, summarize
+
+
+# (name, match, genres, must use the index); see GENRE_WEIGHTS in datagen.py for how common each genre is
+FILTERS = (
+    ('rare', 'all', ['Musical Theatre'], True),
+    ('pair_all', 'all', ['Jazz', 'Blues'], True),
+    ('pair_any', 'any', ['Classical', 'Instrumental'], True),
+    ('common', 'all', ['Rock n Roll'], False),
+)
+
+MODELS = (('venues', Venue), ('artists', Artist))
+
+
+def facet_query(model, criteria):
+    # genre_facets() runs its query; this is the same statement, for EXPLAIN
+    tagged = db.session.query(db.func.unnest(model.genres).label('genre')).filter(*criteria).subquery()
+    return db.session.query(tagged.c.genre, db.func.count()).group_by(tagged.c.genre)
+
+
+def timed(func, iterations):
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run(app, iterations=20):
+    """{'<kind>_<filter>_<list|facets>': summary with the plan's index use}."""
+    data = {}
+    with app.app_context():
+        for kind, model in MODELS:
+            index = 'ix_{}_genres'.format(model.__tablename__)
+            for name, match, genres, required in FILTERS:
+                criteria = genre_criteria(model.genres, genres, match)
+                listing = db.session.query(model.id, model.name).filter(*criteria).order_by(model.id)
+                rows = listing.count()
+                for query, func in ((listing, listing.all), (facet_query(model, criteria),
+                                                             lambda: genre_facets(model, criteria))):
+                    func()
+                    summary = summarize(timed(func, iterations))
+                    summary.update(matches=rows, index_used=index in plan_indexes(query), index_required=required)
+                    data['{}_{}_{}'.format(kind, name, 'list' if query is listing else 'facets')] = summary
+        db.session.remove()
+    return data
@@ -0,0 +1,110 @@
+""" Shared setup and statistics for the micro-benchmarks and the load test."""
+import json
+import logging
+import math
+import re
+
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([0-9.]+);desc="([0-9]+) queries"')
+
+# Turns on the bulk import endpoint in the benchmark app
+BULK_API_TOKEN = 'benchmark'
+
+
+def bench_app(database_url, cache_type='null'):
+    """ The Fyyur app pointed at the benchmark database.
+
+    Replicas are switched off so every run measures the same single database,
+    and the per-request log lines are silenced; the Server-Timing header is
+    turned on because the query counts are read from it.
+    """
+    from app import app
+    from cache import cache
+    from routing import router
+
+    if database_url == app.config['SQLALCHEMY_DATABASE_URI']:
+        raise ValueError('The benchmark database must not be the one the app is configured with')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_url,
+        SQLALCHEMY_BINDS={},
+        WTF_CSRF_ENABLED=False,
+        CACHE_TYPE=cache_type,
+        BULK_API_TOKEN=BULK_API_TOKEN,
+    )
+    app.extensions['instrumentation'].server_timing = True
+    router.binds = ()
+    cache.init_app(app)
+    logging.getLogger('fyyur.requests').setLevel(logging.WARNING)
+    logging.getLogger('fyyur.slow_queries').setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    return app
+
+
+def query_stats(headers):
+    """(query count, SQL milliseconds) from a response's Server-Timing header."""
+    match = SERVER_TIMING_DB.search(headers.get('Server-Timing', ''))
+    if match is None:
+        return None, None
+    return int(match.group(2)), float(match.group(1))
+
+
+def plan_indexes(query):
+    """Names of the indexes the plan of a Query or Core statement reads."""
+    from models import db
+
+    statement = getattr(query, 'statement', query).compile(dialect=db.session.bind.dialect)
+    plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(statement), statement.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    names = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Index Name' in node:
+            names.add(node['Index Name'])
+        nodes.extend(node.get('Plans', ()))
+    return names
+
+
+def form_data(record):
+    data = {key: value for key, value in record.items() if key != 'genres' and value is not None}
+    for flag in ('seeking_talent', 'seeking_venue'):
+        if flag in data:
+            if data[flag]:
+                data[flag] = 'y'
+            else:
+                del data[flag]
+    data['genres'] = record['genres']
+    return data
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    index = max(int(math.ceil(fraction * len(ordered))) - 1, 0)
+    return ordered[index]
+
+
+def summarize(seconds, queries=(), rows=None):
+    """ Latency percentiles in milliseconds, plus the median query count.
+
+    rows is the number of records each sample processed, for throughput
+    benchmarks such as the bulk import.
+    """
+    ordered = sorted(seconds)
+    total = sum(ordered)
+    summary = {
+        'n': len(ordered),
+        'mean_ms': round(total / len(ordered) * 1000, 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 0.5) * 1000, 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None,
+    }
+    counted = sorted(count for count in queries if count is not None)
+    if counted:
+        summary['queries'] = percentile(counted, 0.5)
+    if rows and total:
+        summary['rows_per_second'] = round(rows * len(ordered) / total, 1)
+    return summary
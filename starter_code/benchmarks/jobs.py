@@ -0,0 +1,47 @@
+""" Throughput of the background job workers at different concurrency levels.
+
+Each level gets a fresh queue of identical jobs and a burst-mode worker pool
+that exits once the queue is drained, so the time measured is claiming,
+running and recording every job.
+"""
+import time
+
+from jobs import run_pool, task
+from models import db, Job
+from benchmarks.datagen import insert_batches
+
+
+@task('bench.work', max_attempts=1)
+def work(ms=0):
+    # ms of simulated I/O; with 0 only the queue's own overhead is measured
+    if ms:
+        time.sleep(ms / 1000.0)
+
+
+def fill_queue(jobs, ms):
+    db.session.query(Job).delete(synchronize_session=False)
+    insert_batches(Job.__table__, ({'name': 'bench.work', 'payload': {'ms': ms}, 'max_attempts': 1}
+                                   for _ in range(jobs)))
+
+
+def run(app, jobs, levels, ms=0):
+    """{'c<level>': summary} for each concurrency level."""
+    data = {}
+    for concurrency in levels:
+        with app.app_context():
+            fill_queue(jobs, ms)
+            started = time.perf_counter()
+            run_pool(app, concurrency, poll_interval=0.05, burst=True)
+            elapsed = time.perf_counter() - started
+            statuses = dict(db.session.query(Job.status, db.func.count()).group_by(Job.status))
+            db.session.query(Job).delete(synchronize_session=False)
+            db.session.commit()
+        done = statuses.pop('done', 0)
+        data['c{}'.format(concurrency)] = {
+            'concurrency': concurrency,
+            'n': done,
+            'errors': sum(statuses.values()),
+            'seconds': round(elapsed, 3),
+            'jobs_per_second': round(done / elapsed, 1),
+        }
+    return data
@@ -0,0 +1,175 @@
+""" Local load test: simulated users hitting a real HTTP server.
+
+The app is served by a threaded werkzeug server on a free local port, and
+each simulated user is a thread that keeps picking a weighted task (mostly
+browsing, some writes) until the run's duration is up, in the spirit of a
+locust task set. Per-task latencies, throughput, errors and the connection
+pool counters are reported.
+"""
+import http.client
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from benchmarks.datagen import DataGenerator, phone
+from benchmarks.harness import form_data, summarize
+
+
+# Phone numbers for venues created during load tests, clear of the micro-benchmark range
+LOAD_PHONES = 8500000000
+
+
+class Task(object):
+    def __init__(self, name, weight, method, path, data=None):
+        self.name = name
+        self.weight = weight
+        self.method = method
+        self.path = path
+        self.data = data
+
+    def request(self, rng):
+        path = self.path(rng) if callable(self.path) else self.path
+        data = self.data(rng) if callable(self.data) else self.data
+        return self.method, path, data
+
+
+def task_mix(app):
+    """Read-heavy mix of the site's pages with a few writes, weighted like real traffic."""
+    from models import db, Artist, Show, Venue
+
+    with app.app_context():
+        venue_ids = [venue_id for venue_id, in db.session.query(Venue.id)]
+        artist_ids = [artist_id for artist_id, in db.session.query(Artist.id)]
+        serial = db.session.query(db.func.max(Venue.id)).scalar()
+        # New shows go after every show already booked, so none is refused as a clash
+        booked_until = db.session.query(db.func.max(Show.end_time)).scalar() or datetime.now(timezone.utc)
+        db.session.remove()
+
+    counter = [serial]
+    show_counter = [0]
+    lock = threading.Lock()
+    sample = next(DataGenerator(seed=3).venues(1))
+
+    def venue(rng):
+        return '/venues/{}'.format(rng.choice(venue_ids))
+
+    def artist(rng):
+        return '/artists/{}'.format(rng.choice(artist_ids))
+
+    def new_venue(rng):
+        with lock:
+            counter[0] += 1
+            number = counter[0]
+        return form_data(dict(sample, phone=phone(LOAD_PHONES, number)))
+
+    def new_show(rng):
+        with lock:
+            show_counter[0] += 1
+            number = show_counter[0]
+        start_time = booked_until.astimezone(timezone.utc) + timedelta(hours=3 * number)
+        return {'artist_id': rng.choice(artist_ids), 'venue_id': rng.choice(venue_ids),
+                'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    return [
+        Task('venues', 15, 'GET', '/venues'),
+        Task('show_venue', 20, 'GET', venue),
+        Task('artists', 10, 'GET', '/artists'),
+        Task('show_artist', 20, 'GET', artist),
+        Task('shows', 12, 'GET', '/shows'),
+        Task('search_venues', 5, 'GET', lambda rng: '/venues/search?' + urlencode(
+            {'search_term': rng.choice(('Velvet', 'Neon', 'Lounge', 'New York, NY'))})),
+        Task('search_artists', 5, 'GET', lambda rng: '/artists/search?' + urlencode(
+            {'search_term': rng.choice(('Wolves', 'Golden', 'Jazz'))})),
+        Task('api_venues', 5, 'GET', '/api/v1/venues'),
+        Task('create_show', 5, 'POST', '/shows/create', new_show),
+        Task('create_venue', 3, 'POST', '/venues/create', new_venue),
+    ]
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, app):
+        super(ServerThread, self).__init__(daemon=True)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def user(port, tasks, seed, deadline, results, wait):
+    rng = random.Random(seed)
+    weights = [task.weight for task in tasks]
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    while time.monotonic() < deadline:
+        task = rng.choices(tasks, weights)[0]
+        method, path, data = task.request(rng)
+        body = urlencode(data, doseq=True) if data is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = None
+        elapsed = time.perf_counter() - start
+        connection.close()
+        samples[task.name].append(elapsed)
+        if status is None or status >= 400:
+            errors[task.name] += 1
+        if wait:
+            time.sleep(rng.uniform(0, wait))
+    results.append((samples, errors))
+
+
+def run(app, users=10, duration=30.0, seed=0, wait=0.0):
+    """Run the load test; returns per-task summaries, totals and the pool counters."""
+    from dbpool import pool_snapshots
+    from models import db
+
+    tasks = task_mix(app)
+    server = ServerThread(app)
+    server.start()
+    results = []
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(server.port, tasks, seed * 1000 + index, deadline, results, wait))
+               for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    for user_samples, user_errors in results:
+        for name, seconds in user_samples.items():
+            samples[name].extend(seconds)
+        for name, count in user_errors.items():
+            errors[name] += count
+
+    report = {}
+    for name, seconds in sorted(samples.items()):
+        report[name] = summarize(seconds)
+        report[name]['errors'] = errors[name]
+    everything = [value for seconds in samples.values() for value in seconds]
+    report['total'] = summarize(everything)
+    report['total']['errors'] = sum(errors.values())
+    report['total']['requests_per_second'] = round(len(everything) / elapsed, 1)
+
+    with app.app_context():
+        pools = pool_snapshots(db, app)
+    return {'tasks': report, 'pools': pools, 'users': users, 'duration': duration}
@@ -0,0 +1,201 @@
+""" Micro-benchmarks of every view, run in-process through the Flask test client.
+
+Each scenario is one request, repeated after a few warm-up rounds. Besides
+latency, the query count of every request is read from its Server-Timing
+header, so an added N+1 shows up even when the database is fast.
+"""
+import itertools
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.datagen import DataGenerator, phone
+from benchmarks.harness import BULK_API_TOKEN, form_data, query_stats, summarize
+
+
+# path and data may be callables taking the iteration number, so writes can use fresh values;
+# setup runs untimed before each iteration and its result is passed to path/data instead;
+# headers is a dict sent with every request, or 'etag' to revalidate
+Scenario = namedtuple('Scenario', ['name', 'method', 'path', 'data', 'headers', 'setup', 'rows', 'content_type'])
+Scenario.__new__.__defaults__ = (None, None, None, None, None)
+
+# Phone numbers for rows created by the write benchmarks, clear of the generated ranges
+WRITE_PHONES = 8000000000
+
+BULK_ROWS = 500
+
+
+def entity_form(model, entity_id):
+    from models import db
+    entity = db.session.query(model).get(entity_id)
+    record = {column.name: getattr(entity, column.name) for column in model.__table__.columns
+              if column.name not in ('id', 'updated_at')}
+    db.session.remove()
+    return form_data(record)
+
+
+def scenarios(app):
+    """The scenarios for the data currently in the benchmark database."""
+    from models import db, Artist, Show, Venue
+
+    with app.app_context():
+        # The generator gives the lowest ids the most shows: the heaviest detail pages
+        venue_id = db.session.query(db.func.min(Venue.id)).scalar()
+        artist_id = db.session.query(db.func.min(Artist.id)).scalar()
+        city, state = db.session.query(Venue.city, Venue.state).filter(Venue.id == venue_id).one()
+        # Fresh phone numbers for created rows, even when the database is reused between runs
+        serial = itertools.count(db.session.query(db.func.max(Venue.id)).scalar() +
+                                 db.session.query(db.func.max(Artist.id)).scalar())
+        venue_form = entity_form(Venue, venue_id)
+        artist_form = entity_form(Artist, artist_id)
+        # New shows go after every show already booked, three hours apart, so none is refused as a clash
+        booked_until = db.session.query(db.func.max(Show.end_time)).scalar() or datetime.now(timezone.utc)
+        db.session.remove()
+
+    generator = DataGenerator(seed=1)
+    sample_venue = next(generator.venues(1))
+    sample_artist = next(generator.artists(1))
+    show_slots = itertools.count(1)
+
+    def new_show(i):
+        start_time = booked_until.astimezone(timezone.utc) + timedelta(hours=3 * next(show_slots))
+        return {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    def new_venue(i):
+        return form_data(dict(sample_venue, phone=phone(WRITE_PHONES, next(serial))))
+
+    def new_artist(i):
+        return form_data(dict(sample_artist, phone=phone(WRITE_PHONES, next(serial))))
+
+    def created_venue(i):
+        with app.app_context():
+            venue = Venue(**dict(sample_venue, phone=phone(WRITE_PHONES, next(serial))))
+            db.session.add(venue)
+            db.session.commit()
+            created = venue.id
+            db.session.remove()
+        return created
+
+    def bulk_body(i):
+        records = [dict(record, phone=phone(WRITE_PHONES, next(serial)))
+                   for record in generator.venues(BULK_ROWS)]
+        return ''.join(json.dumps(record) + '\n' for record in records)
+
+    return [
+        Scenario('index', 'GET', '/'),
+        Scenario('venues', 'GET', '/venues'),
+        Scenario('venues_not_modified', 'GET', '/venues', headers='etag'),
+        Scenario('search_venues', 'GET', '/venues/search?search_term=Velvet'),
+        Scenario('search_venues_city', 'GET', '/venues/search?search_term={}, {}'.format(city, state)),
+        Scenario('show_venue', 'GET', '/venues/{}'.format(venue_id)),
+        Scenario('show_venue_not_modified', 'GET', '/venues/{}'.format(venue_id), headers='etag'),
+        Scenario('create_venue_form', 'GET', '/venues/create'),
+        Scenario('edit_venue', 'GET', '/venues/{}/edit'.format(venue_id)),
+        Scenario('venues_genre', 'GET', '/venues?genre=Jazz&genre=Blues'),
+        Scenario('artists', 'GET', '/artists'),
+        Scenario('artists_genre_any', 'GET', '/artists?genre=Classical&genre=Instrumental&match=any'),
+        Scenario('search_artists', 'GET', '/artists/search?search_term=Wolves'),
+        Scenario('show_artist', 'GET', '/artists/{}'.format(artist_id)),
+        Scenario('create_artist_form', 'GET', '/artists/create'),
+        Scenario('edit_artist', 'GET', '/artists/{}/edit'.format(artist_id)),
+        Scenario('shows', 'GET', '/shows'),
+        Scenario('shows_city', 'GET', '/shows?city={}'.format(city)),
+        Scenario('shows_genre', 'GET', '/shows?genre=Jazz'),
+        Scenario('create_shows', 'GET', '/shows/create'),
+        Scenario('venue_calendar', 'GET', '/venues/{}/calendar.ics'.format(venue_id)),
+        Scenario('venue_calendar_not_modified', 'GET', '/venues/{}/calendar.ics'.format(venue_id), headers='etag'),
+        Scenario('artist_calendar', 'GET', '/artists/{}/calendar.ics'.format(artist_id)),
+        Scenario('city_calendar', 'GET', '/shows/calendar.ics?city={}&state={}'.format(city, state)),
+        Scenario('api_venues', 'GET', '/api/v1/venues'),
+        Scenario('api_venue_genres', 'GET', '/api/v1/venues/genres?genre=Jazz'),
+        Scenario('api_venue', 'GET', '/api/v1/venues/{}'.format(venue_id)),
+        Scenario('api_shows', 'GET', '/api/v1/shows'),
+        Scenario('api_export_venues', 'GET', '/api/v1/venues/export'),
+        Scenario('not_found', 'GET', '/nope'),
+        Scenario('create_venue_submission', 'POST', '/venues/create', data=new_venue),
+        Scenario('edit_venue_submission', 'POST', '/venues/{}/edit'.format(venue_id), data=venue_form),
+        Scenario('delete_venue', 'POST', lambda created: '/venues/{}'.format(created), setup=created_venue),
+        Scenario('create_artist_submission', 'POST', '/artists/create', data=new_artist),
+        Scenario('edit_artist_submission', 'POST', '/artists/{}/edit'.format(artist_id), data=artist_form),
+        Scenario('create_show_submission', 'POST', '/shows/create', data=new_show),
+        Scenario('bulk_import_venues', 'POST', '/api/v1/bulk/venues', data=bulk_body, rows=BULK_ROWS,
+                 content_type='application/x-ndjson', headers={'Authorization': 'Bearer ' + BULK_API_TOKEN}),
+    ]
+
+
+def resolve(value, argument):
+    return value(argument) if callable(value) else value
+
+
+def run_scenario(client, scenario, iterations, warmup):
+    headers = scenario.headers
+    if headers == 'etag':
+        # Revalidate with the ETag of a full response, as a browser would
+        etag = client.open(resolve(scenario.path, None), method=scenario.method).headers.get('ETag')
+        headers = {'If-None-Match': etag} if etag else None
+
+    seconds = []
+    queries = []
+    statuses = set()
+    for i in range(warmup + iterations):
+        argument = scenario.setup(i) if scenario.setup else i
+        kwargs = {'method': scenario.method, 'headers': headers}
+        if scenario.data is not None:
+            kwargs['data'] = resolve(scenario.data, argument)
+            if scenario.content_type:
+                kwargs['content_type'] = scenario.content_type
+        path = resolve(scenario.path, argument)
+
+        start = time.perf_counter()
+        response = client.open(path, **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+
+        if i >= warmup:
+            seconds.append(elapsed)
+            queries.append(query_stats(response.headers)[0])
+            statuses.add(response.status_code)
+    summary = summarize(seconds, queries, scenario.rows)
+    summary['status'] = sorted(statuses)
+    return summary
+
+
+def function_benchmarks(iterations):
+    """Per-call costs of the helpers every request or import goes through."""
+    from app import format_datetime
+    from validation import venue_validator
+
+    records = list(DataGenerator(seed=2).venues(1000))
+    results = {}
+
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for _ in venue_validator.validate_many(records):
+            pass
+        seconds.append(time.perf_counter() - start)
+    results['validate_venues'] = summarize(seconds, rows=len(records))
+
+    stamp = datetime(2026, 5, 21, 21, 30, tzinfo=timezone.utc)
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for _ in range(100):
+            format_datetime(stamp, 'full')
+        seconds.append(time.perf_counter() - start)
+    results['format_datetime'] = summarize(seconds, rows=100)
+    return results
+
+
+def run(app, iterations=50, warmup=5, only=None):
+    """Run every scenario (or those named in only); returns name -> summary."""
+    client = app.test_client()
+    results = {}
+    for scenario in scenarios(app):
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = run_scenario(client, scenario, iterations, warmup)
+    if not only:
+        results.update(function_benchmarks(iterations))
+    return results
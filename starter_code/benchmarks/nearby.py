@@ -0,0 +1,70 @@
+""" Radius searches for upcoming shows, against a full scan of the same query.
+
+Meant for `generate --venues 1000000`. Searches are made around a dense,
+a middling and a small city and in an empty spot, at several radii. Each
+one is timed, and EXPLAINed to check that the venues come from the geohash
+index. For comparison, the scan query applies the same distance filter
+without the geohash cells.
+"""
+import time
+from datetime import datetime, timezone
+
+from geo import distance_km, gazetteer, nearby_query, nearby_shows, place_key
+from models import db, Show, Venue
+from benchmarks.harness import plan_indexes, summarize
+
+
+PLACES = (
+    ('new_york', place_key('New York', 'NY')),
+    ('denver', place_key('Denver', 'CO')),
+    ('burlington', place_key('Burlington', 'VT')),
+)
+# Central Nevada: no venues for hundreds of kilometres
+NOWHERE = (39.0, -117.0)
+
+RADII_KM = (5, 25, 100)
+
+PAGE = 30
+
+
+def points():
+    places = gazetteer()
+    return [(name, places[key]) for name, key in PLACES] + [('nowhere', NOWHERE)]
+
+
+def scan_query(latitude, longitude, radius_km, start):
+    distance = distance_km(latitude, longitude)
+    return db.session.query(Show.id, distance).\
+        join(Venue, Show.venue_id == Venue.id).\
+        filter(distance <= radius_km, Show.start_time >= start).\
+        order_by(distance, Show.start_time, Show.id).\
+        limit(PAGE)
+
+
+def timed(func, iterations):
+    func()
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run(app, iterations=20, scan_iterations=3):
+    """{'<place>_<radius>km': summary, plus '<place>_<radius>km_scan' for the largest radius}."""
+    data = {}
+    now = datetime.now(timezone.utc)
+    with app.app_context():
+        for name, (latitude, longitude) in points():
+            for radius in RADII_KM:
+                shows = nearby_shows(latitude, longitude, radius, now, limit=PAGE)
+                summary = summarize(timed(lambda: nearby_shows(latitude, longitude, radius, now, limit=PAGE),
+                                          iterations))
+                query = nearby_query(latitude, longitude, radius, now).limit(PAGE)
+                summary.update(found=len(shows), index_used='ix_Venue_geohash' in plan_indexes(query))
+                data['{}_{}km'.format(name, radius)] = summary
+            scan = scan_query(latitude, longitude, RADII_KM[-1], now)
+            data['{}_{}km_scan'.format(name, RADII_KM[-1])] = summarize(timed(scan.all, scan_iterations))
+        db.session.remove()
+    return data
@@ -0,0 +1,86 @@
+""" Storing benchmark runs as JSON and comparing them."""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# A scenario regresses when its p50 or p95 grows by more than this fraction...
+LATENCY_TOLERANCE = 0.2
+# ...and by at least this many milliseconds, so sub-millisecond jitter isn't flagged
+LATENCY_FLOOR_MS = 1.0
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(kind, results, parameters, path=None):
+    """Write one run to path (by default results/<kind>-<timestamp>.json) and return the path."""
+    now = datetime.now(timezone.utc)
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, '{}-{}.json'.format(kind, now.strftime('%Y%m%dT%H%M%S')))
+    document = {
+        'kind': kind,
+        'created': now.isoformat(),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return path
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def scenario_results(document):
+    # Load test runs nest their per-task numbers one level down
+    results = document['results']
+    return results.get('tasks', results) if document.get('kind') == 'load' else results
+
+
+def compare(baseline, current, tolerance=LATENCY_TOLERANCE, floor_ms=LATENCY_FLOOR_MS):
+    """ Regressions of current against baseline, as human-readable strings.
+
+    Latency regresses when p50 or p95 is both more than tolerance slower
+    (relative) and at least floor_ms slower (absolute). Any increase in a
+    scenario's query count or error count is a regression, as is a drop in
+    import, job, row or snapshot page throughput, or a growth in page weight
+    or peak memory, of more than tolerance.
+    """
+    regressions = []
+    before = scenario_results(baseline)
+    after = scenario_results(current)
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        for key in ('p50_ms', 'p95_ms'):
+            if old.get(key) is None or new.get(key) is None:
+                continue
+            if new[key] > old[key] * (1 + tolerance) and new[key] - old[key] >= floor_ms:
+                regressions.append('{}: {} {:.2f}ms -> {:.2f}ms'.format(name, key, old[key], new[key]))
+        for key in ('queries', 'errors'):
+            if key in old and key in new and new[key] > old[key]:
+                regressions.append('{}: {} {} -> {}'.format(name, key, old[key], new[key]))
+        for key, unit in (('rows_per_second', 'rows/s'), ('jobs_per_second', 'jobs/s'),
+                          ('pages_per_second', 'pages/s')):
+            if key in old and key in new and new[key] < old[key] / (1 + tolerance):
+                regressions.append('{}: {} {} -> {}'.format(name, unit, old[key], new[key]))
+        for key in ('total_bytes', 'peak_bytes'):
+            if key in old and key in new and new[key] > old[key] * (1 + tolerance):
+                regressions.append('{}: {} {} -> {}'.format(name, key, old[key], new[key]))
+    return regressions
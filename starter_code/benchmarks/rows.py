@@ -0,0 +1,152 @@
+""" Loading 100k rows for the listing pages: entities, column rows and read models.
+
+Meant for a large data set, e.g. `generate --venues 100000 --artists 100000
+--shows 100000`. Each scenario loads the first `rows` artists, venues or
+shows the way a version of the view did: 'entities' as mapped objects,
+'columns' as the Query's keyed tuples (with the dicts the templates were
+given), 'readmodel' through readmodels.py. Rows/s comes from timed passes;
+the memory a request needs is the tracemalloc peak of one more pass, taken
+apart from the timing since tracing slows everything down.
+"""
+import time
+import tracemalloc
+from itertools import groupby
+
+from sqlalchemy.orm import joinedload
+
+from models import db, Artist, Show, Venue, VenueShowCount
+from readmodels import ShowTile, artist_items, fetch, show_tile_query, venue_areas
+from benchmarks.harness import summarize
+
+
+ROWS = 100000
+
+
+def artist_entities(last_id):
+    return Artist.query.filter(Artist.id <= last_id).all()
+
+
+def artist_columns(last_id):
+    return db.session.query(Artist.id, Artist.name).filter(Artist.id <= last_id).all()
+
+
+def artist_readmodel(last_id):
+    return artist_items([Artist.id <= last_id])
+
+
+def venue_entities(last_id):
+    rows = db.session.query(Venue, db.func.coalesce(VenueShowCount.upcoming_shows_count, 0)).\
+        outerjoin(VenueShowCount, VenueShowCount.venue_id == Venue.id).\
+        filter(Venue.id <= last_id).\
+        order_by(Venue.state, Venue.city, Venue.id).\
+        all()
+    return [{
+        'city': city,
+        'state': state,
+        'venues': [{
+            'id': venue.id,
+            'name': venue.name,
+            'num_upcoming_shows': upcoming
+        } for venue, upcoming in venues]
+    } for (city, state), venues in groupby(rows, key=lambda row: (row[0].city, row[0].state))]
+
+
+def venue_columns(last_id):
+    # venues() before the read models
+    rows = db.session.query(
+        Venue.city,
+        Venue.state,
+        Venue.id,
+        Venue.name,
+        db.func.coalesce(VenueShowCount.upcoming_shows_count, 0).label('num_upcoming_shows')
+        ).\
+        outerjoin(VenueShowCount, VenueShowCount.venue_id == Venue.id).\
+        filter(Venue.id <= last_id).\
+        order_by(Venue.state, Venue.city, Venue.id).\
+        all()
+    return [{
+        'city': city,
+        'state': state,
+        'venues': [{
+            'id': venue.id,
+            'name': venue.name,
+            'num_upcoming_shows': venue.num_upcoming_shows
+        } for venue in venues]
+    } for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state))]
+
+
+def venue_readmodel(last_id):
+    return venue_areas([Venue.id <= last_id])
+
+
+def show_entities(last_id):
+    return Show.query.options(joinedload(Show.venue), joinedload(Show.artist)).\
+        filter(Show.id <= last_id).\
+        order_by(Show.start_time, Show.id).\
+        all()
+
+
+def show_columns(last_id):
+    return show_tile_query().filter(Show.id <= last_id).order_by(Show.start_time, Show.id).all()
+
+
+def show_readmodel(last_id):
+    return fetch(ShowTile, show_tile_query().filter(Show.id <= last_id).order_by(Show.start_time, Show.id))
+
+
+SCENARIOS = {
+    'artists-entities': (Artist, artist_entities),
+    'artists-columns': (Artist, artist_columns),
+    'artists-readmodel': (Artist, artist_readmodel),
+    'venues-entities': (Venue, venue_entities),
+    'venues-columns': (Venue, venue_columns),
+    'venues-readmodel': (Venue, venue_readmodel),
+    'shows-entities': (Show, show_entities),
+    'shows-columns': (Show, show_columns),
+    'shows-readmodel': (Show, show_readmodel),
+}
+
+
+def nth_id(model, rows):
+    """The id of the rows-th row, so `id <= nth_id` selects the first rows rows."""
+    last_id = db.session.query(model.id).order_by(model.id).offset(rows - 1).limit(1).scalar()
+    if last_id is None:
+        last_id = db.session.query(db.func.max(model.id)).scalar() or 0
+    return last_id
+
+
+def peak_bytes(load, last_id):
+    # Like a request: a fresh session, and the result released before the session ends
+    tracemalloc.start()
+    try:
+        load(last_id)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        db.session.remove()
+
+
+def run(app, iterations=5, rows=ROWS, only=()):
+    """{scenario: summary with rows_per_second and peak_bytes}."""
+    data = {}
+    with app.app_context():
+        for name, (model, load) in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            last_id = nth_id(model, rows)
+            count = db.session.query(db.func.count(model.id)).filter(model.id <= last_id).scalar()
+            db.session.remove()
+            load(last_id)
+            db.session.remove()
+            seconds = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                load(last_id)
+                seconds.append(time.perf_counter() - started)
+                db.session.remove()
+            summary = summarize(seconds, rows=count)
+            summary['rows'] = count
+            summary['peak_bytes'] = peak_bytes(load, last_id)
+            summary['bytes_per_row'] = round(summary['peak_bytes'] / count, 1) if count else None
+            data[name] = summary
+    return data
@@ -0,0 +1,134 @@
+""" /shows as the Show table grows: response time and memory must stay flat.
+
+Generates one data set with the largest number of shows asked for (500k by
+default; this resets the benchmark database), then measures the same /shows
+requests at each size, deleting the last generated shows to shrink the
+table in between. The database role must be allowed to CHECKPOINT (a
+superuser, or pg_checkpoint on Postgres 15 and later). The first page, a
+page halfway through the table (by its keyset cursor), and the city, genre
+and date range filters are each timed, and the tracemalloc peak of one more
+request is taken apart from the timing.
+
+A scenario fails when a request doesn't answer 200, or is not flat: when,
+from the smallest size to the largest, its p50 grows by more than the
+tolerance and by at least LATENCY_FLOOR_MS, or its peak memory grows by more
+than the tolerance.
+"""
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from counters import rebuild_show_counts
+from models import db, Show, Venue
+from pagination import encode_show_cursor
+from benchmarks.datagen import populate
+from benchmarks.harness import summarize
+
+
+SIZES = (50000, 500000)
+
+# Allowed growth of p50 and peak memory from the smallest size to the largest...
+TOLERANCE = 0.5
+# ...with p50 also growing by at least this many milliseconds. Reading the whole table costs far more at
+# 500k shows (a count of the shows took some 40ms), while the timings of a single CPU jitter by a few ms
+LATENCY_FLOOR_MS = 5.0
+
+
+def request_paths(anchor):
+    """name -> /shows URL for the data currently in the database."""
+    total = db.session.query(db.func.count(Show.id)).scalar()
+    middle = db.session.query(Show.start_time, Show.id).order_by(Show.start_time, Show.id).\
+        offset(total // 2).limit(1).one()
+    city, = db.session.query(Venue.city).order_by(Venue.id).first()
+    db.session.remove()
+    queries = {
+        'first_page': {},
+        'middle_page': {'after': encode_show_cursor(*middle)},
+        'city': {'city': city},
+        'genre': {'genre': 'Jazz'},
+        'date_range': {'from': anchor.date().isoformat(), 'to': (anchor + timedelta(days=7)).date().isoformat()},
+    }
+    return {name: '/shows?' + urlencode(args) if args else '/shows' for name, args in queries.items()}
+
+
+def shrink(shows):
+    """Delete the last generated shows, down to shows rows; returns the number left."""
+    last_id = db.session.query(Show.id).order_by(Show.id).offset(shows - 1).limit(1).scalar()
+    if last_id is not None:
+        db.session.query(Show).filter(Show.id > last_id).delete(synchronize_session=False)
+        db.session.commit()
+        rebuild_show_counts()
+    left = db.session.query(db.func.count(Show.id)).scalar()
+    db.session.remove()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute('VACUUM ANALYZE "Show"')
+        # Flush the writes now rather than in a background checkpoint during the timing
+        connection.execute('CHECKPOINT')
+    return left
+
+
+def peak_bytes(client, path):
+    tracemalloc.start()
+    try:
+        client.get(path).get_data()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(client, path, iterations, warmup):
+    seconds = []
+    statuses = set()
+    for i in range(warmup + iterations):
+        start = time.perf_counter()
+        response = client.get(path)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            seconds.append(elapsed)
+            statuses.add(response.status_code)
+    summary = summarize(seconds)
+    summary.update(status=sorted(statuses), peak_bytes=peak_bytes(client, path))
+    return summary
+
+
+def flatness(data, tolerance=TOLERANCE):
+    """ Scenarios whose latency or memory grew with the table, as human-readable strings.
+
+    data is run()'s result; the smallest and the largest sizes are compared.
+    """
+    sizes = sorted(data['sizes'], key=int)
+    smallest, largest = data['sizes'][sizes[0]], data['sizes'][sizes[-1]]
+    problems = []
+    for name in sorted(set(smallest) & set(largest)):
+        old, new = smallest[name], largest[name]
+        if old['status'] != [200] or new['status'] != [200]:
+            problems.append('{}: status {} at {} shows, {} at {} shows'.format(
+                name, old['status'], sizes[0], new['status'], sizes[-1]))
+        if new['p50_ms'] > old['p50_ms'] * (1 + tolerance) and new['p50_ms'] - old['p50_ms'] >= LATENCY_FLOOR_MS:
+            problems.append('{}: p50 {:.2f}ms at {} shows -> {:.2f}ms at {} shows'.format(
+                name, old['p50_ms'], sizes[0], new['p50_ms'], sizes[-1]))
+        if new['peak_bytes'] > old['peak_bytes'] * (1 + tolerance):
+            problems.append('{}: peak {} bytes at {} shows -> {} bytes at {} shows'.format(
+                name, old['peak_bytes'], sizes[0], new['peak_bytes'], sizes[-1]))
+    return problems
+
+
+def run(app, sizes=SIZES, venues=1000, artists=2000, iterations=20, warmup=3, seed=0):
+    """ {'sizes': {shows: {scenario: summary with peak_bytes}}, 'generated': the data set's description}.
+
+    The keys of 'sizes' are the numbers of shows actually in the table, which
+    can be fewer than asked for when the venues and artists are fully booked.
+    """
+    client = app.test_client()
+    data = {'sizes': {}}
+    with app.app_context():
+        data['generated'] = populate(venues, artists, max(sizes), seed)
+        anchor = datetime.fromisoformat(data['generated']['anchor'])
+        for size in sorted(sizes, reverse=True):
+            shows = shrink(size)
+            paths = request_paths(anchor)
+            data['sizes'][str(shows)] = {name: measure(client, path, iterations, warmup)
+                                         for name, path in paths.items()}
+    return data
@@ -0,0 +1,81 @@
+""" Venue and artist search over a large name set, with its query plans.
+
+Meant for a million names or so, e.g. `generate --venues 100000 --artists
+900000`. Every kind of term is timed through search_entities() and
+EXPLAINed: name and city terms must be answered from the trigram indexes and
+"City, ST" terms from the (state, city) index. The same searches are then
+timed on the SQLite FTS5 fallback, loaded with the same names.
+"""
+import time
+
+from models import db, Artist, Venue
+from search import SqliteSearchIndex, search_criteria, search_entities
+from benchmarks.harness import plan_indexes, summarize
+
+
+MODELS = (('venues', Venue), ('artists', Artist))
+
+# Rows per batch when loading the SQLite index
+LOAD_BATCH_SIZE = 10000
+
+
+def terms(model):
+    """(name, term, indexes of which the plan must read one) for the data in the benchmark database."""
+    name, city, state = db.session.query(model.name, model.city, model.state).order_by(model.id).first()
+    word = max(name.split(), key=len)
+    table = model.__tablename__
+    return (
+        ('name_word', word, {'ix_{}_name_trgm'.format(table)}),
+        ('name_prefix', word[:3], {'ix_{}_name_trgm'.format(table)}),
+        ('city', city, {'ix_{}_city_trgm'.format(table)}),
+        ('city_state', '{}, {}'.format(city, state), {'ix_{}_state_city'.format(table)}),
+        ('state', state, None),
+        ('genre', 'Jazz', None),
+        ('no_match', 'Qxzvbj', {'ix_{}_name_trgm'.format(table)}),
+    )
+
+
+def timed(func, iterations):
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def sqlite_index(model):
+    index = SqliteSearchIndex()
+    query = db.session.query(model.id, model.name, model.city, model.state, model.genres).\
+        order_by(model.id).\
+        yield_per(LOAD_BATCH_SIZE)
+    start = time.perf_counter()
+    index.add(query)
+    return index, time.perf_counter() - start
+
+
+def run(app, iterations=20, sqlite=True):
+    """{'<kind>_<term>': summary with the plan's index use, and '<kind>_<term>_sqlite' for the fallback}."""
+    data = {}
+    with app.app_context():
+        for kind, model in MODELS:
+            rows = db.session.query(db.func.count(model.id)).scalar()
+            cases = terms(model)
+            for name, term, indexes in cases:
+                criteria, order = search_criteria(model, term)
+                plan = plan_indexes(db.session.query(model.id).filter(criteria).order_by(*order).limit(20))
+                matches = search_entities(model, term)[1]
+                summary = summarize(timed(lambda: search_entities(model, term), iterations))
+                summary.update(term=term, matches=matches, names=rows,
+                               index_used=indexes is None or bool(plan & indexes))
+                data['{}_{}'.format(kind, name)] = summary
+            if not sqlite:
+                continue
+            index, load_seconds = sqlite_index(model)
+            for name, term, indexes in cases:
+                summary = summarize(timed(lambda: index.search(term), iterations))
+                summary.update(term=term, matches=index.search(term)[1], names=rows,
+                               load_seconds=round(load_seconds, 3))
+                data['{}_{}_sqlite'.format(kind, name)] = summary
+        db.session.remove()
+    return data
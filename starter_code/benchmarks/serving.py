@@ -0,0 +1,107 @@
+""" The serving modes side by side: dev server, threaded gunicorn and gevent.
+
+Each mode runs as its own server process against the benchmark database and
+is driven by the load test's simulated users, browsing tasks only, at each
+concurrency level. The numbers therefore include the HTTP server, unlike the
+micro-benchmarks. The dev server is `app.run()` as in app.py, without the
+debugger.
+"""
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.harness import summarize
+from benchmarks.load import task_mix, user
+
+
+MODES = ('dev', 'threaded', 'gevent')
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'dev':
+        return [sys.executable, '-c',
+                'from app import app; app.run(port={}, debug=False, use_reloader=False)'.format(port)]
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{}'.format(port),
+            '--worker-class', 'gevent' if mode == 'gevent' else 'gthread',
+            '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning', 'wsgi:app']
+
+
+def server_env(database_url):
+    # The same settings bench_app applies in-process: one database, no cache, quiet logs
+    env = dict(os.environ, DATABASE_URL=database_url, DATABASE_REPLICA_URL='', CACHE_TYPE='null',
+               REQUEST_LOG='false', SERVER_TIMING='false')
+    env.pop('ACCESS_LOG', None)
+    return env
+
+
+def wait_until_up(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited with {}'.format(process.returncode))
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Server did not come up on port {}'.format(port))
+
+
+def drive(port, tasks, clients, duration, seed):
+    results = []
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(port, tasks, seed * 1000 + index, deadline, results, 0.0))
+               for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = []
+    errors = 0
+    for user_samples, user_errors in results:
+        for seconds in user_samples.values():
+            samples.extend(seconds)
+        errors += sum(user_errors.values())
+    summary = summarize(samples)
+    summary['errors'] = errors
+    summary['requests_per_second'] = round(len(samples) / elapsed, 1)
+    return summary
+
+
+def run(app, database_url, modes=MODES, levels=(1, 8, 64), duration=10.0, workers=1, threads=8, seed=0):
+    """{'<mode>-c<clients>': summary} for every mode and concurrency level."""
+    tasks = [task for task in task_mix(app) if task.method == 'GET']
+    data = {}
+    for mode in modes:
+        port = free_port()
+        process = subprocess.Popen(server_command(mode, port, workers, threads), cwd=APP_DIR,
+                                   env=server_env(database_url), stdout=subprocess.DEVNULL)
+        try:
+            wait_until_up(port, process)
+            for clients in levels:
+                data['{}-c{}'.format(mode, clients)] = dict(drive(port, tasks, clients, duration, seed),
+                                                            mode=mode, clients=clients)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+    return data
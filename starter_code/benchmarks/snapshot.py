@@ -0,0 +1,42 @@
+""" Static snapshot builds: a full build, then the rebuild after one show changes.
+
+Meant for a large data set, e.g. `generate --venues 10000 --artists 20000
+--shows 1000000`. For each worker count, every page is rendered into a fresh
+directory, then one show's end time is moved a minute earlier and the
+incremental build that follows is timed, change detection included. It
+re-renders the show's venue and artist pages and the listings whose
+versions moved.
+"""
+import shutil
+import tempfile
+from datetime import timedelta
+
+from snapshot import build
+from models import db, Show
+
+
+def change_show(app):
+    # The same show every time, so each level's rebuild has the same pages to redo
+    with app.app_context():
+        show = db.session.query(Show).order_by(Show.id).first()
+        show.end_time -= timedelta(minutes=1)
+        db.session.commit()
+        db.session.remove()
+
+
+def run(app, levels):
+    """{'full-w<level>': summary, 'incremental-w<level>': summary} for each worker count."""
+    data = {}
+    for workers in levels:
+        directory = tempfile.mkdtemp(prefix='fyyur-snapshot-')
+        try:
+            with app.app_context():
+                data['full-w{}'.format(workers)] = build(app, directory, workers)
+                db.session.remove()
+            change_show(app)
+            with app.app_context():
+                data['incremental-w{}'.format(workers)] = build(app, directory, workers)
+                db.session.remove()
+        finally:
+            shutil.rmtree(directory)
+    return data
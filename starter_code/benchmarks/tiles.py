@@ -0,0 +1,92 @@
+""" Rendering pages/shows.html with 10k show tiles, to time the `datetime` filter.
+
+'babel' is the filter as it was: dateutil for strings, then
+babel.dates.format_datetime on every tile. 'compiled' is dates.py with its
+memos emptied before each render, 'memoized' with them kept, and 'no-dates'
+renders the times unformatted, the floor for the rest of the template. The
+'-strings' scenarios pass the start times as ISO 8601 strings. No database
+is needed.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import babel.dates
+import dateutil.parser
+from flask import render_template
+
+import dates
+from benchmarks.harness import summarize
+
+
+TILES = 10000
+
+
+def babel_filter(value, format='medium'):
+    if isinstance(value, datetime):
+        date = value
+    else:
+        date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def show_tiles(count, seed=0, strings=False):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    shows = []
+    for index in range(count):
+        start_time = start + timedelta(minutes=30 * rng.randrange(0, 365 * 48))
+        shows.append({
+            'venue_id': index % 500 + 1,
+            'venue_name': 'Venue {}'.format(index % 500 + 1),
+            'artist_id': index % 700 + 1,
+            'artist_name': 'Artist {}'.format(index % 700 + 1),
+            'artist_image_link': 'https://example.com/artists/{}.jpg'.format(index % 700 + 1),
+            'start_time': start_time.isoformat() if strings else start_time,
+        })
+    return shows
+
+
+SCENARIOS = {
+    # name: (filter, empty the memos before each render, ISO strings)
+    'babel': (babel_filter, False, False),
+    'compiled': (dates.format_datetime, True, False),
+    'memoized': (dates.format_datetime, False, False),
+    'no-dates': (lambda value, format='medium': value, False, False),
+    'babel-strings': (babel_filter, False, True),
+    'compiled-strings': (dates.format_datetime, True, True),
+}
+
+
+def run(app, iterations=10, warmup=2, tiles=TILES, only=()):
+    """{scenario: summary} with each sample one render of `tiles` tiles."""
+    data = {}
+    original = app.jinja_env.filters['datetime']
+    try:
+        for name, (date_filter, cold, strings) in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            shows = show_tiles(tiles, strings=strings)
+            app.jinja_env.filters['datetime'] = date_filter
+            # Compiled templates may hold on to the filter they were built with
+            app.jinja_env.cache.clear()
+            samples = []
+            with app.test_request_context('/shows'):
+                for iteration in range(warmup + iterations):
+                    if cold:
+                        dates.clear_memos()
+                    started = time.perf_counter()
+                    render_template('pages/shows.html', shows=shows, next_url=None)
+                    if iteration >= warmup:
+                        samples.append(time.perf_counter() - started)
+            summary = summarize(samples)
+            summary['us_per_tile'] = round(summary['p50_ms'] * 1000 / tiles, 3)
+            data[name] = summary
+    finally:
+        app.jinja_env.filters['datetime'] = original
+        app.jinja_env.cache.clear()
+    return data
@@ -0,0 +1,199 @@
+""" Booking shows without double-booking a venue or an artist.
+
+A show occupies [start_time, end_time). The exclusion constraints on Show
+(see models.py) refuse a show that overlaps another at the same venue or
+with the same artist, so concurrent bookings can't both get in; book_show()
+inserts with ON CONFLICT DO NOTHING and explains a refusal by looking up
+the show it clashed with.
+
+Because a venue's shows never overlap, the one show that can be running at
+the start of a window is the last to start before it. free_slots() reads
+that show and the shows starting inside the window from the
+(venue_id, start_time) index: O(log n + k) per venue for k shows in the
+window, however many shows the venue has.
+
+Schedule does the same checks in memory, for loaders that place many
+shows before writing any of them (see benchmarks/datagen.py).
+"""
+from bisect import bisect_right, insort
+from collections import namedtuple
+from datetime import timedelta
+from itertools import groupby
+
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from models import db, Artist, Show, Venue, DEFAULT_SHOW_DURATION
+
+
+Slot = namedtuple('Slot', ['start', 'end'])
+
+
+class BookingError(ValueError):
+    """ A show that can't be booked.
+
+    errors maps a field to a message, like validate_show()'s errors.
+    """
+
+    def __init__(self, errors):
+        super(BookingError, self).__init__('; '.join(errors.values()))
+        self.errors = errors
+
+
+def during(start, end):
+    return db.func.tstzrange(start, end)
+
+
+def overlapping(column, value, start, end):
+    # Written as the exclusion constraint's expression, so its GiST index answers it
+    return db.session.query(Show.id, Show.start_time, Show.end_time).\
+        filter(column == value, during(Show.start_time, Show.end_time).op('&&')(during(start, end))).\
+        order_by(Show.start_time).\
+        first()
+
+
+def clash_errors(artist_id, venue_id, start_time, end_time):
+    errors = {}
+    for field, column, value, owner in (('venue_id', Show.venue_id, venue_id, 'The venue'),
+                                        ('artist_id', Show.artist_id, artist_id, 'The artist')):
+        show = overlapping(column, value, start_time, end_time)
+        if show is not None:
+            errors[field] = '{} is already booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M} (show {}).'.format(
+                owner, show.start_time, show.end_time, show.id)
+    # The clashing show may have been deleted in the meantime
+    return errors or {'start_time': 'The venue or the artist is already booked at that time.'}
+
+
+def book_show(artist_id, venue_id, start_time, end_time=None):
+    """ Insert a show in the caller's transaction and return its id.
+
+    Raises BookingError for an unknown artist or venue, or when either is
+    already booked for part of [start_time, end_time). end_time defaults to
+    DEFAULT_SHOW_DURATION after start_time.
+    """
+    if end_time is None:
+        end_time = start_time + DEFAULT_SHOW_DURATION
+    if end_time <= start_time:
+        raise BookingError({'end_time': 'The show must end after it starts.'})
+    artist_known, venue_known = db.session.query(
+        db.session.query(Artist.id).filter(Artist.id == artist_id).exists(),
+        db.session.query(Venue.id).filter(Venue.id == venue_id).exists()
+        ).one()
+    errors = {}
+    if not artist_known:
+        errors['artist_id'] = 'Unknown artist.'
+    if not venue_known:
+        errors['venue_id'] = 'Unknown venue.'
+    if errors:
+        raise BookingError(errors)
+
+    statement = insert(Show.__table__).\
+        values(artist_id=artist_id, venue_id=venue_id, start_time=start_time, end_time=end_time).\
+        on_conflict_do_nothing().\
+        returning(Show.id)
+    show_id = db.session.execute(statement).scalar()
+    if show_id is None:
+        raise BookingError(clash_errors(artist_id, venue_id, start_time, end_time))
+    return show_id
+
+
+#----------------------------------------------------------------------------#
+# Free slots.
+#----------------------------------------------------------------------------#
+
+def gaps(bookings, start, end, min_length):
+    """ The Slots of at least min_length between start and end not covered by bookings.
+
+    bookings are (start, end) pairs sorted by start that don't overlap each other.
+    """
+    slots = []
+    free_from = start
+    for booked_start, booked_end in bookings:
+        if booked_start - free_from >= min_length:
+            slots.append(Slot(free_from, booked_start))
+        free_from = max(free_from, booked_end)
+    if end - free_from >= min_length:
+        slots.append(Slot(free_from, end))
+    return slots
+
+
+def month_window(moment):
+    """[start, end) of the calendar month moment falls in, in moment's time zone."""
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def busy_times():
+    """ (venue_id, start_time, end_time) of the shows that may cover part of [:start, :end) at :venue_ids.
+
+    Each known venue gets a first row for the last show to start before the
+    window, with NULL times when there is none, then a row per show starting
+    inside it, in start_time order.
+    """
+    venue_ids = db.bindparam('venue_ids', type_=ARRAY(db.Integer))
+    start = db.bindparam('start', type_=db.DateTime(timezone=True))
+    end = db.bindparam('end', type_=db.DateTime(timezone=True))
+    last = db.select([Show.start_time, Show.end_time]).\
+        where(db.and_(Show.venue_id == Venue.id, Show.start_time < start)).\
+        order_by(Show.start_time.desc()).\
+        limit(1).\
+        lateral()
+    before = db.select([Venue.id.label('venue_id'), last.c.start_time, last.c.end_time]).\
+        select_from(Venue.__table__.outerjoin(last, db.true())).\
+        where(Venue.id == db.any_(venue_ids))
+    inside = db.select([Show.venue_id, Show.start_time, Show.end_time]).\
+        where(db.and_(Show.venue_id == db.any_(venue_ids), Show.start_time >= start, Show.start_time < end))
+    busy = db.union_all(before, inside).alias()
+    return db.select([busy]).order_by(busy.c.venue_id, busy.c.start_time.nullsfirst())
+
+
+# Compiling the statement takes longer than Postgres takes to run it, so it is built and compiled once;
+# the venue ids are an array parameter so that any number of them shares the compiled form
+BUSY_TIMES = busy_times()
+compiled_statements = {}
+
+
+def free_slots(venue_ids, start, end, min_length=DEFAULT_SHOW_DURATION):
+    """ {venue_id: [Slot]} of the free time of each venue between start and end, in one query.
+
+    Unknown venues are left out.
+    """
+    slots = {}
+    connection = db.session.connection().execution_options(compiled_cache=compiled_statements)
+    rows = connection.execute(BUSY_TIMES, venue_ids=list(venue_ids), start=start, end=end).fetchall()
+    for venue_id, bookings in groupby(rows, key=lambda row: row[0]):
+        slots[venue_id] = gaps([(row[1], row[2]) for row in bookings if row[1] is not None], start, end, min_length)
+    return slots
+
+
+#----------------------------------------------------------------------------#
+# In memory.
+#----------------------------------------------------------------------------#
+
+class Schedule(object):
+    """ Bookings per key (a venue or an artist id), checked in memory.
+
+    A key's bookings never overlap, so kept sorted by start they are also
+    sorted by end, and a clash is found with one bisection; an interval tree
+    is only needed for intervals that may overlap each other.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def clashes(self, key, start, end):
+        ends = self.ends.get(key)
+        if not ends:
+            return False
+        # The first booking still running at start is the only one that can reach into [start, end)
+        index = bisect_right(ends, start)
+        return index < len(ends) and self.starts[key][index] < end
+
+    def book(self, key, start, end):
+        """Add [start, end) to key's bookings unless it clashes with one; returns whether it did."""
+        if self.clashes(key, start, end):
+            return False
+        insort(self.starts.setdefault(key, []), start)
+        insort(self.ends.setdefault(key, []), end)
+        return True
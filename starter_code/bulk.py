@@ -0,0 +1,240 @@
+import csv
+import io
+import json
+import re
+from collections import Counter, namedtuple
+
+import click
+import psycopg2.extensions
+from flask.cli import with_appcontext
+from psycopg2.extras import execute_values
+
+from cache import cache
+from counters import count_new_shows
+from geo import coordinates
+from models import db, Artist, Show, Venue
+from validation import venue_validator, artist_validator, validate_show
+
+
+ENTITIES = {
+    'venues': (Venue, venue_validator),
+    'artists': (Artist, artist_validator),
+}
+KINDS = ('venues', 'artists', 'shows')
+
+DEFAULT_BATCH_SIZE = 1000
+
+ImportResult = namedtuple('ImportResult', ['inserted', 'rejected'])
+
+# Backslash escapes of COPY's text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_SPECIAL = re.compile(r'[\\\t\n\r]')
+
+# A line the reader couldn't parse, rejected by import_records() with the rest of the bad rows
+Malformed = namedtuple('Malformed', ['text', 'error'])
+
+
+#----------------------------------------------------------------------------#
+# Readers.
+#----------------------------------------------------------------------------#
+
+def read_csv(stream):
+    return csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield Malformed(line, 'Invalid JSON: {}.'.format(error))
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+#----------------------------------------------------------------------------#
+# Loading.
+#----------------------------------------------------------------------------#
+
+def copy_value(value):
+    """value in COPY's text format."""
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES) if COPY_SPECIAL.search(value) else value
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        # An array literal, in which backslashes and quotes are escaped before COPY's own escapes
+        items = ('"{}"'.format(item.replace('\\', '\\\\').replace('"', '\\"')) for item in value)
+        return copy_value('{{{}}}'.format(','.join(items)))
+    return copy_value(str(value))
+
+
+def staged_insert(table, rows, returning, conflict=None):
+    """ INSERT rows into table, skipping those that conflict; returns the returning columns of the rows inserted.
+
+    The rows are COPYed into a temporary table and inserted from there with
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING: rendering and parsing a
+    multi-row VALUES list costs several times more than the insert itself.
+    """
+    names = list(rows[0])
+    columns = ', '.join('"{}"'.format(name) for name in names)
+    db.session.execute('CREATE TEMPORARY TABLE bulk_staging ON COMMIT DROP AS SELECT {} FROM "{}" WITH NO DATA'.format(
+        columns, table.name))
+    with db.session.connection().connection.cursor() as cursor:
+        if psycopg2.extensions.get_wait_callback() is None:
+            data = ''.join('\t'.join([copy_value(row[name]) for name in names]) + '\n' for row in rows)
+            cursor.copy_expert('COPY bulk_staging ({}) FROM STDIN'.format(columns), io.StringIO(data))
+        else:
+            # psycopg2 can't COPY with a wait callback set, as under gevent (see dbpool.py)
+            execute_values(cursor, 'INSERT INTO bulk_staging ({}) VALUES %s'.format(columns),
+                           [tuple(row[name] for name in names) for row in rows], page_size=len(rows))
+    on_conflict = 'ON CONFLICT ({}) DO NOTHING'.format(conflict) if conflict else 'ON CONFLICT DO NOTHING'
+    return db.session.execute('INSERT INTO "{0}" ({1}) SELECT {1} FROM bulk_staging {2} RETURNING {3}'.format(
+        table.name, columns, on_conflict, ', '.join('"{}"'.format(name) for name in returning))).fetchall()
+
+
+def insert_entities(model, batch):
+    """ Insert a batch of venue/artist rows with staged_insert().
+
+    Rows whose phone number is already taken are skipped by ON CONFLICT and
+    returned so they can be rejected. Venues are geocoded on the way in.
+    """
+    rows = [row for line, row in batch]
+    if model is Venue:
+        # Many venues share a city
+        places = {}
+        for row in rows:
+            place = row['city'], row['state']
+            if place not in places:
+                places[place] = coordinates(*place)
+        rows = [dict(row, **places[row['city'], row['state']]) for row in rows]
+    inserted = {phone for phone, in staged_insert(model.__table__, rows, ['phone'], 'phone')}
+    rejected = []
+    for line, row in batch:
+        if row['phone'] in inserted:
+            inserted.discard(row['phone'])
+        else:
+            rejected.append((line, row, {'phone': 'Phone number already listed.'}))
+    return len(batch) - len(rejected), rejected
+
+
+def insert_shows(batch):
+    # Check both foreign keys for the whole batch up front so one bad id can't abort the INSERT
+    artist_ids = {row['artist_id'] for line, row in batch}
+    venue_ids = {row['venue_id'] for line, row in batch}
+    known_artists = {artist_id for artist_id, in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids))}
+    known_venues = {venue_id for venue_id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+
+    rows = []
+    rejected = []
+    for line, row in batch:
+        errors = {}
+        if row['artist_id'] not in known_artists:
+            errors['artist_id'] = 'Unknown artist.'
+        if row['venue_id'] not in known_venues:
+            errors['venue_id'] = 'Unknown venue.'
+        if errors:
+            rejected.append((line, row, errors))
+        else:
+            rows.append((line, row))
+    if not rows:
+        return 0, rejected
+    # Shows that overlap another at the same venue or with the same artist, already booked or earlier
+    # in the batch, are skipped by the exclusion constraints (see booking.py) and rejected here
+    returned = staged_insert(Show.__table__, [row for line, row in rows], ['id', 'venue_id', 'artist_id', 'start_time'])
+    inserted = Counter()
+    show_ids = []
+    for show_id, venue_id, artist_id, start_time in returned:
+        inserted[venue_id, artist_id, start_time] += 1
+        show_ids.append(show_id)
+    count_new_shows(show_ids)
+    for line, row in rows:
+        key = row['venue_id'], row['artist_id'], row['start_time']
+        if inserted[key]:
+            inserted[key] -= 1
+        else:
+            rejected.append((line, row, {'start_time': 'The venue or the artist is already booked at that time.'}))
+    return len(show_ids), rejected
+
+
+def import_records(kind, records, reject, batch_size=DEFAULT_BATCH_SIZE):
+    """ Validate and insert an iterable of raw records of the given kind.
+
+    Rows are inserted and committed in batches of batch_size. Every rejected
+    row is passed to reject(line, record, errors), line being its 1-based
+    position in the input; lines the reader couldn't parse and records that
+    aren't objects are rejected too, and the import goes on.
+    """
+    model, validator = ENTITIES.get(kind, (Show, None))
+    validate = validator.validate if validator is not None else validate_show
+    inserted = rejected = 0
+    batch = []
+
+    def flush():
+        if validator is not None:
+            count, failures = insert_entities(model, batch)
+        else:
+            count, failures = insert_shows(batch)
+        db.session.commit()
+        for line, row, errors in failures:
+            reject(line, row, errors)
+        del batch[:]
+        return count, len(failures)
+
+    try:
+        for line, record in enumerate(records, 1):
+            if isinstance(record, Malformed):
+                record, errors = record.text, {'record': record.error}
+            elif not isinstance(record, dict):
+                errors = {'record': 'Not an object.'}
+            else:
+                row, errors = validate(record)
+            if errors:
+                reject(line, record, errors)
+                rejected += 1
+                continue
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                count, failures = flush()
+                inserted += count
+                rejected += failures
+        if batch:
+            count, failures = flush()
+            inserted += count
+            rejected += failures
+    finally:
+        # A bulk load can touch any number of pages, so start the page cache over; batches
+        # committed before an error in the input stay in
+        if inserted:
+            cache.clear()
+    return ImportResult(inserted, rejected)
+
+
+def reject_writer(stream):
+    """Reject callback that writes one NDJSON line per rejected row."""
+    def reject(line, record, errors):
+        stream.write(json.dumps({'line': line, 'record': record, 'errors': errors}, default=str) + '\n')
+    return reject
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(READERS)),
+              help='Input format; guessed from the file extension when omitted.')
+@click.option('--rejects', type=click.File('w', encoding='utf-8'), default='rejects.ndjson',
+              show_default=True, help='Where rejected rows and their errors are written.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+@with_appcontext
+def import_command(kind, source, fmt, rejects, batch_size):
+    """Bulk load venues, artists or shows from a CSV or NDJSON file."""
+    if fmt is None:
+        fmt = 'csv' if source.name.endswith('.csv') else 'ndjson'
+    result = import_records(kind, READERS[fmt](source), reject_writer(rejects), batch_size)
+    click.echo('Inserted {} {}, rejected {} (see {}).'.format(result.inserted, kind, result.rejected, rejects.name))
@@ -0,0 +1,395 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, g, make_response, request, session
+
+from dates import default_display, display_settings
+from models import db, Artist, Show, ShowCountClock, Venue
+
+
+def sizeof(value):
+    """Approximate the memory cost of a cached value in bytes."""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class NullCache(object):
+    """Backend that never stores anything, for disabling the cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete_many(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(object):
+    """ In-process cache with least-recently-used eviction.
+
+    Entries expire after their timeout (in seconds), and the least recently
+    used entries are evicted whenever the total size of the cached values goes
+    over max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_timeout=300):
+        self.max_bytes = max_bytes
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, timeout=None):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (timeout or self.default_timeout)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, expires, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def delete_many(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+class FileSystemCache(object):
+    """ Cache shared between worker processes through a directory of pickles.
+
+    Each key is stored in its own file, written to a temporary file first and
+    then renamed, so readers never see a partial entry.
+    """
+
+    def __init__(self, directory, default_timeout=300):
+        self.directory = directory
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        if expires <= time.time():
+            self.delete_many(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + (timeout or self.default_timeout)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def delete_many(self, *keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            # Another process may be clearing too, or renaming its temporary file into place
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+class Cache(object):
+    """ Read-through cache for query results and rendered pages.
+
+    The backend is picked from the CACHE_TYPE config value: 'filesystem' for
+    a cache shared through CACHE_DIR, 'simple' for the in-process LRU, or
+    'null' to turn caching off. Invalidation deletes entries, so every
+    process that writes must share the cache for the others to see it.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        kind = config.get('CACHE_TYPE', 'simple')
+        timeout = config.get('CACHE_DEFAULT_TIMEOUT', 300)
+        if kind == 'filesystem':
+            self.backend = FileSystemCache(config['CACHE_DIR'], timeout)
+        elif kind == 'null':
+            self.backend = NullCache()
+        else:
+            self.backend = LRUCache(config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024), timeout)
+        app.extensions['cache'] = self
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, timeout)
+
+    def delete_many(self, *keys):
+        self.backend.delete_many(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_or_set(self, key, func, timeout=None):
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value, timeout)
+        return value
+
+    @property
+    def shared(self):
+        """Whether other processes, such as the job workers, see what this one stores."""
+        return isinstance(self.backend, FileSystemCache)
+
+    def stats(self):
+        return {'hits': self.backend.hits, 'misses': self.backend.misses}
+
+    def cached_page(self, key):
+        """ Cache the rendered body of a GET view under key.
+
+        key is formatted with the view arguments, e.g. 'venue:{venue_id}'.
+        Under conditional_get() the body is stored with the version it was
+        rendered at and only served for that version, so a page never goes
+        out with an ETag newer than its content. Requests with a query string,
+        a pending flash message or their own locale or time zone for dates
+        bypass the cache, as do responses other than 200.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if request.args or session.get('_flashes') or not default_display():
+                    return view(**kwargs)
+                cache_key = page_key(key.format(**kwargs))
+                version = tuple(g.version) if 'version' in g else None
+                cached = self.get(cache_key)
+                if cached is not None and cached[0] == version:
+                    return make_response(cached[1])
+                response = make_response(view(**kwargs))
+                if response.status_code == 200:
+                    self.set(cache_key, (version, response.get_data()))
+                return response
+            return wrapper
+        return decorator
+
+
+def page_key(name):
+    return 'page:' + name
+
+
+def calendar_key(name):
+    """Cache key of an iCalendar feed, e.g. 'venue:1'; see calendars.py."""
+    return 'calendar:' + name
+
+
+def city_calendar_key(city, state):
+    return calendar_key('city:{}:{}'.format(state, city))
+
+
+def venue_page_keys(venue_id):
+    """ Pages that show a venue: its own page, the listing and its artists' pages.
+
+    With the calendars of the venue, of its artists and of its city.
+    """
+    keys = [page_key('venues'), page_key('venue:{}'.format(venue_id)), calendar_key('venue:{}'.format(venue_id))]
+    artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+    for artist_id, in artist_ids:
+        keys.extend((page_key('artist:{}'.format(artist_id)), calendar_key('artist:{}'.format(artist_id))))
+    keys.extend(city_calendar_key(city, state) for city, state in
+                db.session.query(Venue.city, Venue.state).filter(Venue.id == venue_id))
+    return keys
+
+
+def artist_page_keys(artist_id):
+    """ Pages that show an artist: its own page, the listing and its venues' pages.
+
+    With the calendars of the artist, of its venues and of their cities.
+    """
+    keys = [page_key('artists'), page_key('artist:{}'.format(artist_id)), calendar_key('artist:{}'.format(artist_id))]
+    venues = db.session.query(Show.venue_id, Venue.city, Venue.state).\
+        join(Venue, Show.venue_id == Venue.id).\
+        filter(Show.artist_id == artist_id).\
+        distinct()
+    for venue_id, city, state in venues:
+        keys.extend((page_key('venue:{}'.format(venue_id)), calendar_key('venue:{}'.format(venue_id)),
+                     city_calendar_key(city, state)))
+    return keys
+
+
+def show_page_keys(artist_id, venue_id):
+    """ A new show changes both detail pages and the venue listing's upcoming count.
+
+    And the calendars of its venue, its artist and the venue's city.
+    """
+    keys = [
+        page_key('venues'),
+        page_key('venue:{}'.format(venue_id)),
+        page_key('artist:{}'.format(artist_id)),
+        calendar_key('venue:{}'.format(venue_id)),
+        calendar_key('artist:{}'.format(artist_id))
+    ]
+    keys.extend(city_calendar_key(city, state) for city, state in
+                db.session.query(Venue.city, Venue.state).filter(Venue.id == venue_id))
+    return keys
+
+
+def conditional_get(version):
+    """ Answer conditional GETs with 304 before the view runs.
+
+    version is called with the view arguments and returns a tuple of
+    aggregates that changes whenever the rendered page would, containing at
+    least one datetime. The ETag hashes that tuple with the request path,
+    query string and date display settings, and Last-Modified is the newest
+    datetime in it. The view finds the tuple in g.version.
+    Requests with a pending flash message always get the full page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if session.get('_flashes'):
+                return view(**kwargs)
+            state = g.version = version(**kwargs)
+            etag = hashlib.sha1((repr(state) + request.full_path + repr(display_settings())).encode('utf-8')).hexdigest()
+            stamps = [value for value in state if isinstance(value, datetime)]
+            last_modified = max(stamps).replace(microsecond=0) if stamps else None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and last_modified and last_modified <= since)
+
+            response = Response(status=304) if not_modified else make_response(view(**kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified:
+                    response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def last_show_started():
+    """Latest start_time that has passed; pages change when a show moves from upcoming to past."""
+    return db.func.max(db.case([(Show.start_time < datetime.now(timezone.utc), Show.start_time)]))
+
+
+def venue_version(venue_id):
+    return db.session.query(
+        db.func.max(Venue.updated_at),
+        db.func.max(Show.updated_at),
+        db.func.max(Artist.updated_at),
+        db.func.count(Show.id),
+        last_show_started()
+        ).\
+        select_from(Venue).\
+        outerjoin(Show, Show.venue_id == Venue.id).\
+        outerjoin(Artist, Show.artist_id == Artist.id).\
+        filter(Venue.id == venue_id).\
+        one()
+
+
+def artist_version(artist_id):
+    return db.session.query(
+        db.func.max(Artist.updated_at),
+        db.func.max(Show.updated_at),
+        db.func.max(Venue.updated_at),
+        db.func.count(Show.id),
+        last_show_started()
+        ).\
+        select_from(Artist).\
+        outerjoin(Show, Show.artist_id == Artist.id).\
+        outerjoin(Venue, Show.venue_id == Venue.id).\
+        filter(Artist.id == artist_id).\
+        one()
+
+
+# The app never deletes a show: deleting its venue sets venue_id to NULL, which bumps updated_at. So the
+# listings need no count of shows, which would scan the whole table on every request as it grows
+
+def venues_version():
+    # The listing's upcoming counts only change with new shows or when a roll of the counters moves some
+    return db.session.query(
+        db.session.query(db.func.max(Venue.updated_at)).as_scalar(),
+        db.session.query(db.func.count(Venue.id)).as_scalar(),
+        db.session.query(db.func.max(Show.updated_at)).as_scalar(),
+        db.session.query(ShowCountClock.changed_at).as_scalar()
+        ).\
+        one()
+
+
+def artists_version():
+    return db.session.query(db.func.max(Artist.updated_at), db.func.count(Artist.id)).one()
+
+
+def shows_version():
+    return db.session.query(
+        db.session.query(db.func.max(Show.updated_at)).as_scalar(),
+        db.session.query(db.func.max(Venue.updated_at)).as_scalar(),
+        db.session.query(db.func.max(Artist.updated_at)).as_scalar()
+        ).\
+        one()
+
+
+cache = Cache()
@@ -0,0 +1,262 @@
+""" iCalendar feeds of the shows at a venue, by an artist or in a city.
+
+A venue or artist feed lists the shows from FEED_PAST_DAYS before today on,
+a city feed those of the next CITY_FEED_DAYS. Each feed is cached as one
+entry, (version, body): its version is an aggregate over its shows and the
+venues and artists they name, and conditional_get() answers a poll with a
+current ETag from the cached version without touching the database. The
+write paths delete the entries of the feeds they change (see
+venue_page_keys() and friends in cache.py); the next poll recomputes the
+version, and the body is rebuilt, by streaming the shows from the
+(venue_id, start_time) or (artist_id, start_time) index, only if the
+version moved.
+"""
+from datetime import datetime, time, timedelta, timezone
+
+from flask import Response, abort, current_app, g, request, stream_with_context
+
+from cache import cache, calendar_key, city_calendar_key
+from models import db, Artist, Show, Venue
+
+
+# Shows that started more than this many days ago drop out of the venue and artist feeds
+FEED_PAST_DAYS = 30
+# A big city books thousands of shows a month, so its feed only looks this many days ahead
+CITY_FEED_DAYS = 14
+
+# Rows fetched per round trip, and events per chunk sent, while a feed is built
+FEED_BATCH_SIZE = 1000
+
+PRODID = '-//Fyyur//Shows//EN'
+FOOTER = b'END:VCALENDAR\r\n'
+
+
+#----------------------------------------------------------------------------#
+# iCalendar text.
+#----------------------------------------------------------------------------#
+
+def escape(text):
+    # TEXT values (RFC 5545 3.3.11)
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').\
+        replace('\n', '\\n')
+
+
+def fold(line):
+    """ The content line as CRLF-terminated UTF-8, folded into lines of at most 75 octets (RFC 5545 3.1).
+
+    Lines are only broken between characters.
+    """
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return data + b'\r\n'
+    parts = []
+    start, limit = 0, 75
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        # Continuation lines start with a space, which counts towards their 75 octets
+        start, limit = end, 74
+    parts.append(data[start:])
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def utc_stamp(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def header(name):
+    return b''.join((
+        b'BEGIN:VCALENDAR\r\n',
+        b'VERSION:2.0\r\n',
+        fold('PRODID:' + PRODID),
+        b'CALSCALE:GREGORIAN\r\n',
+        b'METHOD:PUBLISH\r\n',
+        fold('X-WR-CALNAME:' + escape(name)),
+    ))
+
+
+def event(row, host, url_root):
+    show_id, start_time, end_time, updated_at, venue_id, venue_name, address, city, state, artist_name = row
+    return b''.join((
+        b'BEGIN:VEVENT\r\n',
+        fold('UID:show-{}@{}'.format(show_id, host)),
+        'DTSTAMP:{}\r\nDTSTART:{}\r\nDTEND:{}\r\n'.format(
+            utc_stamp(updated_at), utc_stamp(start_time), utc_stamp(end_time)).encode('ascii'),
+        fold('SUMMARY:' + escape('{} at {}'.format(artist_name, venue_name))),
+        fold('LOCATION:' + escape('{}, {}, {}, {}'.format(venue_name, address, city, state))),
+        fold('URL:{}venues/{}'.format(url_root, venue_id)),
+        b'END:VEVENT\r\n',
+    ))
+
+
+#----------------------------------------------------------------------------#
+# Versions.
+#----------------------------------------------------------------------------#
+
+def feed_window(days_ahead=None):
+    """ [start, end) of the shows in a feed; end is None for no limit.
+
+    Both move at midnight UTC, so a feed's window changes once a day. Without
+    days_ahead, the window starts FEED_PAST_DAYS ago; otherwise today.
+    """
+    today = datetime.combine(datetime.now(timezone.utc).date(), time(), timezone.utc)
+    if days_ahead is None:
+        return today - timedelta(days=FEED_PAST_DAYS), None
+    return today, today + timedelta(days=days_ahead)
+
+
+def in_window(start, end):
+    criteria = [Show.start_time >= start]
+    if end is not None:
+        criteria.append(Show.start_time < end)
+    return criteria
+
+
+def feed_version(model, criteria, start, end):
+    """ (window start date, newest updated_at of the model rows matching criteria, count and newest
+    updated_at of their shows in [start, end), newest updated_at of the other side of those shows).
+
+    The second value is None when no row matches. The window start is a date so that
+    conditional_get() takes Last-Modified from the rows only.
+    """
+    if model is Venue:
+        other, owner_id, other_id = Artist, Show.venue_id, Show.artist_id
+    else:
+        other, owner_id, other_id = Venue, Show.artist_id, Show.venue_id
+    # A lookup per show: the shows are few next to the other table, which a join would scan whole
+    other_updated_at = db.select([other.updated_at]).where(other.id == other_id).as_scalar()
+    row = db.session.query(
+        db.func.max(model.updated_at),
+        db.func.count(Show.id),
+        db.func.max(Show.updated_at),
+        db.func.max(other_updated_at)
+        ).\
+        select_from(model).\
+        outerjoin(Show, db.and_(owner_id == model.id, *in_window(start, end))).\
+        filter(*criteria).\
+        one()
+    return (start.date(),) + tuple(row)
+
+
+def cached_version(key, start, compute):
+    # The version the cached feed was built from, unless a writer deleted it or the window has moved since
+    cached = cache.get(key)
+    if cached is not None and cached[0][0] == start.date():
+        return cached[0]
+    return compute()
+
+
+def venue_feed_version(venue_id):
+    start, end = feed_window()
+    return cached_version(calendar_key('venue:{}'.format(venue_id)), start,
+                          lambda: feed_version(Venue, [Venue.id == venue_id], start, end))
+
+
+def artist_feed_version(artist_id):
+    start, end = feed_window()
+    return cached_version(calendar_key('artist:{}'.format(artist_id)), start,
+                          lambda: feed_version(Artist, [Artist.id == artist_id], start, end))
+
+
+def requested_city():
+    city, state = request.args.get('city', '').strip(), request.args.get('state', '').strip()
+    if not city or not state:
+        abort(400)
+    return city, state
+
+
+def city_feed_version():
+    city, state = requested_city()
+    start, end = feed_window(CITY_FEED_DAYS)
+    return cached_version(city_calendar_key(city, state), start,
+                          lambda: feed_version(Venue, [Venue.city == city, Venue.state == state], start, end))
+
+
+#----------------------------------------------------------------------------#
+# Feeds.
+#----------------------------------------------------------------------------#
+
+def events_query(version, criteria, days_ahead=None):
+    # The window the version was computed for, even if midnight has passed since
+    start = datetime.combine(version[0], time(), timezone.utc)
+    end = start + timedelta(days=days_ahead) if days_ahead is not None else None
+    return db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.end_time,
+        Show.updated_at,
+        Show.venue_id,
+        Venue.name,
+        Venue.address,
+        Venue.city,
+        Venue.state,
+        Artist.name
+        ).\
+        join(Venue, Show.venue_id == Venue.id).\
+        join(Artist, Show.artist_id == Artist.id).\
+        filter(*(in_window(start, end) + criteria)).\
+        order_by(Show.start_time, Show.id)
+
+
+def feed_response(key, version, title, query):
+    """ The feed built from version: from the cache, or streamed from query and cached as it is sent.
+
+    title is called for the calendar's name only when the feed is built.
+    """
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return Response(cached[1], mimetype='text/calendar')
+
+    host, url_root = request.host, request.url_root
+    timeout = current_app.config['CALENDAR_CACHE_TIMEOUT']
+
+    def generate():
+        chunks = [header(title())]
+        yield chunks[0]
+        events = []
+        for row in query.yield_per(FEED_BATCH_SIZE):
+            events.append(event(row, host, url_root))
+            if len(events) == FEED_BATCH_SIZE:
+                chunks.append(b''.join(events))
+                yield chunks[-1]
+                events = []
+        chunks.append(b''.join(events) + FOOTER)
+        yield chunks[-1]
+        # Only a feed sent in full is cached
+        cache.set(key, (version, b''.join(chunks)), timeout)
+
+    return Response(stream_with_context(generate()), mimetype='text/calendar')
+
+
+def current_version(version, *args):
+    # conditional_get() leaves the version it computed in g
+    return g.get('version') or version(*args)
+
+
+def venue_feed(venue_id):
+    version = current_version(venue_feed_version, venue_id)
+    if version[1] is None:
+        abort(404)
+    return feed_response(calendar_key('venue:{}'.format(venue_id)), version,
+                         lambda: db.session.query(Venue.name).filter(Venue.id == venue_id).scalar(),
+                         events_query(version, [Show.venue_id == venue_id]))
+
+
+def artist_feed(artist_id):
+    version = current_version(artist_feed_version, artist_id)
+    if version[1] is None:
+        abort(404)
+    return feed_response(calendar_key('artist:{}'.format(artist_id)), version,
+                         lambda: db.session.query(Artist.name).filter(Artist.id == artist_id).scalar(),
+                         events_query(version, [Show.artist_id == artist_id]))
+
+
+def city_feed():
+    city, state = requested_city()
+    version = current_version(city_feed_version)
+    if version[1] is None:
+        abort(404)
+    return feed_response(city_calendar_key(city, state), version, lambda: '{}, {}'.format(city, state),
+                         events_query(version, [Venue.city == city, Venue.state == state], CITY_FEED_DAYS))
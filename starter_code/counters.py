@@ -0,0 +1,163 @@
+from datetime import datetime, timezone
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects.postgresql import insert
+
+from cache import cache, page_key
+from models import db, ArtistShowCount, Show, ShowCountClock, VenueShowCount
+
+
+CLOCK_ID = 1
+
+# Each counter table and the Show column it counts by
+COUNTERS = ((VenueShowCount, 'venue_id'), (ArtistShowCount, 'artist_id'))
+
+# Only shows with both a venue and an artist are listed, so only those are counted; deleting a venue
+# leaves its shows with a NULL venue_id, see uncount_shows()
+LISTED = db.and_(Show.venue_id.isnot(None), Show.artist_id.isnot(None))
+
+
+def locked_clock(shared=True):
+    """ The counters' clock row, locked for the rest of the transaction.
+
+    Writers that add shows take a shared lock and the job that advances the
+    clock an exclusive one, so a show is never counted against a clock that
+    moves underneath it.
+    """
+    return db.session.query(ShowCountClock).\
+        filter(ShowCountClock.id == CLOCK_ID).\
+        with_for_update(read=shared).\
+        one_or_none()
+
+
+def tallies(key, criteria, counted_until):
+    # (id, upcoming, past) per venue or artist for the matching shows
+    column = getattr(Show, key)
+    upcoming = Show.start_time > counted_until
+    return db.session.query(
+        column.label('id'),
+        db.func.count().filter(upcoming).label('upcoming'),
+        db.func.count().filter(db.not_(upcoming)).label('past')
+        ).\
+        filter(criteria, LISTED).\
+        group_by(column).\
+        order_by(column)
+
+
+def add_counts(model, key, query, replace=False):
+    table = model.__table__
+    statement = insert(table).from_select([key, 'upcoming_shows_count', 'past_shows_count'], query.statement)
+    if replace:
+        values = {name: statement.excluded[name] for name in ('upcoming_shows_count', 'past_shows_count')}
+    else:
+        values = {name: table.c[name] + statement.excluded[name] for name in ('upcoming_shows_count', 'past_shows_count')}
+    db.session.execute(statement.on_conflict_do_update(index_elements=[key], set_=values))
+
+
+def count_new_shows(show_ids):
+    """ Add freshly inserted (flushed) shows to the counters, in the caller's transaction.
+
+    Does nothing until the counters have been built, see rebuild_show_counts().
+    """
+    if not show_ids:
+        return
+    clock = locked_clock()
+    if clock is None:
+        return
+    for model, key in COUNTERS:
+        add_counts(model, key, tallies(key, Show.id.in_(show_ids), clock.counted_until))
+
+
+def uncount_shows(criteria):
+    """ Take the matching shows off the counters, in the caller's transaction.
+
+    Call it before a write that unlists them, such as deleting their venue.
+    """
+    clock = locked_clock()
+    if clock is None:
+        return
+    for model, key in COUNTERS:
+        counted = tallies(key, criteria, clock.counted_until).subquery()
+        table = model.__table__
+        db.session.execute(
+            table.update().
+            where(table.c[key] == counted.c.id).
+            values(upcoming_shows_count=table.c.upcoming_shows_count - counted.c.upcoming,
+                   past_shows_count=table.c.past_shows_count - counted.c.past)
+        )
+
+
+def roll_show_counts(now=None):
+    """ Move shows that have started since the last run from upcoming to past.
+
+    Only the shows between the old and the new clock value are read, so a run
+    costs the number of shows that started in between. Commits and returns
+    that number.
+    """
+    now = now or datetime.now(timezone.utc)
+    clock = locked_clock(shared=False)
+    if clock is None or now <= clock.counted_until:
+        db.session.rollback()
+        return 0
+
+    started = db.and_(Show.start_time > clock.counted_until, Show.start_time <= now)
+    moved = db.session.query(db.func.count(Show.id)).filter(started, LISTED).scalar()
+    if moved:
+        for model, key in COUNTERS:
+            column = getattr(Show, key)
+            crossed = db.session.query(column.label('id'), db.func.count().label('shows')).\
+                filter(started, LISTED).\
+                group_by(column).\
+                subquery()
+            table = model.__table__
+            db.session.execute(
+                table.update().
+                where(table.c[key] == crossed.c.id).
+                values(upcoming_shows_count=table.c.upcoming_shows_count - crossed.c.shows,
+                       past_shows_count=table.c.past_shows_count + crossed.c.shows)
+            )
+        clock.changed_at = now
+    clock.counted_until = now
+    db.session.commit()
+    return moved
+
+
+def rebuild_show_counts(now=None):
+    """Recount every venue and artist from the Show table and reset the clock to now. Commits."""
+    now = now or datetime.now(timezone.utc)
+    # A full recount can take longer than the web requests' statement_timeout
+    db.session.execute('SET LOCAL statement_timeout = 0')
+    clock = locked_clock(shared=False)
+    if clock is None:
+        clock = ShowCountClock(id=CLOCK_ID, counted_until=now, changed_at=now)
+        db.session.add(clock)
+    clock.counted_until = clock.changed_at = now
+    for model, key in COUNTERS:
+        db.session.query(model).delete(synchronize_session=False)
+        add_counts(model, key, tallies(key, db.true(), now), replace=True)
+    db.session.commit()
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+counts_command = AppGroup('counts', help='Maintain the upcoming/past show counters.')
+
+
+@counts_command.command('roll')
+def roll_command():
+    """Move shows that have started from upcoming to past; run this from cron every minute or so."""
+    moved = roll_show_counts()
+    if moved:
+        cache.delete_many(page_key('venues'))
+    click.echo('Moved {} shows to past.'.format(moved))
+
+
+@counts_command.command('rebuild')
+def rebuild_command():
+    """Recount all shows from scratch."""
+    rebuild_show_counts()
+    cache.clear()
+    click.echo('Show counters rebuilt.')
@@ -0,0 +1,196 @@
+""" Date and time formatting for templates.
+
+The `datetime` template filter used to hand every value to
+babel.dates.format_datetime, which re-parses the locale and the pattern on
+each call. Here a pattern is compiled once per locale into literals and
+field getters, with the locale's day, month and period names looked up in
+advance through Babel itself, so the output is the same. Formatted values
+and parsed strings are kept in bounded memos, since the same show times
+come back on every page that lists them.
+
+Times are shown in the request's locale and time zone: the best match for
+Accept-Language among DATETIME_LOCALES, and the IANA zone in ?tz= or the
+tz cookie, falling back to the first locale and DISPLAY_TIMEZONE.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+from flask import current_app, has_app_context, request
+from flask.globals import _request_ctx_stack
+
+
+# Named formats accepted by the filter, e.g. {{ show.start_time|datetime('full') }}
+PATTERNS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+DEFAULT_LOCALE = 'en_US'
+DEFAULT_TIMEZONE = 'UTC'
+
+# Entries kept in the memos of formatted values and of parsed strings
+FORMAT_MEMO_SIZE = 16384
+PARSE_MEMO_SIZE = 4096
+
+
+#----------------------------------------------------------------------------#
+# Compiled patterns.
+#----------------------------------------------------------------------------#
+
+def padded(attribute, width):
+    return lambda value: '%0*d' % (width, getattr(value, attribute))
+
+
+def named(locale, field, samples, key):
+    # Babel formats one sample per name, e.g. one date per weekday; key picks the name for a value
+    names = [babel.dates.DateTimeFormat(sample, locale)[field] for sample in samples]
+    return lambda value: names[key(value)]
+
+
+def field_getter(char, num, locale):
+    field = char * num
+    if char == 'E':
+        return named(locale, field, [datetime(2001, 1, day) for day in range(1, 8)], datetime.weekday)
+    if char in 'ML' and num >= 3:
+        return named(locale, field, [datetime(2001, month, 1) for month in range(1, 13)],
+                     lambda value: value.month - 1)
+    if char == 'a':
+        return named(locale, field, [datetime(2001, 1, 1, 0), datetime(2001, 1, 1, 12)],
+                     lambda value: value.hour >= 12)
+    if char in 'ML':
+        return padded('month', num)
+    if char == 'y' and num != 2:
+        return padded('year', num)
+    if char in 'dHms':
+        return padded({'d': 'day', 'H': 'hour', 'm': 'minute', 's': 'second'}[char], num)
+    if char == 'h':
+        return lambda value: '%0*d' % (num, value.hour % 12 or 12)
+    # Anything rarer goes through Babel on every call
+    return lambda value: babel.dates.DateTimeFormat(value, locale)[field]
+
+
+@lru_cache(maxsize=None)
+def compiled_pattern(pattern, locale_name):
+    """ A function formatting a datetime with a Babel pattern in a locale.
+
+    Cached for the life of the process; there is one per pattern and locale in use.
+    """
+    locale = Locale.parse(locale_name)
+    parts = []
+    getters = []
+    for kind, value in babel.dates.tokenize_pattern(pattern):
+        if kind == 'chars':
+            parts.append(value.replace('%', '%%'))
+        else:
+            parts.append('%s')
+            getters.append(field_getter(value[0], value[1], locale))
+    template = ''.join(parts)
+    getters = tuple(getters)
+
+    def format(value):
+        return template % tuple(getter(value) for getter in getters)
+    return format
+
+
+@lru_cache(maxsize=None)
+def zone(name):
+    return babel.dates.get_timezone(name)
+
+
+#----------------------------------------------------------------------------#
+# Parsing.
+#----------------------------------------------------------------------------#
+
+@lru_cache(maxsize=PARSE_MEMO_SIZE)
+def parse_datetime(text):
+    """A datetime from a string, trying ISO 8601 before dateutil's guesswork."""
+    try:
+        # fromisoformat doesn't take a trailing Z before Python 3.11
+        return datetime.fromisoformat(text[:-1] + '+00:00' if text.endswith('Z') else text)
+    except ValueError:
+        return dateutil.parser.parse(text)
+
+
+#----------------------------------------------------------------------------#
+# Display locale and time zone.
+#----------------------------------------------------------------------------#
+
+def known_timezone(name):
+    if not name:
+        return False
+    try:
+        zone(name)
+    except LookupError:
+        return False
+    return True
+
+
+def locales():
+    return current_app.config.get('DATETIME_LOCALES') or [DEFAULT_LOCALE]
+
+
+def default_settings():
+    if not has_app_context():
+        return DEFAULT_LOCALE, DEFAULT_TIMEZONE
+    return locales()[0], current_app.config.get('DISPLAY_TIMEZONE', DEFAULT_TIMEZONE)
+
+
+def display_settings():
+    """(locale, time zone name) for the current request, or the configured defaults outside one."""
+    # Called for every formatted value, so it is kept on the request context rather than
+    # looked up through g
+    context = _request_ctx_stack.top
+    if context is None:
+        return default_settings()
+    settings = getattr(context, 'display_settings', None)
+    if settings is None:
+        default = default_settings()
+        available = locales()
+        locale = request.accept_languages.best_match(available, default[0]) if len(available) > 1 else default[0]
+        name = request.args.get('tz') or request.cookies.get('tz')
+        settings = context.display_settings = (locale, name if known_timezone(name) else default[1])
+    return settings
+
+
+def default_display():
+    """Whether the request sees times as everyone else does, so shared cached pages can serve it."""
+    return display_settings() == default_settings()
+
+
+#----------------------------------------------------------------------------#
+# Formatting.
+#----------------------------------------------------------------------------#
+
+@lru_cache(maxsize=FORMAT_MEMO_SIZE)
+def format_in(value, pattern, locale, tz):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if pattern in ('short', 'long'):
+        # Babel's own named formats combine a date and a time pattern
+        return babel.dates.format_datetime(value, pattern, tzinfo=zone(tz), locale=locale)
+    return compiled_pattern(pattern, locale)(value.astimezone(zone(tz)))
+
+
+def format_datetime(value, format='medium', locale=None, tz=None):
+    """ The `datetime` template filter.
+
+    value is a datetime, or a string to parse; naive values are taken as UTC.
+    format is a name from PATTERNS or a Babel pattern. locale and tz default
+    to the request's display settings.
+    """
+    if not isinstance(value, datetime):
+        value = parse_datetime(value)
+    if locale is None or tz is None:
+        request_locale, request_tz = display_settings()
+        locale = locale or request_locale
+        tz = tz or request_tz
+    return format_in(value, PATTERNS.get(format, format), locale, tz)
+
+
+def clear_memos():
+    """Forget formatted and parsed values (not the compiled patterns)."""
+    format_in.cache_clear()
+    parse_datetime.cache_clear()
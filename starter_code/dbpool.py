@@ -0,0 +1,155 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats(object):
+    """ Counters for one connection pool.
+
+    checkout wait is the time a request spends blocked in the pool waiting for
+    a connection; connects/disconnects count physical connections opened and
+    closed (recycled, invalidated or dropped by pre-ping), i.e. churn.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.connects = 0
+        self.disconnects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            if seconds > self.wait_seconds_max:
+                self.wait_seconds_max = seconds
+            if timed_out:
+                self.timeouts += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that keeps a PoolStats of checkout waits and connection churn."""
+
+    # Checkouts slower than this many seconds are passed to on_slow_checkout
+    slow_checkout = 0.1
+    on_slow_checkout = None
+
+    def __init__(self, *args, **kwargs):
+        recreated = '_dispatch' in kwargs
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.stats = stats = PoolStats()
+        if not recreated:
+            # The listeners travel with the dispatch to recreated pools, which also
+            # inherit this stats object in recreate()
+            event.listen(self, 'connect', lambda *args: self._count('connects', stats))
+            event.listen(self, 'close', lambda *args: self._count('disconnects', stats))
+            event.listen(self, 'invalidate', lambda *args: self._count('invalidations', stats))
+
+    @staticmethod
+    def _count(name, stats):
+        with stats.lock:
+            setattr(stats, name, getattr(stats, name) + 1)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = True
+        try:
+            conn = super(InstrumentedQueuePool, self)._do_get()
+            timed_out = False
+            return conn
+        finally:
+            waited = time.perf_counter() - start
+            self.stats.record_wait(waited, timed_out)
+            if waited >= self.slow_checkout and self.on_slow_checkout is not None:
+                self.on_slow_checkout(self, waited)
+
+    def recreate(self):
+        # Keep the counters when the engine disposes and rebuilds its pool
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+    def snapshot(self):
+        """Current occupancy plus the cumulative counters, as a flat dict."""
+        stats = self.stats
+        with stats.lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'idle': self.checkedin(),
+                'overflow': self.overflow(),
+                'checkouts': stats.checkouts,
+                'checkout_timeouts': stats.timeouts,
+                'checkout_wait_seconds_total': stats.wait_seconds_total,
+                'checkout_wait_seconds_max': stats.wait_seconds_max,
+                'connects': stats.connects,
+                'disconnects': stats.disconnects,
+                'invalidations': stats.invalidations,
+            }
+
+
+def pool_snapshots(db, app):
+    """Snapshot of every instrumented pool, keyed by bind name ('default' for the primary)."""
+    snapshots = {}
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        pool = db.get_engine(app, bind).pool
+        if isinstance(pool, InstrumentedQueuePool):
+            snapshots[bind or 'default'] = pool.snapshot()
+    return snapshots
+
+
+def dispose_engines(db, app):
+    """ Drop every pooled connection, e.g. before forking worker processes.
+
+    A connection must never be used from two processes, so a parent disposes
+    its pools before forking and the children open their own.
+    """
+    db.session.remove()
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        db.get_engine(app, bind).dispose()
+
+
+def wait_green(conn, timeout=None):
+    # psycopg2 wait callback: yield to other greenlets while Postgres is busy
+    from gevent.socket import wait_read, wait_write
+    import psycopg2.extensions
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('Bad result from poll: {!r}'.format(state))
+
+
+def make_psycopg2_green():
+    """ Make psycopg2 cooperative under gevent.
+
+    psycopg2 talks to the server through libpq, which gevent's monkey patching
+    can't reach; with this wait callback a query parks only its own greenlet,
+    so a worker keeps serving other requests while one waits on the database.
+    Must run before the first connection is opened.
+    """
+    import psycopg2.extensions
+    psycopg2.extensions.set_wait_callback(wait_green)
+
+
+def init_pool_instrumentation(app):
+    """Log checkouts that waited longer than DB_POOL_SLOW_CHECKOUT seconds."""
+    InstrumentedQueuePool.slow_checkout = app.config.get('DB_POOL_SLOW_CHECKOUT', 0.1)
+
+    def log_slow_checkout(pool, waited):
+        app.logger.warning('Waited %.3fs for a database connection (%d checked out, overflow %d)',
+                           waited, pool.checkedout(), pool.overflow())
+
+    InstrumentedQueuePool.on_slow_checkout = staticmethod(log_slow_checkout)
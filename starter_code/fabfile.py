@@ -1,14 +1,22 @@
+import os
+
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
+# A saved micro-benchmark run to flag regressions against, e.g. one written with
+# `python -m benchmarks micro --output benchmarks/results/baseline.json` on master.
+# results/ is not committed, so a fresh checkout runs without one
+BASELINE = "benchmarks/results/baseline.json"
+
 # prepare for deployment
 
 
 def test():
+    command = "python -m benchmarks micro"
+    if os.path.exists(BASELINE):
+        command += " --baseline " + BASELINE
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local(command, capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -40,7 +48,7 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python -m benchmarks micro --iterations 10"
     )
 
 
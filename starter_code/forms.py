@@ -2,84 +2,16 @@ from datetime import datetime
 from flask_wtf import FlaskForm
 from wtforms import (StringField, SelectField, SelectMultipleField, DateTimeField, 
                     BooleanField, IntegerField, TextAreaField)
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange
 
-import re
+from models import DEFAULT_SHOW_DURATION
+from validation import STATE_CODES, GENRE_NAMES, PHONE, venue_validator, artist_validator
 
-state_choices = choices=[
-            ('AL', 'AL'),
-            ('AK', 'AK'),
-            ('AZ', 'AZ'),
-            ('AR', 'AR'),
-            ('CA', 'CA'),
-            ('CO', 'CO'),
-            ('CT', 'CT'),
-            ('DE', 'DE'),
-            ('DC', 'DC'),
-            ('FL', 'FL'),
-            ('GA', 'GA'),
-            ('HI', 'HI'),
-            ('ID', 'ID'),
-            ('IL', 'IL'),
-            ('IN', 'IN'),
-            ('IA', 'IA'),
-            ('KS', 'KS'),
-            ('KY', 'KY'),
-            ('LA', 'LA'),
-            ('ME', 'ME'),
-            ('MT', 'MT'),
-            ('NE', 'NE'),
-            ('NV', 'NV'),
-            ('NH', 'NH'),
-            ('NJ', 'NJ'),
-            ('NM', 'NM'),
-            ('NY', 'NY'),
-            ('NC', 'NC'),
-            ('ND', 'ND'),
-            ('OH', 'OH'),
-            ('OK', 'OK'),
-            ('OR', 'OR'),
-            ('MD', 'MD'),
-            ('MA', 'MA'),
-            ('MI', 'MI'),
-            ('MN', 'MN'),
-            ('MS', 'MS'),
-            ('MO', 'MO'),
-            ('PA', 'PA'),
-            ('RI', 'RI'),
-            ('SC', 'SC'),
-            ('SD', 'SD'),
-            ('TN', 'TN'),
-            ('TX', 'TX'),
-            ('UT', 'UT'),
-            ('VT', 'VT'),
-            ('VA', 'VA'),
-            ('WA', 'WA'),
-            ('WV', 'WV'),
-            ('WI', 'WI'),
-            ('WY', 'WY'),
-        ]
-genre_choices = choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+state_choices = [(state, state) for state in STATE_CODES]
+genre_choices = [(genre, genre) for genre in GENRE_NAMES]
+
+# Rules the custom validate() methods add on top of the field validators
+FORM_CHECKS = ('phone', 'genres', 'state')
 
 class ShowForm(FlaskForm):
     artist_id = StringField(
@@ -93,6 +25,11 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration_minutes = IntegerField(
+        'duration_minutes',
+        validators=[DataRequired(), NumberRange(min=1, max=24 * 60)],
+        default=int(DEFAULT_SHOW_DURATION.total_seconds() // 60)
+    )
 
 def is_valid_phone(number):
     """ Validate phone numbers like:
@@ -108,8 +45,15 @@ def is_valid_phone(number):
 
     Note: (? = optional) - Learn more: https://regex101.com/
     """
-    regex = re.compile('^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$')
-    return regex.match(number)
+    return PHONE.match(number or '')
+
+
+def apply_checks(form, validator):
+    """Run the shared phone/genre/state checks on a form, stopping at the first error."""
+    errors = validator.errors(form.data, only=FORM_CHECKS, stop_at_first=True)
+    for field, message in errors.items():
+        getattr(form, field).errors.append(message)
+    return not errors
 
 
 class VenueForm(FlaskForm):
@@ -155,17 +99,7 @@ class VenueForm(FlaskForm):
         rv = FlaskForm.validate(self)
         if not rv:
             return False
-        if not is_valid_phone(self.phone.data):
-            self.phone.errors.append('Invalid phone.')
-            return False
-        if not set(self.genres.data).issubset(dict(Genre.choices()).keys()):
-            self.genres.errors.append('Invalid genres.')
-            return False
-        if self.state.data not in dict(State.choices()).keys():
-            self.state.errors.append('Invalid state.')
-            return False
-        # if pass validation
-        return True
+        return apply_checks(self, venue_validator)
 
 class ArtistForm(FlaskForm):
     name = StringField(
@@ -212,14 +146,4 @@ class ArtistForm(FlaskForm):
         rv = FlaskForm.validate(self)
         if not rv:
             return False
-        if not is_valid_phone(self.phone.data):
-            self.phone.errors.append('Invalid phone.')
-            return False
-        if not set(self.genres.data).issubset(dict(Genre.choices()).keys()):
-            self.genres.errors.append('Invalid genres.')
-            return False
-        if self.state.data not in dict(State.choices()).keys():
-            self.state.errors.append('Invalid state.')
-            return False
-        # if pass validation
-        return True
\ No newline at end of file
+        return apply_checks(self, artist_validator)
\ No newline at end of file
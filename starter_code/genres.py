@@ -0,0 +1,67 @@
+""" Genre filters and facet counts for the venue and artist listings.
+
+    ?genre=Jazz&genre=Blues              everything tagged with both
+    ?genre=Jazz&genre=Blues&match=any    everything tagged with either
+"""
+from collections import OrderedDict
+
+from flask import abort, request, url_for
+
+from models import db, genres_contain, genres_overlap
+
+
+MATCHES = ('all', 'any')
+
+
+def requested_genres():
+    """The genre filter of the current request as (genres, match), genres deduplicated in order."""
+    genres = list(OrderedDict.fromkeys(genre for genre in request.args.getlist('genre') if genre))
+    match = request.args.get('match', 'all')
+    if match not in MATCHES:
+        abort(400, "match must be 'all' or 'any'")
+    return genres, match
+
+
+def genre_criteria(column, genres, match='all'):
+    # @> for all of the genres, && for any of them; the GIN index on the column serves both
+    if not genres:
+        return []
+    if match == 'any':
+        return [genres_overlap(column, genres)]
+    return [genres_contain(column, genres)]
+
+
+def genre_facets(model, criteria):
+    """ (genre, count) for the rows of model matching criteria, most common first.
+
+    A single aggregate over the filtered rows' unnested genre arrays, so a
+    filter's facets cost one query however many genres there are.
+    """
+    tagged = db.session.query(db.func.unnest(model.genres).label('genre')).filter(*criteria).subquery()
+    count = db.func.count().label('count')
+    return db.session.query(tagged.c.genre, count).\
+        group_by(tagged.c.genre).\
+        order_by(count.desc(), tagged.c.genre).\
+        all()
+
+
+def facet_links(endpoint, facets, genres, match):
+    """ The facets as links that add or remove their genre from the current filter.
+
+    Selected genres that match nothing are kept, with a zero count, so they
+    can still be removed.
+    """
+    counts = OrderedDict(facets)
+    for genre in genres:
+        counts.setdefault(genre, 0)
+    links = []
+    for genre, count in counts.items():
+        selected = genre in genres
+        toggled = [other for other in genres if other != genre] if selected else genres + [genre]
+        links.append({
+            'genre': genre,
+            'count': count,
+            'selected': selected,
+            'url': url_for(endpoint, genre=toggled, match=match if match != 'all' else None)
+        })
+    return links
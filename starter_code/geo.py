@@ -0,0 +1,274 @@
+""" Venue coordinates and radius search.
+
+Venues are geocoded offline to their city's centre from the bundled
+gazetteer, data/us_cities.csv, so no geocoding service is needed. Each
+geocoded venue also stores the geohash of its coordinates. A radius search
+turns the search circle into a few geohash prefixes, each one a range scan
+on the geohash B-tree index, and only computes exact distances for the
+venues in those cells.
+"""
+import csv
+import math
+import os
+import re
+
+import click
+from flask import abort, current_app, request
+from flask.cli import with_appcontext
+
+from models import db, Artist, Show, Venue
+from readmodels import NearbyShowTile, fetch
+
+
+GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'us_cities.csv')
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+# Mean Earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+# A search circle is covered by at most this many geohash cells, i.e. index range scans
+MAX_CELLS = 16
+
+# Nearby searches start at radius / FIRST_RING and widen until they have a full page
+FIRST_RING = 16
+
+_gazetteer = None
+
+
+#----------------------------------------------------------------------------#
+# Geocoding.
+#----------------------------------------------------------------------------#
+
+def place_key(city, state):
+    # 'St. Louis', 'Saint Louis' and 'st louis ' are the same place
+    city = re.sub(r'[.\s]+', ' ', city.casefold()).strip()
+    city = re.sub(r'^saint ', 'st ', city)
+    return city, state.strip().upper()
+
+
+def gazetteer():
+    """(city, state) key -> (latitude, longitude), loaded once."""
+    global _gazetteer
+    if _gazetteer is None:
+        with open(GAZETTEER, newline='') as f:
+            _gazetteer = {place_key(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+                          for row in csv.DictReader(f)}
+    return _gazetteer
+
+
+def coordinates(city, state):
+    """Column values locating a venue in city, state; all None if the gazetteer doesn't know the city."""
+    point = gazetteer().get(place_key(city or '', state or ''))
+    if point is None:
+        return {'latitude': None, 'longitude': None, 'geohash': None}
+    return {'latitude': point[0], 'longitude': point[1], 'geohash': encode(*point)}
+
+
+def locate(venue):
+    """Set a venue's coordinates from its city and state."""
+    for name, value in coordinates(venue.city, venue.state).items():
+        setattr(venue, name, value)
+
+
+#----------------------------------------------------------------------------#
+# Geohashes.
+#----------------------------------------------------------------------------#
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    count = 0
+    even = True
+    while len(chars) < precision:
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        count += 1
+        if count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of the geohash cells of a precision."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """ (south, north, west, east) around a circle on the sphere.
+
+    west/east may run past +-180; a box that reaches a pole spans every longitude.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    south = latitude - math.degrees(angle)
+    north = latitude + math.degrees(angle)
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), min(north, 90.0), -180.0, 180.0
+    spread = math.sin(angle) / math.cos(math.radians(latitude))
+    if spread >= 1:
+        return south, north, -180.0, 180.0
+    delta = math.degrees(math.asin(spread))
+    return south, north, longitude - delta, longitude + delta
+
+
+def covering_cells(south, north, west, east):
+    """The geohashes of the finest cells that cover the box in at most MAX_CELLS cells."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        first_row = math.floor((south + 90) / height)
+        first_column = math.floor((west + 180) / width)
+        rows = math.floor((north + 90) / height) - first_row + 1
+        columns = math.floor((east + 180) / width) - first_column + 1
+        if rows * columns <= MAX_CELLS:
+            break
+    cells = set()
+    for row in range(rows):
+        latitude = min(-90 + (first_row + row + 0.5) * height, 90.0)
+        for column in range(columns):
+            longitude = (-180 + (first_column + column + 0.5) * width + 180) % 360 - 180
+            cells.add(encode(latitude, longitude, precision))
+    return sorted(cells)
+
+
+def in_cells(column, cells):
+    # A prefix is a range in the column's C collation; '~' sorts after every geohash character
+    return db.or_(*[db.and_(column >= cell, column < cell + '~') for cell in cells])
+
+
+#----------------------------------------------------------------------------#
+# Distance.
+#----------------------------------------------------------------------------#
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_km(latitude, longitude):
+    """SQL expression for the great-circle distance from a point to Venue's coordinates."""
+    f = db.func
+    a = f.power(f.sin(f.radians(Venue.latitude - latitude) / 2), 2) + \
+        f.cos(f.radians(latitude)) * f.cos(f.radians(Venue.latitude)) * \
+        f.power(f.sin(f.radians(Venue.longitude - longitude) / 2), 2)
+    return 2 * EARTH_RADIUS_KM * f.asin(f.least(1.0, f.sqrt(a)))
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+def nearby_query(latitude, longitude, radius_km, start, end=None):
+    """Shows from start (to end) at venues within radius_km of a point, nearest first."""
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    distance = distance_km(latitude, longitude)
+    query = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        distance.label('distance_km')
+        ).\
+        join(Venue, Show.venue_id == Venue.id).\
+        join(Artist, Show.artist_id == Artist.id).\
+        filter(
+            in_cells(Venue.geohash, covering_cells(south, north, west, east)),
+            Venue.latitude.between(south, north),
+            distance <= radius_km,
+            Show.start_time >= start
+        )
+    if end is not None:
+        query = query.filter(Show.start_time < end)
+    return query.order_by(distance, Show.start_time, Show.id)
+
+
+def requested_point():
+    """ (latitude, longitude, radius_km) from ?lat=&lon=&radius=, or None without lat and lon.
+
+    radius defaults to NEARBY_RADIUS_KM and is capped at NEARBY_MAX_RADIUS_KM.
+    """
+    if not request.args.get('lat') and not request.args.get('lon'):
+        return None
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lon'])
+        radius = float(request.args.get('radius') or current_app.config['NEARBY_RADIUS_KM'])
+    except (KeyError, ValueError):
+        abort(400, 'lat, lon and radius must be numbers')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and radius > 0):
+        abort(400, 'lat must be within +-90, lon within +-180 and radius positive')
+    return latitude, longitude, min(radius, current_app.config['NEARBY_MAX_RADIUS_KM'])
+
+
+def nearby_shows(latitude, longitude, radius_km, start, end=None, limit=30):
+    """ The first limit shows at venues within radius_km of a point, nearest first.
+
+    The search starts on a small circle and widens it fourfold until it has
+    limit shows: the nearest shows within the small circle are also the
+    nearest within the large one, so a dense city only reads the venues close
+    to the point instead of every venue within the radius. Returns
+    NearbyShowTile rows.
+    """
+    search = radius_km / FIRST_RING
+    while True:
+        search = min(search, radius_km)
+        shows = fetch(NearbyShowTile, nearby_query(latitude, longitude, search, start, end).limit(limit))
+        if len(shows) >= limit or search >= radius_km:
+            return shows
+        search *= 4
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@click.command('geocode')
+@click.option('--all', 'everything', is_flag=True, help='Geocode every venue, not only those without coordinates.')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def geocode_command(everything, batch_size):
+    """Fill in venue coordinates from the bundled gazetteer."""
+    query = db.session.query(Venue.id, Venue.city, Venue.state).order_by(Venue.id)
+    if not everything:
+        query = query.filter(Venue.latitude.is_(None))
+    located = missing = 0
+    last_id = 0
+    while True:
+        # Keyset batches, so updated rows never shift the next batch
+        rows = query.filter(Venue.id > last_id).limit(batch_size).all()
+        if not rows:
+            break
+        updates = []
+        for venue_id, city, state in rows:
+            values = coordinates(city, state)
+            if values['geohash'] is None:
+                missing += 1
+            else:
+                located += 1
+                updates.append(dict(values, venue_id=venue_id))
+        if updates:
+            table = Venue.__table__
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('venue_id')),
+                updates
+            )
+        db.session.commit()
+        last_id = rows[-1].id
+    click.echo('Geocoded {} venues; {} are in cities the gazetteer does not know.'.format(located, missing))
@@ -0,0 +1,38 @@
+""" gunicorn settings for wsgi:app; the environment overrides the defaults. """
+import multiprocessing
+import os
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 5000))
+
+# 'gevent' serves many concurrent (slow) clients per worker, 'gthread' is a plain thread pool
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# A write deletes the cache entries it makes stale, which an in-process cache only does in the worker that
+# handled it; the others would keep serving the old pages and feeds
+if workers > 1 and os.environ.get('CACHE_TYPE') == 'simple':
+    raise RuntimeError("CACHE_TYPE='simple' is per process; use 'filesystem' with WEB_CONCURRENCY > 1")
+# gthread: threads per worker
+threads = int(os.environ.get('WEB_THREADS', 8))
+# gevent: concurrent clients per worker. Their queries still share the worker's DB_POOL_SIZE connections
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+keepalive = 5
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+# On SIGTERM workers stop accepting and get this long to finish the requests in flight
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+
+# gevent has to patch the worker before the app is imported, so every worker loads its own
+preload_app = False
+
+accesslog = os.environ.get('ACCESS_LOG')
+
+
+def worker_exit(server, worker):
+    # Close the worker's connections properly instead of leaving Postgres to notice them dropping
+    from app import app
+    from dbpool import dispose_engines
+    from models import db
+
+    with app.app_context():
+        dispose_engines(db, app)
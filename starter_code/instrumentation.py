@@ -0,0 +1,373 @@
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from flask import Response, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cache import cache
+from dbpool import pool_snapshots
+from models import db
+
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Slowest statements kept per request for the structured log line
+SLOWEST_STATEMENTS = 5
+
+# Longest statement text written to a log line
+MAX_STATEMENT_LENGTH = 1000
+
+request_log = logging.getLogger('fyyur.requests')
+slow_query_log = logging.getLogger('fyyur.slow_queries')
+
+
+#----------------------------------------------------------------------------#
+# Per-request profile.
+#----------------------------------------------------------------------------#
+
+class RequestProfile(object):
+    """Time spent in SQL and template rendering during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.slowest = []
+
+    def record_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        entry = (seconds, self.queries, statement)
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def slowest_statements(self):
+        return [{'ms': round(seconds * 1000, 2), 'statement': truncate(statement)}
+                for seconds, _, statement in sorted(self.slowest, reverse=True)]
+
+
+def current_profile():
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+
+def truncate(statement):
+    statement = ' '.join(statement.split())
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        return statement[:MAX_STATEMENT_LENGTH] + '...'
+    return statement
+
+
+def redact(parameters):
+    # Only the shape of the parameters is logged, never the values
+    if isinstance(parameters, dict):
+        return {name: '?' for name in parameters}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return '<{} parameter sets>'.format(len(parameters))
+        return ['?'] * len(parameters)
+    return '?'
+
+
+class TimedTemplate(Template):
+    """Template that adds its render time to the request profile."""
+
+    def render(self, *args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            profile.render_seconds += time.perf_counter() - start
+
+
+#----------------------------------------------------------------------------#
+# Metrics.
+#----------------------------------------------------------------------------#
+
+class Histogram(object):
+    """Cumulative Prometheus-style histogram, one series per label tuple."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+
+def format_labels(names, values):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metrics(object):
+    """ Process-local request metrics, rendered in the Prometheus text format.
+
+    Each worker process keeps its own numbers; scrape every worker or run a
+    single process per scrape target.
+    """
+
+    labels = ('endpoint', 'method')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.responses = Counter()
+        self.queries = Counter()
+        self.sql_seconds = Counter()
+        self.render_seconds = Counter()
+
+    def observe(self, endpoint, method, status, profile, seconds):
+        labels = (endpoint, method)
+        with self.lock:
+            self.latency.observe(labels, seconds)
+            self.responses[labels + (status,)] += 1
+            self.queries[labels] += profile.queries
+            self.sql_seconds[labels] += profile.sql_seconds
+            self.render_seconds[labels] += profile.render_seconds
+
+    def render(self, app):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, names, values, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, format_labels(names, values), value))
+
+        with self.lock:
+            buckets = []
+            for labels, (counts, total) in sorted(self.latency.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.latency.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    buckets.append(('_bucket', self.labels + ('le',), labels + (bound,), cumulative))
+                buckets.append(('_sum', self.labels, labels, total))
+                buckets.append(('_count', self.labels, labels, cumulative))
+            metric('fyyur_request_duration_seconds', 'histogram', 'Request latency by route.', buckets)
+            metric('fyyur_responses_total', 'counter', 'Responses by route and status.',
+                   [('', self.labels + ('status',), labels, count)
+                    for labels, count in sorted(self.responses.items())])
+            for name, counter, help_text in (
+                    ('fyyur_sql_queries_total', self.queries, 'SQL statements executed by route.'),
+                    ('fyyur_sql_seconds_total', self.sql_seconds, 'Time spent in SQL by route.'),
+                    ('fyyur_render_seconds_total', self.render_seconds, 'Time spent rendering templates by route.')):
+                metric(name, 'counter', help_text,
+                       [('', self.labels, labels, value) for labels, value in sorted(counter.items())])
+
+        stats = cache.stats()
+        metric('fyyur_cache_hits_total', 'counter', 'Page/query cache hits.', [('', (), (), stats['hits'])])
+        metric('fyyur_cache_misses_total', 'counter', 'Page/query cache misses.', [('', (), (), stats['misses'])])
+
+        snapshots = sorted(pool_snapshots(db, app).items())
+        for field in ('checked_out', 'idle', 'overflow'):
+            metric('fyyur_db_pool_' + field, 'gauge', 'Connection pool {}.'.format(field.replace('_', ' ')),
+                   [('', ('bind',), (bind,), snapshot[field]) for bind, snapshot in snapshots])
+        for field in ('checkouts', 'checkout_timeouts', 'checkout_wait_seconds_total', 'connects',
+                      'disconnects', 'invalidations'):
+            name = field if field.endswith('_total') else field + '_total'
+            metric('fyyur_db_pool_' + name, 'counter', 'Connection pool {}.'.format(field.replace('_', ' ')),
+                   [('', ('bind',), (bind,), snapshot[field]) for bind, snapshot in snapshots])
+        return '\n'.join(lines) + '\n'
+
+
+#----------------------------------------------------------------------------#
+# Sampling profiler.
+#----------------------------------------------------------------------------#
+
+class SamplingProfiler(object):
+    """ Samples the stacks of in-flight requests from a background thread.
+
+    Requests slower than the threshold have their samples written to
+    directory in the folded format read by flamegraph.pl and speedscope
+    ("outer;inner;leaf count" per line).
+    """
+
+    def __init__(self, threshold, interval, directory):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, ident):
+        with self.lock:
+            self.active[ident] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+                self.thread.start()
+
+    def stop(self, ident):
+        with self.lock:
+            return self.active.pop(ident, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, samples in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[fold(frame)] += 1
+
+    def dump(self, samples, endpoint):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{:.0f}-{}.folded'.format(time.time() * 1000, endpoint))
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        return path
+
+
+def fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+#----------------------------------------------------------------------------#
+# Extension.
+#----------------------------------------------------------------------------#
+
+class Instrumentation(object):
+    """ Per-request timing of views, SQL and templates.
+
+    Every response gets one JSON line on the fyyur.requests logger and, with
+    SERVER_TIMING, a Server-Timing header (total, db, render and the
+    remaining view time); with METRICS the numbers feed per-route histograms
+    served at /metrics. Both are off by default, as they tell anyone what
+    each page costs the database. Statements
+    slower than SLOW_QUERY_MS are logged on fyyur.slow_queries with their
+    parameters redacted. Setting PROFILE_THRESHOLD_MS turns on the sampling
+    profiler for requests slower than that.
+    """
+
+    def __init__(self, app=None):
+        self.metrics = Metrics()
+        self.profiler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        self.slow_query = app.config.get('SLOW_QUERY_MS', 200) / 1000.0
+        threshold = app.config.get('PROFILE_THRESHOLD_MS')
+        if threshold is not None:
+            self.profiler = SamplingProfiler(threshold / 1000.0, app.config.get('PROFILE_INTERVAL_MS', 5) / 1000.0,
+                                             app.config.get('PROFILE_DIR', 'profiles'))
+        if app.config.get('REQUEST_LOG', True) and not request_log.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            request_log.addHandler(handler)
+            request_log.setLevel(logging.INFO)
+            request_log.propagate = False
+
+        app.jinja_env.template_class = TimedTemplate
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.teardown_request)
+        if app.config.get('METRICS', False):
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['instrumentation'] = self
+
+    # The start time is kept on the statement's execution context, which a failed statement takes with it;
+    # a stack on the pooled connection would keep its entry and pair later statements with the wrong start.
+    # Only the dialect's own probes on first connect run without a context, and they aren't timed
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        seconds = time.perf_counter() - context._query_started
+        profile = current_profile()
+        if profile is not None:
+            profile.record_query(statement, seconds)
+        if seconds >= self.slow_query:
+            slow_query_log.warning('%.1fms %s params=%s', seconds * 1000, truncate(statement), redact(parameters))
+
+    def start_request(self):
+        if request.endpoint == 'metrics':
+            return
+        g.profile = RequestProfile()
+        if self.profiler is not None:
+            self.profiler.start(threading.get_ident())
+
+    def finish_request(self, response):
+        profile = g.get('profile')
+        if profile is None:
+            return response
+        seconds = time.perf_counter() - profile.started
+        endpoint = request.endpoint or 'unmatched'
+        self.metrics.observe(endpoint, request.method, response.status_code, profile, seconds)
+
+        if self.server_timing:
+            view = max(seconds - profile.sql_seconds - profile.render_seconds, 0.0)
+            response.headers.add('Server-Timing', ', '.join((
+                'total;dur={:.2f}'.format(seconds * 1000),
+                'db;dur={:.2f};desc="{} queries"'.format(profile.sql_seconds * 1000, profile.queries),
+                'render;dur={:.2f}'.format(profile.render_seconds * 1000),
+                'view;dur={:.2f}'.format(view * 1000),
+            )))
+
+        request_log.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'ms': round(seconds * 1000, 2),
+            'sql_ms': round(profile.sql_seconds * 1000, 2),
+            'queries': profile.queries,
+            'render_ms': round(profile.render_seconds * 1000, 2),
+            'slowest': profile.slowest_statements(),
+        }))
+
+        if self.profiler is not None:
+            samples = self.profiler.stop(threading.get_ident())
+            if samples and seconds >= self.profiler.threshold:
+                path = self.profiler.dump(samples, endpoint)
+                request_log.info(json.dumps({'profile': path, 'endpoint': endpoint, 'ms': round(seconds * 1000, 2)}))
+        return response
+
+    def teardown_request(self, exc):
+        # finish_request is skipped when a view raises; don't keep sampling the thread
+        if self.profiler is not None:
+            self.profiler.stop(threading.get_ident())
+
+    def metrics_view(self):
+        return Response(self.metrics.render(self.app), mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,266 @@
+import logging
+import multiprocessing
+import random
+import signal
+import time
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+
+from dbpool import dispose_engines
+from models import db, Job
+from routing import RoutingSession
+
+
+log = logging.getLogger('fyyur.jobs')
+
+Task = namedtuple('Task', ['func', 'max_attempts', 'every'])
+
+# Task name -> Task, filled in by the @task decorator
+TASKS = {}
+
+# session.info key holding the jobs deferred in the current transaction
+PENDING = 'deferred_jobs'
+
+# Seconds a claimed job stays invisible to other workers; a job whose worker died is retried after this
+LEASE_SECONDS = 300
+
+# Retry delays grow from BACKOFF_BASE seconds, doubling per attempt, up to BACKOFF_MAX
+BACKOFF_BASE = 5
+BACKOFF_MAX = 3600
+
+# A running job whose lease expired was abandoned by its worker (killed, out of memory); it is claimed again
+# while it has attempts left, and dead-lettered by the same statement once it has none, or it would loop forever
+CLAIM = text("""
+    WITH exhausted AS (
+        UPDATE "Job" SET status = 'failed', finished_at = now(), locked_until = NULL,
+                         last_error = 'Lease expired on the last attempt'
+        WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts
+    )
+    UPDATE "Job" SET status = 'running', attempts = attempts + 1,
+                     locked_until = now() + make_interval(secs => :lease)
+    WHERE id = (
+        SELECT id FROM "Job"
+        WHERE status IN ('queued', 'running') AND run_at <= now()
+          AND (locked_until IS NULL OR locked_until < now())
+          AND attempts < max_attempts
+        ORDER BY run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, name, payload, attempts, max_attempts
+""")
+
+
+def task(name, max_attempts=5, every=None):
+    """ Register a function as a job task under name.
+
+    Tasks run at least once, so they must be safe to repeat. every (seconds)
+    makes the worker schedule the task periodically.
+    """
+    def decorator(func):
+        TASKS[name] = Task(func, max_attempts, every)
+        return func
+    return decorator
+
+
+#----------------------------------------------------------------------------#
+# Enqueueing.
+#----------------------------------------------------------------------------#
+
+def job_values(name, payload=None, key=None, delay=0):
+    values = {
+        'name': name,
+        'payload': payload or {},
+        'idempotency_key': key,
+        'max_attempts': TASKS[name].max_attempts if name in TASKS else 5,
+    }
+    if delay:
+        values['run_at'] = db.func.now() + timedelta(seconds=delay)
+    return values
+
+
+def insert_jobs(session, jobs):
+    # A job whose idempotency key is already queued (or was ever run) is skipped
+    statement = insert(Job.__table__).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    for values in jobs:
+        session.execute(statement.values(**values))
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """Add a job in the current transaction; it is visible to workers once the caller commits."""
+    insert_jobs(db.session, [job_values(name, payload, key, delay)])
+
+
+def defer(name, payload=None, key=None, delay=0):
+    """ Queue a job to be enqueued when the current session commits.
+
+    Nothing is written if the transaction rolls back, and because the queue
+    lives in the same database, the job commits atomically with the write
+    that caused it: workers only ever see jobs for committed changes.
+    """
+    db.session.info.setdefault(PENDING, []).append(job_values(name, payload, key, delay))
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def write_deferred_jobs(session):
+    jobs = session.info.pop(PENDING, None)
+    if jobs:
+        insert_jobs(session, jobs)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def drop_deferred_jobs(session, transaction):
+    # The transaction rolled back or was closed without a commit
+    if transaction.parent is None:
+        session.info.pop(PENDING, None)
+
+
+#----------------------------------------------------------------------------#
+# Working.
+#----------------------------------------------------------------------------#
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def claim(lease=LEASE_SECONDS):
+    job = db.session.execute(CLAIM, {'lease': lease}).first()
+    db.session.commit()
+    return job
+
+
+def finish(job_id):
+    db.session.execute(
+        text('UPDATE "Job" SET status = \'done\', finished_at = now(), locked_until = NULL, last_error = NULL '
+             'WHERE id = :id'),
+        {'id': job_id}
+    )
+    db.session.commit()
+
+
+def fail(job, error):
+    if job.attempts >= job.max_attempts or job.name not in TASKS:
+        db.session.execute(
+            text('UPDATE "Job" SET status = \'failed\', finished_at = now(), locked_until = NULL, last_error = :error '
+                 'WHERE id = :id'),
+            {'id': job.id, 'error': error}
+        )
+    else:
+        db.session.execute(
+            text('UPDATE "Job" SET status = \'queued\', locked_until = NULL, last_error = :error, '
+                 'run_at = now() + make_interval(secs => :delay) WHERE id = :id'),
+            {'id': job.id, 'error': error, 'delay': backoff(job.attempts)}
+        )
+    db.session.commit()
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome; returns True if it succeeded."""
+    try:
+        task = TASKS.get(job.name)
+        if task is None:
+            raise LookupError('Unknown task {!r}'.format(job.name))
+        task.func(**job.payload)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        log.warning('Job %s (%s) failed on attempt %s', job.id, job.name, job.attempts, exc_info=True)
+        fail(job, traceback.format_exc(limit=20))
+        return False
+    finish(job.id)
+    return True
+
+
+def work(app, stop, poll_interval=1.0, burst=False):
+    """ One worker process: claim and run jobs until stop is set.
+
+    With burst, return as soon as the queue has nothing due instead of polling.
+    """
+    # The pool stops everything through stop, letting the current job finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    with app.app_context():
+        while not stop.is_set():
+            job = claim()
+            if job is None:
+                if burst:
+                    break
+                stop.wait(poll_interval)
+                continue
+            run_job(job)
+            db.session.remove()
+
+
+def schedule_periodic(now, scheduled):
+    """ Enqueue the periodic tasks whose interval has rolled over since the last call.
+
+    The job's key names the interval, so several schedulers (one per worker
+    host) agree on a single job per task and interval.
+    """
+    for name, task in TASKS.items():
+        if task.every:
+            slot = int(now // task.every)
+            if scheduled.get(name) != slot:
+                enqueue(name, key='{}:{}'.format(name, slot))
+                scheduled[name] = slot
+    db.session.commit()
+
+
+def run_pool(app, concurrency, poll_interval=1.0, burst=False):
+    """Run concurrency worker processes until SIGINT/SIGTERM, or until the queue drains with burst."""
+    context = multiprocessing.get_context('fork')
+    stop = context.Event()
+
+    def spawn():
+        # Forked workers must not share the parent's connections
+        dispose_engines(db, app)
+        process = context.Process(target=work, args=(app, stop, poll_interval, burst), daemon=True)
+        process.start()
+        return process
+
+    def shutdown(signum, frame):
+        log.info('Stopping workers after their current job')
+        stop.set()
+
+    previous = {sig: signal.signal(sig, shutdown) for sig in (signal.SIGINT, signal.SIGTERM)}
+    processes = [spawn() for _ in range(concurrency)]
+    scheduled = {}
+    try:
+        while not stop.is_set():
+            alive = [process for process in processes if process.is_alive()]
+            if burst:
+                if not alive:
+                    break
+            else:
+                schedule_periodic(time.time(), scheduled)
+                # Replace workers that died, e.g. killed by the OOM killer
+                for process in processes:
+                    if not process.is_alive():
+                        log.warning('Worker %s exited with %s, restarting', process.pid, process.exitcode)
+                processes = alive + [spawn() for _ in range(concurrency - len(alive))]
+            stop.wait(poll_interval)
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+
+@click.command('worker')
+@click.option('--concurrency', '-c', default=2, show_default=True, help='Worker processes.')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds between polls of an empty queue.')
+@click.option('--burst', is_flag=True, help='Exit once no jobs are due instead of waiting for more.')
+@with_appcontext
+def worker_command(concurrency, poll_interval, burst):
+    """Run background jobs from the Job table."""
+    click.echo('Starting {} workers for: {}'.format(concurrency, ', '.join(sorted(TASKS))))
+    run_pool(current_app._get_current_object(), concurrency, poll_interval, burst)
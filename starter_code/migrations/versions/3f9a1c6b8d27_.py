@@ -0,0 +1,49 @@
+"""add upcoming/past show counter tables
+
+Revision ID: 3f9a1c6b8d27
+Revises: e71b5d08c2f6
+Create Date: 2026-10-18 15:21:08.114620
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c6b8d27'
+down_revision = 'e71b5d08c2f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, owner in (('VenueShowCount', 'Venue'), ('ArtistShowCount', 'Artist')):
+        key = '{}_id'.format(owner.lower())
+        op.create_table(table,
+        sa.Column(key, sa.Integer(), nullable=False),
+        sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint([key], ['{}.id'.format(owner)], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(key)
+        )
+    op.create_table('ShowCountClock',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('counted_until', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Count the existing shows as of now; `flask counts roll` keeps them current from here. Only listed
+    # shows, with both a venue and an artist, are counted, as counters.LISTED has it
+    op.execute('INSERT INTO "ShowCountClock" (id, counted_until) VALUES (1, now())')
+    for table, key in (('VenueShowCount', 'venue_id'), ('ArtistShowCount', 'artist_id')):
+        op.execute(
+            'INSERT INTO "{table}" ({key}, upcoming_shows_count, past_shows_count) '
+            'SELECT {key}, count(*) FILTER (WHERE start_time > now()), count(*) FILTER (WHERE start_time <= now()) '
+            'FROM "Show" WHERE venue_id IS NOT NULL AND artist_id IS NOT NULL GROUP BY {key}'.format(table=table, key=key)
+        )
+
+
+def downgrade():
+    op.drop_table('ShowCountClock')
+    op.drop_table('ArtistShowCount')
+    op.drop_table('VenueShowCount')
@@ -0,0 +1,26 @@
+"""add venue area and show schedule indexes
+
+Revision ID: 5b1e9c3d7a21
+Revises: 2c67b7b2b2b4
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e9c3d7a21'
+down_revision = '2c67b7b2b2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
@@ -0,0 +1,31 @@
+"""add venue coordinates and geohash index
+
+Revision ID: 7e3c9b1d4f60
+Revises: d52b7f3e9a14
+Create Date: 2026-10-18 18:03:51.227604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3c9b1d4f60'
+down_revision = 'd52b7f3e9a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing venues are geocoded by `flask geocode`
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12, collation='C'), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    op.drop_column('Venue', 'geohash')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
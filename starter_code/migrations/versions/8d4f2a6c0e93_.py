@@ -0,0 +1,57 @@
+"""convert Show.start_time to a timezone-aware timestamp
+
+Revision ID: 8d4f2a6c0e93
+Revises: 5b1e9c3d7a21
+Create Date: 2026-10-18 10:03:17.552981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2a6c0e93'
+down_revision = '5b1e9c3d7a21'
+branch_labels = None
+depends_on = None
+
+# Rows converted per UPDATE; each batch commits on its own so row locks are short lived
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('start_time_ts', sa.DateTime(timezone=True), nullable=True))
+
+    # Copy the text timestamps across in id ranges outside of the migration transaction
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(sa.text('SELECT min(id), max(id) FROM "Show"')).first()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                bind.execute(
+                    sa.text(
+                        'UPDATE "Show" SET start_time_ts = start_time::timestamptz '
+                        'WHERE id >= :start AND id < :stop AND start_time_ts IS NULL'
+                    ),
+                    start=start,
+                    stop=start + BATCH_SIZE,
+                )
+
+    # Rows inserted by the old code while the backfill ran are picked up here
+    op.execute('UPDATE "Show" SET start_time_ts = start_time::timestamptz WHERE start_time_ts IS NULL')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.drop_column('Show', 'start_time')
+    op.alter_column('Show', 'start_time_ts', new_column_name='start_time', nullable=False)
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_Show_start_time', 'Show', ['start_time'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time', table_name='Show')
+    op.alter_column('Show', 'start_time',
+                    type_=sa.String(length=120),
+                    postgresql_using='start_time::text')
@@ -0,0 +1,25 @@
+"""add running job lease index for dead-lettering abandoned jobs
+
+Revision ID: 9c2e4f7a1d35
+Revises: b7d3e5a1c084
+Create Date: 2026-10-19 09:12:31.402718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e4f7a1d35'
+down_revision = 'b7d3e5a1c084'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Job_lease', 'Job', ['locked_until'], unique=False,
+                    postgresql_where=sa.text("status = 'running'"))
+
+
+def downgrade():
+    op.drop_index('ix_Job_lease', table_name='Job')
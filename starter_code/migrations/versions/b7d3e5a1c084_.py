@@ -0,0 +1,24 @@
+"""add artist show index for artist pages and calendar feeds
+
+Revision ID: b7d3e5a1c084
+Revises: f4b8d2a6c913
+Create Date: 2026-10-18 23:02:44.918306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e5a1c084'
+down_revision = 'f4b8d2a6c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
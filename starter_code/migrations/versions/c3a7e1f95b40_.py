@@ -0,0 +1,32 @@
+"""add pg_trgm search indexes on venue and artist
+
+Revision ID: c3a7e1f95b40
+Revises: 8d4f2a6c0e93
+Create Date: 2026-10-18 11:26:05.104377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a7e1f95b40'
+down_revision = '8d4f2a6c0e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Artist_state_city', 'Artist', ['state', 'city'], unique=False)
+    for table in ('Venue', 'Artist'):
+        for column in ('name', 'city'):
+            op.create_index('ix_{}_{}_trgm'.format(table, column), table, [column], unique=False,
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        for column in ('name', 'city'):
+            op.drop_index('ix_{}_{}_trgm'.format(table, column), table_name=table)
+    op.drop_index('ix_Artist_state_city', table_name='Artist')
@@ -0,0 +1,26 @@
+"""add the show counters' changed_at
+
+Revision ID: d41a7e9c2b58
+Revises: 9c2e4f7a1d35
+Create Date: 2026-10-19 14:37:52.918304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7e9c2b58'
+down_revision = '9c2e4f7a1d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ShowCountClock', sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False,
+                                              server_default=sa.text('now()')))
+    op.alter_column('ShowCountClock', 'changed_at', server_default=None)
+
+
+def downgrade():
+    op.drop_column('ShowCountClock', 'changed_at')
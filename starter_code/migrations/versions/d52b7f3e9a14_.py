@@ -0,0 +1,26 @@
+"""add GIN indexes on venue and artist genres
+
+Revision ID: d52b7f3e9a14
+Revises: a64d2e8f1b57
+Create Date: 2026-10-18 17:12:37.560912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd52b7f3e9a14'
+down_revision = 'a64d2e8f1b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.create_index('ix_{}_genres'.format(table), table, ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_index('ix_{}_genres'.format(table), table_name=table)
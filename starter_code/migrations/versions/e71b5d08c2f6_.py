@@ -0,0 +1,29 @@
+"""add updated_at version columns
+
+Revision ID: e71b5d08c2f6
+Revises: c3a7e1f95b40
+Create Date: 2026-10-18 12:40:52.771309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71b5d08c2f6'
+down_revision = 'c3a7e1f95b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True),
+                                       server_default=sa.text('now()'), nullable=False))
+        op.create_index('ix_{}_updated_at'.format(table), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_index('ix_{}_updated_at'.format(table), table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,68 @@
+"""add show end times and exclusion constraints against double bookings
+
+Revision ID: f4b8d2a6c913
+Revises: 7e3c9b1d4f60
+Create Date: 2026-10-18 21:14:07.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8d2a6c913'
+down_revision = '7e3c9b1d4f60'
+branch_labels = None
+depends_on = None
+
+
+# Shows listed with the same start time at one venue, or for one artist; the exclusion
+# constraints can't be added until they are moved or deleted
+CLASHES = '''
+SELECT a.id, b.id, a.start_time
+FROM "Show" a JOIN "Show" b
+  ON a.id < b.id AND a.start_time = b.start_time AND (a.venue_id = b.venue_id OR a.artist_id = b.artist_id)
+ORDER BY a.start_time
+LIMIT 20
+'''
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+    # Existing shows get the default two hours, cut short where the venue or the artist
+    # has its next show sooner, so shows that were listed back to back don't overlap
+    op.execute('''
+        UPDATE "Show" SET end_time = LEAST(
+            next.start_time + interval '2 hours',
+            COALESCE(next.next_at_venue, 'infinity'),
+            COALESCE(next.next_for_artist, 'infinity'))
+        FROM (
+            SELECT id, start_time,
+                   lead(start_time) OVER (PARTITION BY venue_id ORDER BY start_time, id) AS next_at_venue,
+                   lead(start_time) OVER (PARTITION BY artist_id ORDER BY start_time, id) AS next_for_artist
+            FROM "Show"
+        ) AS next
+        WHERE "Show".id = next.id
+    ''')
+    clashes = op.get_bind().execute(sa.text(CLASHES)).fetchall()
+    if clashes:
+        raise RuntimeError('Shows double-booked at the same start time, move or delete one of each pair first: '
+                           + ', '.join('{} and {} at {}'.format(*clash) for clash in clashes))
+    op.alter_column('Show', 'end_time', nullable=False)
+    op.create_check_constraint('ck_Show_ends_after_start', 'Show', 'end_time > start_time')
+    for column in ('venue_id', 'artist_id'):
+        op.create_exclude_constraint(
+            'ex_Show_{}_booked'.format(column), 'Show',
+            (column, '='),
+            (sa.func.tstzrange(sa.column('start_time'), sa.column('end_time')), '&&'),
+            using='gist'
+        )
+
+
+def downgrade():
+    for column in ('artist_id', 'venue_id'):
+        op.drop_constraint('ex_Show_{}_booked'.format(column), 'Show')
+    op.drop_constraint('ck_Show_ends_after_start', 'Show')
+    op.drop_column('Show', 'end_time')
@@ -1,14 +1,65 @@
 
-from flask_sqlalchemy import SQLAlchemy
+from datetime import timedelta
+
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, ExcludeConstraint
+
+from dbpool import InstrumentedQueuePool
+from routing import RoutingSQLAlchemy
+
+# Every engine (primary and replica binds) gets the instrumented pool; sizing comes from config.
+# Reads inside GET requests are routed to a replica bind when one is configured.
+db = RoutingSQLAlchemy(engine_options={'poolclass': InstrumentedQueuePool})
+
+
+def genres_contain(column, genres):
+  # psycopg2 sends a Python list as text[], which has no @> operator against varchar[]
+  return column.contains(db.cast(list(genres), ARRAY(db.String)))
+
+
+def genres_overlap(column, genres):
+  # Any of the genres, with the same cast as genres_contain()
+  return column.overlap(db.cast(list(genres), ARRAY(db.String)))
+
+
+# Length of a show booked without an end time
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+
+def default_end_time(context):
+  return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
+
+def booked_during(column):
+  # A venue (or an artist) can't be booked for two shows whose [start_time, end_time) overlap;
+  # the integer equality in a GiST index comes from btree_gist
+  return ExcludeConstraint(
+    (column, '='),
+    (db.func.tstzrange(db.column('start_time'), db.column('end_time')), '&&'),
+    name = 'ex_Show_{}_booked'.format(column),
+    using = 'gist'
+  )
 
-db = SQLAlchemy()
 
 class Show(db.Model):
   __tablename__ = 'Show'
   id = db.Column(db.Integer, primary_key = True)
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
-  start_time = db.Column(db.String(120), nullable = False)
+  start_time = db.Column(db.DateTime(timezone=True), nullable = False)
+  end_time = db.Column(db.DateTime(timezone=True), nullable = False, default = default_end_time)
+  updated_at = db.Column(db.DateTime(timezone=True), nullable = False, server_default = db.func.now(), onupdate = db.func.now())
+
+  # Upcoming/past show lookups for a venue or an artist filter on its id and range-scan start_time
+  # The exclusion constraints' GiST indexes serve the overlap checks in booking.py
+  __table_args__ = (
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_Show_start_time', 'start_time'),
+    db.Index('ix_Show_updated_at', 'updated_at'),
+    db.CheckConstraint('end_time > start_time', name = 'ck_Show_ends_after_start'),
+    booked_during('venue_id'),
+    booked_during('artist_id'),
+  )
 
 
 class Venue(db.Model):
@@ -20,16 +71,36 @@ class Venue(db.Model):
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False, unique=True)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(ARRAY(db.String), nullable=False)
     image_link = db.Column(db.String(500))
     website = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     seeking_talent= db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String(200))
+    # Set on insert and bumped on every update; drives the ETag/Last-Modified validators
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    # City centre from the bundled gazetteer (see geo.py); NULL when the city isn't in it
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # C collation so a geohash prefix is a B-tree range
+    geohash = db.Column(db.String(12, collation='C'))
     
     # Venue is the parent (one-to-many) of a Show (Artist is also a foreign key, in def. of Show)
     # In the parent is where we put the db.relationship in SQLAlchemy
-    show = db.relationship('Show', backref='venue', lazy=True)
+    show = db.relationship('Show', backref='venue', lazy=True, order_by='Show.start_time')
+
+    # The /venues listing groups and orders venues by state then city
+    # Search matches name and city with pg_trgm, so ILIKE '%term%' can use a GIN index
+    __table_args__ = (
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+        # GIN on the genre arrays serves @> (all of) and && (any of) genre filters
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        # Radius searches scan a few geohash prefix ranges instead of every venue
+        db.Index('ix_Venue_geohash', 'geohash'),
+    )
 
 
 class Artist(db.Model):
@@ -41,13 +112,75 @@ class Artist(db.Model):
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False, unique=True)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(ARRAY(db.String), nullable=False)
     image_link = db.Column(db.String(500))
     website = db.Column(db.String(500))
     facebook_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String(200))
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     
     # Artist is the parent (one-to-many) of a Show (Venue is also a foreign key, in def. of Show)
     # In the parent is where we put the db.relationship in SQLAlchemy
-    show = db.relationship('Show', backref='artist', lazy=True)
\ No newline at end of file
+    show = db.relationship('Show', backref='artist', lazy=True, order_by='Show.start_time')
+
+    # Same search indexes as Venue
+    __table_args__ = (
+        db.Index('ix_Artist_state_city', 'state', 'city'),
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+    )
+
+
+# Denormalized upcoming/past show counts, maintained by counters.py. "Upcoming" means starting
+# after ShowCountClock.counted_until, which a periodic job moves forward; a missing row means 0.
+
+class VenueShowCount(db.Model):
+  __tablename__ = 'VenueShowCount'
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key = True)
+  upcoming_shows_count = db.Column(db.Integer, nullable = False, server_default = '0')
+  past_shows_count = db.Column(db.Integer, nullable = False, server_default = '0')
+
+
+class ArtistShowCount(db.Model):
+  __tablename__ = 'ArtistShowCount'
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key = True)
+  upcoming_shows_count = db.Column(db.Integer, nullable = False, server_default = '0')
+  past_shows_count = db.Column(db.Integer, nullable = False, server_default = '0')
+
+
+class ShowCountClock(db.Model):
+  # A single row; shows starting up to counted_until are counted as past
+  __tablename__ = 'ShowCountClock'
+  id = db.Column(db.Integer, primary_key = True)
+  counted_until = db.Column(db.DateTime(timezone=True), nullable = False)
+  # When a roll or a rebuild last changed the counts; counted_until moves on every roll, so the
+  # listings' versions go by this instead
+  changed_at = db.Column(db.DateTime(timezone=True), nullable = False)
+
+
+class Job(db.Model):
+  # Background job queue, worked by `flask worker` (see jobs.py)
+  __tablename__ = 'Job'
+  id = db.Column(db.BigInteger, primary_key = True)
+  name = db.Column(db.String(120), nullable = False)
+  payload = db.Column(JSONB, nullable = False, server_default = '{}')
+  # Enqueueing the same key twice is a no-op
+  idempotency_key = db.Column(db.String(200), unique = True)
+  status = db.Column(db.String(20), nullable = False, server_default = 'queued')
+  attempts = db.Column(db.Integer, nullable = False, server_default = '0')
+  max_attempts = db.Column(db.Integer, nullable = False, server_default = '5')
+  run_at = db.Column(db.DateTime(timezone=True), nullable = False, server_default = db.func.now())
+  locked_until = db.Column(db.DateTime(timezone=True))
+  last_error = db.Column(db.Text)
+  created_at = db.Column(db.DateTime(timezone=True), nullable = False, server_default = db.func.now())
+  finished_at = db.Column(db.DateTime(timezone=True))
+
+  # Workers poll for due jobs in run_at order; finished jobs drop out of the partial index.
+  # ix_Job_lease finds the running jobs whose lease expired without reading the queue
+  __table_args__ = (
+    db.Index('ix_Job_due', 'run_at', postgresql_where=db.text("status IN ('queued', 'running')")),
+    db.Index('ix_Job_lease', 'locked_until', postgresql_where=db.text("status = 'running'")),
+  )
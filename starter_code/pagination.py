@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import dateutil.parser
+from flask import abort, current_app, request
+
+
+def parse_datetime_arg(name):
+    """Read an optional ISO-8601 date/datetime query argument, rejecting anything unparsable."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return dateutil.parser.isoparse(value)
+    except ValueError:
+        abort(400)
+
+
+def encode_show_cursor(start_time, show_id):
+    """Opaque keyset cursor for a position in the (start_time, id) show ordering."""
+    return '{}_{}'.format(start_time.isoformat(), show_id)
+
+
+def decode_show_cursor(cursor):
+    try:
+        start_time, show_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(start_time), int(show_id)
+    except ValueError:
+        abort(400)
+
+
+def page_size(default_key, max_key, name='per_page'):
+    """Page size from the query string, falling back to and capped by config values."""
+    size = min(
+        request.args.get(name, current_app.config[default_key], type=int),
+        current_app.config[max_key]
+    )
+    if size < 1:
+        abort(400)
+    return size
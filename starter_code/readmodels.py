@@ -0,0 +1,120 @@
+""" Read models for the listing, search and detail pages.
+
+Each read selects only the columns its page renders and runs as a Core
+statement on the session's connection, so replica routing still applies
+but no entities are built: nothing enters the identity map or is tracked
+for changes. Rows come back as the named tuples below, which are plain
+tuples with __slots__ = (), and templates read their fields by name.
+"""
+from collections import namedtuple
+from itertools import groupby
+
+from models import db, Artist, Show, Venue, VenueShowCount
+
+
+# /venues: venues grouped by area, with their upcoming show counts
+Area = namedtuple('Area', ['city', 'state', 'venues'])
+VenueItem = namedtuple('VenueItem', ['id', 'name', 'num_upcoming_shows'])
+
+# /artists
+ArtistItem = namedtuple('ArtistItem', ['id', 'name'])
+
+# Venue and artist search; total is the number of matches over all pages
+SearchResult = namedtuple('SearchResult', ['id', 'name', 'city', 'state', 'total'])
+
+# Show tiles on /shows and /shows/nearby
+ShowTile = namedtuple('ShowTile', ['id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name',
+                                   'artist_image_link'])
+NearbyShowTile = namedtuple('NearbyShowTile', ShowTile._fields + ('distance_km',))
+
+# Detail pages, with the shows on them
+VenuePage = namedtuple('VenuePage', ['id', 'name', 'genres', 'city', 'state', 'address', 'phone', 'website',
+                                     'facebook_link', 'seeking_talent', 'seeking_description', 'image_link'])
+VenueShow = namedtuple('VenueShow', ['start_time', 'artist_id', 'artist_name', 'artist_image_link'])
+ArtistPage = namedtuple('ArtistPage', ['id', 'name', 'genres', 'city', 'state', 'address', 'phone', 'website',
+                                       'facebook_link', 'seeking_venue', 'seeking_description', 'image_link'])
+ArtistShow = namedtuple('ArtistShow', ['start_time', 'venue_id', 'venue_name', 'venue_image_link'])
+
+
+def fetch(row_type, query):
+    """ Run a column query and return its rows as row_type tuples.
+
+    The query must select row_type's fields, in order.
+    """
+    # Rows are made into tuples as they are read, so the result's own rows are never all held at once
+    return list(map(row_type._make, db.session.execute(query.statement)))
+
+
+def columns(model, row_type):
+    return [getattr(model, field) for field in row_type._fields]
+
+
+#----------------------------------------------------------------------------#
+# Listings.
+#----------------------------------------------------------------------------#
+
+def venue_areas(criteria=()):
+    """ [Area] of the venues matching criteria, by state then city.
+
+    The rows arrive ordered by area, so they are split in a single pass.
+    """
+    query = db.session.query(
+        Venue.city,
+        Venue.state,
+        Venue.id,
+        Venue.name,
+        db.func.coalesce(VenueShowCount.upcoming_shows_count, 0)
+        ).\
+        outerjoin(VenueShowCount, VenueShowCount.venue_id == Venue.id).\
+        filter(*criteria).\
+        order_by(Venue.state, Venue.city, Venue.id)
+    make = VenueItem._make
+    return [Area(city, state, [make(row[2:]) for row in rows])
+            for (city, state), rows in groupby(db.session.execute(query.statement), key=lambda row: row[:2])]
+
+
+def artist_items(criteria=()):
+    return fetch(ArtistItem, db.session.query(*columns(Artist, ArtistItem)).filter(*criteria))
+
+
+def show_tile_query():
+    """The ShowTile columns; callers add filters and ordering, then fetch(ShowTile, query)."""
+    return db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.venue_id,
+        Venue.name,
+        Show.artist_id,
+        Artist.name,
+        Artist.image_link
+        ).\
+        join(Venue, Show.venue_id == Venue.id).\
+        join(Artist, Show.artist_id == Artist.id)
+
+
+#----------------------------------------------------------------------------#
+# Detail pages.
+#----------------------------------------------------------------------------#
+
+def venue_page(venue_id):
+    """(VenuePage, [VenueShow] by start time), or (None, []) for an unknown venue."""
+    venues = fetch(VenuePage, db.session.query(*columns(Venue, VenuePage)).filter(Venue.id == venue_id))
+    if not venues:
+        return None, []
+    shows = fetch(VenueShow, db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).
+                  join(Artist, Show.artist_id == Artist.id).
+                  filter(Show.venue_id == venue_id).
+                  order_by(Show.start_time, Show.id))
+    return venues[0], shows
+
+
+def artist_page(artist_id):
+    """(ArtistPage, [ArtistShow] by start time), or (None, []) for an unknown artist."""
+    artists = fetch(ArtistPage, db.session.query(*columns(Artist, ArtistPage)).filter(Artist.id == artist_id))
+    if not artists:
+        return None, []
+    shows = fetch(ArtistShow, db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).
+                  join(Venue, Show.venue_id == Venue.id).
+                  filter(Show.artist_id == artist_id).
+                  order_by(Show.start_time, Show.id))
+    return artists[0], shows
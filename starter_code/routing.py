@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+# Cookie holding the time until which a client that just wrote reads from the primary
+STICKY_COOKIE = 'read_primary_until'
+
+# Seconds a standby is behind its primary; 0 when it has replayed everything it
+# received, and also on a server that is not a standby at all (a plain local
+# database standing in for a replica)
+LAG_QUERY = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class RoutingSession(SignallingSession):
+    """ Session that sends reads to the replica bind picked for the request.
+
+    Flushes always go to the primary, as does anything outside a request that
+    was routed to a replica (CLI commands, migrations, writes).
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = g.get('read_bind') if has_app_context() else None
+        if bind is not None and not self._flushing:
+            return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter(object):
+    """ Picks a replica bind for read-only requests.
+
+    GET/HEAD requests read from a random healthy bind in REPLICA_BINDS. A
+    replica is skipped while its lag exceeds REPLICA_MAX_LAG seconds or it
+    cannot be reached; the lag is re-checked every REPLICA_LAG_CHECK_INTERVAL
+    seconds. Any other request goes to the primary and makes the client read
+    from the primary for long enough that the next page (e.g. the redirect
+    after an edit) sees its own write.
+    """
+
+    def __init__(self, app=None):
+        self.binds = ()
+        self.max_lag = 5.0
+        self.check_interval = 5.0
+        self._health = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.db = app.extensions['sqlalchemy'].db
+        self.binds = tuple(app.config.get('REPLICA_BINDS', ()))
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5.0)
+        self.check_interval = app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5.0)
+        app.before_request(self.route_request)
+        app.after_request(self.stick_after_write)
+        app.extensions['replica_router'] = self
+
+    @property
+    def sticky_seconds(self):
+        # A replica may be up to max_lag behind, plus however long ago it was last checked
+        return self.max_lag + self.check_interval
+
+    def lag(self, bind):
+        """Replication lag of a bind in seconds, or None if it can't be queried."""
+        try:
+            with self.db.get_engine(self.app, bind).connect() as connection:
+                return float(connection.execute(LAG_QUERY).scalar())
+        except SQLAlchemyError:
+            self.app.logger.warning('Replica %s is unreachable', bind, exc_info=True)
+            return None
+
+    def is_healthy(self, bind):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, healthy = self._health.get(bind, (None, False))
+            if checked_at is not None and now - checked_at < self.check_interval:
+                return healthy
+            # Claim the check so concurrent requests keep the previous answer meanwhile
+            self._health[bind] = (now, healthy)
+        lag = self.lag(bind)
+        healthy = lag is not None and lag <= self.max_lag
+        if not healthy and lag is not None:
+            self.app.logger.warning('Skipping replica %s, %.1fs behind', bind, lag)
+        with self._lock:
+            self._health[bind] = (now, healthy)
+        return healthy
+
+    def healthy_binds(self):
+        return [bind for bind in self.binds if self.is_healthy(bind)]
+
+    def route_request(self):
+        g.read_bind = None
+        if not self.binds or request.method not in READ_METHODS:
+            return
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+                return
+        except ValueError:
+            pass
+        binds = self.healthy_binds()
+        if binds:
+            g.read_bind = random.choice(binds)
+
+    def stick_after_write(self, response):
+        if self.binds and request.method not in READ_METHODS and response.status_code < 400:
+            until = int(time.time() + self.sticky_seconds) + 1
+            response.set_cookie(STICKY_COOKIE, str(until), max_age=int(self.sticky_seconds) + 1,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+router = ReplicaRouter()
@@ -0,0 +1,172 @@
+import re
+import sqlite3
+from collections import namedtuple
+
+from models import db, genres_contain
+from readmodels import SearchResult, fetch
+from validation import STATES
+
+
+# A "City, ST" term; see parse_term()
+Place = namedtuple('Place', ['city', 'state'])
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so user input is matched literally."""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_term(term):
+    """ A Place for "City, ST" terms whose last part is a state code, or else the term itself.
+
+    Any other term with a comma, such as a band called "Earth, Wind & Fire",
+    is searched for as a whole.
+    """
+    term = term.strip()
+    city, comma, state = term.rpartition(',')
+    if comma and city.strip() and state.strip().upper() in STATES:
+        return Place(city.strip(), state.strip().upper())
+    return term
+
+
+def search_criteria(model, term):
+    """ (criteria, order) of a search over Venue or Artist; see search_entities().
+
+    Both kinds of term are ranked by trigram similarity, of the city for
+    places and of the name otherwise, then by name.
+    """
+    query = parse_term(term)
+    if isinstance(query, Place):
+        criteria = db.and_(model.state == query.state, model.city.ilike(escape_like(query.city) + '%'))
+        rank = db.func.similarity(model.city, query.city)
+    else:
+        pattern = '%{}%'.format(escape_like(query))
+        matches = [model.name.ilike(pattern), model.city.ilike(pattern), genres_contain(model.genres, [query])]
+        if query.upper() in STATES:
+            matches.append(model.state == query.upper())
+        criteria = db.or_(*matches)
+        rank = db.func.similarity(model.name, query)
+    return criteria, [rank.desc(), model.name, model.id]
+
+
+def search_entities(model, term, page=1, per_page=20):
+    """ Ranked, paginated search over Venue or Artist.
+
+    "City, ST" terms match venues/artists in that state whose city starts
+    with the given one, using the (state, city) index. Any other term is
+    matched against name and city with the pg_trgm GIN indexes, against genres
+    by array containment and, when it is a state code, against the state.
+
+    Returns (rows, count). Each row is a SearchResult; count is
+    the total number of matches, computed by a window function in the same query
+    instead of a second COUNT(*) round trip. A blank term matches nothing.
+    """
+    if not term.strip():
+        # Rather than count and sort the whole table for a pattern that matches every row
+        return [], 0
+    criteria, order = search_criteria(model, term)
+    columns = [model.id, model.name, model.city, model.state]
+
+    rows = fetch(SearchResult, db.session.query(*columns, db.func.count().over()).
+                 filter(criteria).
+                 order_by(*order).
+                 limit(per_page).
+                 offset((page - 1) * per_page))
+
+    if rows:
+        count = rows[0].total
+    elif page > 1:
+        # Paged past the end; the window count is only available on non-empty pages
+        count = db.session.query(db.func.count(model.id)).filter(criteria).scalar()
+    else:
+        count = 0
+    return rows, count
+
+
+#----------------------------------------------------------------------------#
+# SQLite fallback.
+#----------------------------------------------------------------------------#
+
+def trigrams(text):
+    # As pg_trgm splits them: lowercased words, padded with two spaces in front and one behind
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = '  {} '.format(word)
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """pg_trgm's similarity(): the share of trigrams a and b have in common."""
+    a, b = trigrams(a or ''), trigrams(b or '')
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SqliteSearchIndex(object):
+    """ search_entities() over an SQLite FTS5 table, to search without a Postgres server.
+
+    Matches and ranks as the Postgres search does, except that SQLite's LIKE
+    ignores case for ASCII letters only. The trigram tokenizer finds names and
+    cities for terms of three characters or more, but the genre and state
+    criteria are checked row by row: it is meant for tests and small data sets.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path)
+        self.connection.create_function('similarity', 2, similarity, deterministic=True)
+        # genres holds one genre per line, with a newline on either side, for exact lookups with instr()
+        self.connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS entity "
+            "USING fts5(name, city, id UNINDEXED, state UNINDEXED, genres UNINDEXED, tokenize='trigram')"
+        )
+
+    def add(self, rows):
+        """Index (id, name, city, state, genres) rows, e.g. a query of those columns."""
+        self.connection.executemany(
+            'INSERT INTO entity (id, name, city, state, genres) VALUES (?, ?, ?, ?, ?)',
+            ((entity_id, name, city, state, '\n{}\n'.format('\n'.join(genres or ())))
+             for entity_id, name, city, state, genres in rows)
+        )
+        self.connection.commit()
+
+    def criteria(self, term):
+        query = parse_term(term)
+        if isinstance(query, Place):
+            return ("state = ? AND city LIKE ? ESCAPE '\\'", [query.state, escape_like(query.city) + '%'],
+                    'similarity(city, ?)', [query.city])
+        genre = "instr(genres, ?) > 0"
+        params = ['\n{}\n'.format(query)]
+        if len(query) >= 3:
+            text = "rowid IN (SELECT rowid FROM entity WHERE entity MATCH ?)"
+            params.insert(0, '{{name city}}: "{}"'.format(query.replace('"', '""')))
+        else:
+            text = "(name LIKE ? ESCAPE '\\' OR city LIKE ? ESCAPE '\\')"
+            pattern = '%{}%'.format(escape_like(query))
+            params[:0] = [pattern, pattern]
+        where = [text, genre]
+        if query.upper() in STATES:
+            where.append('state = ?')
+            params.append(query.upper())
+        return '({})'.format(' OR '.join(where)), params, 'similarity(name, ?)', [query]
+
+    def search(self, term, page=1, per_page=20):
+        """(rows, count) for term, as search_entities() returns them."""
+        if not term.strip():
+            return [], 0
+        where, params, rank, rank_params = self.criteria(term)
+        rows = [SearchResult._make(row) for row in self.connection.execute(
+            'SELECT id, name, city, state, count(*) OVER () FROM entity WHERE {} '
+            'ORDER BY {} DESC, name, id LIMIT ? OFFSET ?'.format(where, rank),
+            params + rank_params + [per_page, (page - 1) * per_page]
+        )]
+        if rows:
+            count = rows[0].total
+        elif page > 1:
+            count = self.connection.execute('SELECT count(*) FROM entity WHERE ' + where, params).fetchone()[0]
+        else:
+            count = 0
+        return rows, count
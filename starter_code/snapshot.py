@@ -0,0 +1,265 @@
+""" Static snapshot of the public pages, for a web server to serve without the app.
+
+`flask snapshot` renders /venues, /artists, /shows and every /venues/<id>
+and /artists/<id> page through the app's own views, in a pool of worker
+processes, into SNAPSHOT_DIR: /venues/1 is written to venues/1.html. Each
+file is written under a temporary name and renamed, and manifest.json last,
+so a server never reads a partial page.
+
+A later run only re-renders the pages whose rows changed since the previous
+one started: venues, artists and shows with a newer updated_at (and the pages
+on the other side of their shows), shows that have started since, which move
+from upcoming to past, and ids that appeared. Pages of deleted rows are
+removed. The listings are re-rendered when their version (see cache.py)
+moved, and everything when the asset bundles the pages link have changed.
+
+The pages are rendered for an anonymous visitor, in the default locale and
+time zone. A server can take over plain GETs and pass everything else to the
+app, e.g. with nginx: `try_files $uri.html @fyyur;` for requests without a
+query string or session cookie.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from assets import assets
+from cache import artists_version, cache, page_key, shows_version, venues_version
+from dbpool import dispose_engines
+from instrumentation import request_log
+from models import db, Artist, Show, Venue
+from routing import STICKY_COOKIE
+
+
+MANIFEST = 'manifest.json'
+
+LISTINGS = {
+    '/venues': venues_version,
+    '/artists': artists_version,
+    '/shows': shows_version,
+}
+
+# updated_at is set when the writing transaction started, so a row committed just after the previous
+# snapshot began can carry an earlier stamp; rows stamped this long before it are looked at again
+WRITE_SLACK = timedelta(minutes=5)
+
+# Pages per task handed to a worker
+CHUNK_SIZE = 50
+
+
+def page_file(path):
+    return path.lstrip('/') + '.html'
+
+
+def venue_path(venue_id):
+    return '/venues/{}'.format(venue_id)
+
+
+def artist_path(artist_id):
+    return '/artists/{}'.format(artist_id)
+
+
+def page_cache_key(path):
+    # The names the views cache their pages under: /venues/1 is 'venue:1'
+    kind, _, entity_id = path.strip('/').partition('/')
+    return page_key('{}:{}'.format(kind[:-1], entity_id) if entity_id else kind)
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_file(path, data):
+    """Replace path with data in one rename; readable by the web server's user."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+#----------------------------------------------------------------------------#
+# Changes.
+#----------------------------------------------------------------------------#
+
+def listing_versions():
+    return {path: repr(tuple(version())) for path, version in LISTINGS.items()}
+
+
+def changed_pages(since, until):
+    """ Paths of the detail pages whose rows were written after since, or with a show starting in (since, until].
+
+    Each query range-scans an updated_at or start_time index.
+    """
+    venue_ids = {venue_id for venue_id, in db.session.query(Venue.id).filter(Venue.updated_at > since)}
+    artist_ids = {artist_id for artist_id, in db.session.query(Artist.id).filter(Artist.updated_at > since)}
+    shows = db.session.query(Show.venue_id, Show.artist_id).\
+        filter(db.or_(Show.updated_at > since, db.and_(Show.start_time > since, Show.start_time <= until)))
+    # Detail pages list the name and image of the other side of each show
+    if venue_ids:
+        shows = shows.union(db.session.query(Show.venue_id, Show.artist_id).filter(Show.venue_id.in_(venue_ids)))
+    if artist_ids:
+        shows = shows.union(db.session.query(Show.venue_id, Show.artist_id).filter(Show.artist_id.in_(artist_ids)))
+    for venue_id, artist_id in shows:
+        venue_ids.add(venue_id)
+        artist_ids.add(artist_id)
+    return {venue_path(venue_id) for venue_id in venue_ids if venue_id is not None} | \
+        {artist_path(artist_id) for artist_id in artist_ids if artist_id is not None}
+
+
+def detail_pages():
+    return {venue_path(venue_id) for venue_id, in db.session.query(Venue.id)} | \
+        {artist_path(artist_id) for artist_id, in db.session.query(Artist.id)}
+
+
+#----------------------------------------------------------------------------#
+# Rendering.
+#----------------------------------------------------------------------------#
+
+# The test client and output directory of the current process, see start_worker()
+worker = {}
+
+
+def start_worker(app, directory):
+    client = app.test_client()
+    # Render from the primary: a lagging replica would snapshot the old page
+    client.set_cookie('localhost', STICKY_COOKIE, str(time.time() + 24 * 3600))
+    worker.update(client=client, directory=directory)
+
+
+def render_pages(paths):
+    """ [(path, status, manifest entry)] for paths, writing the pages that rendered.
+
+    The entry is None unless the status is 200.
+    """
+    client, directory = worker['client'], worker['directory']
+    results = []
+    for path in paths:
+        # The cached copy can predate a write made outside the app; the fresh render replaces it
+        cache.delete_many(page_cache_key(path))
+        response = client.get(path)
+        entry = None
+        if response.status_code == 200:
+            body = response.get_data()
+            entry = {'file': page_file(path), 'bytes': len(body), 'etag': hashlib.sha1(body).hexdigest()}
+            write_file(os.path.join(directory, entry['file']), body)
+        results.append((path, response.status_code, entry))
+    return results
+
+
+def render(app, directory, paths, workers):
+    """Yield render_pages() results for paths, rendered by a pool of workers forked from this process."""
+    chunks = [paths[i:i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+    # A rebuild of a few pages isn't worth forking for
+    workers = min(workers, len(chunks))
+    if workers <= 1:
+        start_worker(app, directory)
+        for chunk in chunks:
+            yield render_pages(chunk)
+        return
+    # Forked workers must not share the parent's connections
+    dispose_engines(db, app)
+    with multiprocessing.get_context('fork').Pool(workers, start_worker, (app, directory)) as pool:
+        yield from pool.imap_unordered(render_pages, chunks)
+
+
+def build(app, directory, workers=None, full=False):
+    """ Bring the snapshot in directory up to date; returns a summary of the run, timed from start to finish.
+
+    Renders every page when full is set, when there is no snapshot yet or
+    when the asset bundles changed, and only the changed pages otherwise.
+    """
+    clock = time.perf_counter()
+    workers = workers or os.cpu_count()
+    os.makedirs(directory, exist_ok=True)
+    previous = load_manifest(directory)
+    # The database's clock stamps updated_at, so changes are measured against it
+    started_at = db.session.query(db.func.now()).scalar()
+    listings = listing_versions()
+    current = detail_pages()
+    incremental = not full and previous is not None and previous['assets'] == assets.manifest
+    if incremental:
+        since = datetime.fromisoformat(previous['started_at']) - WRITE_SLACK
+        pages = dict(previous['pages'])
+        paths = [path for path, version in listings.items() if previous['listings'].get(path) != version]
+        paths.extend((changed_pages(since, started_at) & current) | (current - set(pages)) | set(previous['failed']))
+        gone = {path for path in pages if path not in LISTINGS and path not in current}
+    else:
+        pages = {}
+        paths = list(LISTINGS) + sorted(current)
+        gone = set(previous['pages']) - set(paths) if previous is not None else set()
+    db.session.commit()
+
+    rendered, failed = 0, []
+    for results in render(app, directory, sorted(set(paths)), workers):
+        for path, status, entry in results:
+            if entry is not None:
+                pages[path] = entry
+                rendered += 1
+            elif status == 404:
+                gone.add(path)
+            else:
+                failed.append(path)
+
+    for path in gone:
+        pages.pop(path, None)
+        try:
+            os.remove(os.path.join(directory, page_file(path)))
+        except FileNotFoundError:
+            pass
+
+    manifest = {
+        'started_at': started_at.isoformat(),
+        'assets': assets.manifest,
+        'listings': listings,
+        'pages': pages,
+        'failed': sorted(failed),
+    }
+    write_file(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    seconds = time.perf_counter() - clock
+    return {
+        'mode': 'incremental' if incremental else 'full',
+        'workers': workers,
+        'pages': len(pages),
+        'rendered': rendered,
+        'removed': len(gone),
+        'failed': len(failed),
+        'seconds': round(seconds, 3),
+        'pages_per_second': round(rendered / seconds, 1) if seconds else None,
+    }
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@click.command('snapshot')
+@click.option('--output', type=click.Path(file_okay=False), help='Snapshot directory; SNAPSHOT_DIR by default.')
+@click.option('--workers', '-w', type=int, help='Rendering processes; one per CPU by default.')
+@click.option('--full', is_flag=True, help='Re-render every page, not only those whose rows changed.')
+@with_appcontext
+def snapshot_command(output, workers, full):
+    """Render the public pages into a static directory for the web server to serve."""
+    directory = output or current_app.config['SNAPSHOT_DIR']
+    # A log line per page would bury the summary
+    request_log.setLevel(logging.WARNING)
+    summary = build(current_app._get_current_object(), directory, workers, full)
+    click.echo('{mode} snapshot: rendered {rendered} pages in {seconds:.2f}s ({rate} pages/s) with {workers} workers; '
+               '{pages} pages, {removed} removed, {failed} failed. Manifest: {manifest}'.format(
+                   rate=summary['pages_per_second'] or '-', manifest=os.path.join(directory, MANIFEST), **summary))
+    if summary['failed']:
+        raise SystemExit(1)
@@ -0,0 +1,56 @@
+""" The app's background tasks, see jobs.py. """
+import logging
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from cache import cache, page_key
+from counters import roll_show_counts
+from jobs import defer, task
+from models import db
+from routing import STICKY_COOKIE
+
+
+log = logging.getLogger('fyyur.jobs')
+
+
+@task('counts.roll', every=60)
+def roll_counts():
+    # Replaces the cron entry for `flask counts roll` when a worker is running
+    if roll_show_counts():
+        cache.delete_many(page_key('venues'))
+
+
+@task('pages.warm', max_attempts=3)
+def warm(paths):
+    """Render pages into the shared cache so the next visitor doesn't pay for the miss."""
+    client = current_app.test_client()
+    # Render from the primary: a lagging replica would put the old page back in the cache
+    client.set_cookie('localhost', STICKY_COOKIE, str(time.time() + 3600))
+    for path in paths:
+        status = client.get(path).status_code
+        if status >= 500:
+            raise RuntimeError('GET {} returned {}'.format(path, status))
+        if status != 200:
+            log.info('Not warming %s: %s', path, status)
+
+
+def warm_pages(*paths):
+    """ Re-render pages after the current transaction commits.
+
+    Only worth it with the filesystem cache: an in-process cache lives in the
+    web process, where the worker's render would never be seen.
+    """
+    if cache.shared:
+        # The delay lets the web process drop the stale entries before the worker looks
+        defer('pages.warm', {'paths': list(paths)}, delay=1)
+
+
+@task('jobs.prune', every=3600)
+def prune_jobs(days=7):
+    # Finished jobs only matter for their idempotency keys and for debugging
+    db.session.execute(
+        text('DELETE FROM "Job" WHERE status = \'done\' AND finished_at < now() - make_interval(days => :days)'),
+        {'days': days}
+    )
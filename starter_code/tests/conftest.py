@@ -0,0 +1,39 @@
+""" Fixtures for the tests; run `python -m pytest tests` from starter_code/ (pip install pytest).
+
+Most tests need a Postgres database that may be wiped, with the pg_trgm and
+btree_gist extensions available, given with TEST_DATABASE_URL. It is filled
+with a small generated data set (see benchmarks/datagen.py). Without one the
+tests that use the app fixture are skipped.
+"""
+import os
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+
+VENUES = 50
+ARTISTS = 100
+SHOWS = 2000
+
+
+@pytest.fixture(scope='session')
+def app():
+    database_url = os.environ.get('TEST_DATABASE_URL')
+    if not database_url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+
+    from benchmarks.datagen import populate
+    from benchmarks.harness import bench_app
+
+    app = bench_app(database_url)
+    with app.app_context():
+        try:
+            populate(VENUES, ARTISTS, SHOWS)
+        except DBAPIError as error:
+            pytest.skip('No usable Postgres database at TEST_DATABASE_URL: {}'.format(error.orig))
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
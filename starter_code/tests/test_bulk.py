@@ -0,0 +1,52 @@
+""" The bulk importer: COPY values, and bad lines rejected one by one while the rest go in. """
+import io
+import json
+
+from bulk import Malformed, copy_value, read_ndjson
+from benchmarks.datagen import DataGenerator, phone
+
+
+# Phone numbers of the venues imported here, apart from the generated data set's
+TEST_PHONES = 9100000000
+
+
+def mixed_body(venues):
+    lines = [json.dumps(venue) for venue in venues]
+    lines[1:1] = ['{"name": "Half a line"', '[1, 2]', '"x"', '']
+    return '\n'.join(lines) + '\n'
+
+
+def test_read_ndjson_yields_malformed_lines():
+    records = list(read_ndjson(io.StringIO('{"a": 1}\n{"a": \n\n[1, 2]\n')))
+    assert records[0] == {'a': 1}
+    assert isinstance(records[1], Malformed) and records[1].text == '{"a":'
+    assert records[2] == [1, 2]
+
+
+def test_copy_value_escapes_text_and_arrays():
+    assert copy_value('a\tb\\c\n') == 'a\\tb\\\\c\\n'
+    assert copy_value(['Jazz', 'Say "hi"']) == '{"Jazz","Say \\\\"hi\\\\""}'
+    assert [copy_value(value) for value in (None, True, 1.5)] == ['\\N', 't', '1.5']
+
+
+def test_bulk_import_rejects_bad_lines_and_keeps_going(app, client):
+    from models import db, Venue
+
+    venues = [dict(venue, phone=phone(TEST_PHONES, index))
+              for index, venue in enumerate(DataGenerator(seed=1).venues(3))]
+    try:
+        response = client.post('/api/v1/bulk/venues', data=mixed_body(venues), content_type='application/x-ndjson',
+                               headers={'Authorization': 'Bearer ' + app.config['BULK_API_TOKEN']})
+        assert response.status_code == 200
+        result = response.get_json()
+        assert (result['inserted'], result['rejected']) == (3, 3)
+        assert [(reject['line'], sorted(reject['errors'])) for reject in result['rejects']] == \
+            [(2, ['record']), (3, ['record']), (4, ['record'])]
+        with app.app_context():
+            imported = db.session.query(Venue.phone).filter(Venue.phone.in_([v['phone'] for v in venues])).count()
+            assert imported == 3
+    finally:
+        with app.app_context():
+            db.session.query(Venue).filter(Venue.phone.like('910-%')).delete(synchronize_session=False)
+            db.session.commit()
+            db.session.remove()
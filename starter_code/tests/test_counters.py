@@ -0,0 +1,36 @@
+""" The upcoming/past show counters' clock and the /venues ETag. """
+from datetime import timedelta
+
+from counters import locked_clock, rebuild_show_counts, roll_show_counts
+
+
+def venues_etag(client):
+    response = client.get('/venues')
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_venues_etag_only_changes_when_a_roll_moves_shows(app, client):
+    from models import db, Show
+
+    try:
+        with app.app_context():
+            rebuild_show_counts()
+        etag = venues_etag(client)
+
+        with app.app_context():
+            counted_until = locked_clock().counted_until
+            db.session.rollback()
+            assert roll_show_counts(counted_until + timedelta(microseconds=1)) == 0
+        assert venues_etag(client) == etag
+
+        with app.app_context():
+            next_start = db.session.query(db.func.min(Show.start_time)).\
+                filter(Show.start_time > counted_until + timedelta(microseconds=1)).\
+                scalar()
+            assert roll_show_counts(next_start) > 0
+        assert venues_etag(client) != etag
+    finally:
+        with app.app_context():
+            rebuild_show_counts()
+            db.session.remove()
@@ -0,0 +1,74 @@
+""" Statements run per page, so an N+1 query can't creep back into a view.
+
+Every page has a budget of statements, counted at the engine, and a detail
+page must run as many statements for the busiest venue or artist as for the
+quietest one.
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# path -> most statements a request may run: the conditional GET's version query, the rows and the genre facets
+LISTINGS = {
+    '/venues': 3,
+    '/artists': 3,
+    '/shows': 2,
+    '/shows?genre=Jazz': 2,
+    '/api/v1/venues': 1,
+    '/api/v1/artists': 1,
+    '/api/v1/shows': 1,
+}
+
+# The version query, the venue or artist and its shows
+DETAIL_PAGE_BUDGET = 3
+
+
+@contextmanager
+def recorded_statements():
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+
+
+def count_statements(client, path):
+    # A first request opens the connection and fills the app's one-off caches
+    client.get(path)
+    with recorded_statements() as statements:
+        response = client.get(path)
+    assert response.status_code == 200, path
+    return len(statements)
+
+
+def busiest_and_quietest(key):
+    """The ids with the most and the fewest shows, by the Show column key."""
+    from models import db, Show
+
+    column = getattr(Show, key)
+    counts = db.session.query(column, db.func.count()).filter(column.isnot(None)).group_by(column).all()
+    db.session.remove()
+    counts.sort(key=lambda row: (row[1], row[0]))
+    return counts[-1][0], counts[0][0]
+
+
+@pytest.mark.parametrize('path', sorted(LISTINGS))
+def test_listing_within_budget(client, path):
+    assert count_statements(client, path) <= LISTINGS[path]
+
+
+@pytest.mark.parametrize('kind, key', [('venues', 'venue_id'), ('artists', 'artist_id')])
+def test_detail_page_independent_of_shows(app, client, kind, key):
+    with app.app_context():
+        busiest, quietest = busiest_and_quietest(key)
+    counts = [count_statements(client, '/{}/{}'.format(kind, entity_id)) for entity_id in (busiest, quietest)]
+    assert counts[0] == counts[1]
+    assert counts[0] <= DETAIL_PAGE_BUDGET
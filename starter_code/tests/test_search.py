@@ -0,0 +1,82 @@
+""" Search: the SQLite FTS5 fallback on its own, then against search_entities() on Postgres. """
+import sqlite3
+
+import pytest
+
+from search import SqliteSearchIndex, search_entities
+
+
+# (id, name, city, state, genres)
+ROWS = [
+    (1, 'The Velvet Cellar', 'San Francisco', 'CA', ['Jazz', 'Blues']),
+    (2, 'Velvet Underground Hall', 'San Diego', 'CA', ['Rock n Roll']),
+    (3, 'The Musical Hop', 'New York', 'NY', ['Jazz']),
+    (4, 'Park Square Live', 'Santa Fe', 'NM', ['Folk']),
+    (5, '100% Club', 'Austin', 'TX', ['Blues']),
+]
+
+
+def sqlite_index(rows):
+    try:
+        index = SqliteSearchIndex()
+    except sqlite3.OperationalError as error:
+        pytest.skip('SQLite without the FTS5 trigram tokenizer: {}'.format(error))
+    index.add(rows)
+    return index
+
+
+def ids(result):
+    rows, count = result
+    return [row.id for row in rows], count
+
+
+@pytest.mark.parametrize('term, expected', [
+    # Names and cities, ranked by the similarity of the name
+    ('velvet', ([1, 2], 2)),
+    ('VELVET', ([1, 2], 2)),
+    ('york', ([3], 1)),
+    # "City, ST" terms: cities in that state starting with the given one, ranked by the city's similarity
+    ('San, CA', ([2, 1], 2)),
+    ('san diego, ca', ([2], 1)),
+    ('Santa, CA', ([], 0)),
+    # Genres match whole names only; neither name is like the term, so they are ranked by name
+    ('Jazz', ([3, 1], 2)),
+    ('Jaz', ([], 0)),
+    # LIKE wildcards are matched literally
+    ('100%', ([5], 1)),
+    ('0% c', ([5], 1)),
+    ('', ([], 0)),
+    ('   ', ([], 0)),
+])
+def test_sqlite_search(term, expected):
+    assert ids(sqlite_index(ROWS).search(term)) == expected
+
+
+def test_sqlite_search_state_code():
+    # Short terms are matched with LIKE instead of the trigram index; "ca" is also in "Musical"
+    rows, count = sqlite_index(ROWS).search('ca')
+    assert sorted(row.id for row in rows) == [1, 2, 3] and count == 3
+
+
+def test_sqlite_search_pages():
+    index = sqlite_index(ROWS)
+    first, count = ids(index.search('a', per_page=2))
+    second, second_count = ids(index.search('a', page=2, per_page=2))
+    assert count == second_count == 5
+    assert len(first) == 2 and len(second) == 2 and not set(first) & set(second)
+    assert index.search('a', page=4, per_page=2) == ([], 5)
+
+
+@pytest.mark.parametrize('kind', ['venues', 'artists'])
+def test_sqlite_search_matches_postgres(app, kind):
+    from models import db
+    from benchmarks.search import MODELS, terms
+
+    model = dict(MODELS)[kind]
+    with app.app_context():
+        index = sqlite_index(db.session.query(model.id, model.name, model.city, model.state, model.genres).
+                             order_by(model.id))
+        for name, term, indexes in terms(model) + (('blank', '', None),):
+            for page in (1, 2):
+                assert index.search(term, page, 5) == search_entities(model, term, page, 5), (name, term, page)
+        db.session.remove()
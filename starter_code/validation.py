@@ -0,0 +1,202 @@
+import re
+from datetime import timedelta, timezone
+
+import dateutil.parser
+
+from models import DEFAULT_SHOW_DURATION
+
+
+# The allowed states and genres; the form choices are built from these too
+
+STATE_CODES = (
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS',
+    'KY', 'LA', 'ME', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'MD', 'MA',
+    'MI', 'MN', 'MS', 'MO', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+)
+GENRE_NAMES = (
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop', 'Heavy Metal',
+    'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+)
+
+STATES = frozenset(STATE_CODES)
+GENRES = frozenset(GENRE_NAMES)
+
+# Patterns are compiled once at import time
+PHONE = re.compile(r'^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$')
+URL = re.compile(r'^[a-z]+://[^/?:]+\.[^/?:]+(:[0-9]+)?(/.*?)?(\?.*)?$', re.IGNORECASE)
+
+TRUE_VALUES = frozenset(('1', 'true', 't', 'yes', 'y', 'on'))
+
+
+#----------------------------------------------------------------------------#
+# Checks.
+#----------------------------------------------------------------------------#
+
+def is_present(value):
+    return bool(value)
+
+
+def is_phone(value):
+    return bool(value) and PHONE.match(value) is not None
+
+
+def is_state(value):
+    return value in STATES
+
+
+def is_genre_list(value):
+    # JSON can carry any type here; only a list of known genre names passes
+    return isinstance(value, list) and bool(value) and \
+        all(isinstance(genre, str) for genre in value) and GENRES.issuperset(value)
+
+
+def is_url(value):
+    return bool(value) and URL.match(value) is not None
+
+
+#----------------------------------------------------------------------------#
+# Coercion.
+#----------------------------------------------------------------------------#
+
+def to_text(value):
+    if isinstance(value, str):
+        return value.strip() or None
+    return value
+
+
+def to_genres(value):
+    # CSV cells carry genres as one comma-separated string
+    if isinstance(value, str):
+        return [genre.strip() for genre in value.split(',') if genre.strip()]
+    return value or []
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+FLAG_FIELDS = frozenset(('seeking_talent', 'seeking_venue'))
+
+
+def coercer_for(field):
+    if field == 'genres':
+        return to_genres
+    if field in FLAG_FIELDS:
+        return to_bool
+    return to_text
+
+
+class Validator(object):
+    """ Checks venue or artist records against the form rules.
+
+    checks is a sequence of (field, predicate, message) run in order. One
+    Validator serves the WTForms classes, the bulk importer and the API, for a
+    single record or a batch.
+    """
+
+    def __init__(self, fields, checks):
+        self.fields = tuple(fields)
+        self.checks = tuple(checks)
+        self.coercers = tuple((field, coercer_for(field)) for field in self.fields)
+
+    def clean(self, record):
+        """Coerce a raw record (strings from CSV/JSON) into column values."""
+        return {field: coerce(record.get(field)) for field, coerce in self.coercers}
+
+    def errors(self, row, only=None, stop_at_first=False):
+        """ Field name -> message for every failed check on an already clean row.
+
+        only restricts the checks to the given fields; stop_at_first returns as
+        soon as one check fails.
+        """
+        errors = {}
+        for field, check, message in self.checks:
+            if only is not None and field not in only:
+                continue
+            if field not in errors and not check(row.get(field)):
+                errors[field] = message
+                if stop_at_first:
+                    break
+        return errors
+
+    def validate(self, record, stop_at_first=False):
+        row = self.clean(record)
+        return row, self.errors(row, stop_at_first=stop_at_first)
+
+    def validate_many(self, records, stop_at_first=False):
+        """Yield (row, errors) for each record of an iterable."""
+        clean = self.clean
+        errors = self.errors
+        for record in records:
+            row = clean(record)
+            yield row, errors(row, stop_at_first=stop_at_first)
+
+
+def entity_checks(urls):
+    # Same order as the form validators: required fields, then phone, genres, state and URLs
+    checks = [(field, is_present, 'This field is required.') for field in ('name', 'city', 'state', 'address')]
+    checks.append(('phone', is_phone, 'Invalid phone.'))
+    checks.append(('genres', is_genre_list, 'Invalid genres.'))
+    checks.append(('state', is_state, 'Invalid state.'))
+    checks.extend((field, is_url, 'Invalid URL.') for field in urls)
+    return checks
+
+
+venue_validator = Validator(
+    ('name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'website', 'facebook_link',
+     'seeking_talent', 'seeking_description'),
+    entity_checks(('website', 'facebook_link'))
+)
+artist_validator = Validator(
+    ('name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'website', 'facebook_link',
+     'seeking_venue', 'seeking_description'),
+    entity_checks(('image_link', 'website', 'facebook_link'))
+)
+
+
+def to_datetime(value):
+    # Times without a zone are taken as UTC, as dates.py shows them
+    if not hasattr(value, 'isoformat'):
+        value = dateutil.parser.isoparse(str(value))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def validate_show(record):
+    """ Coerce and check a raw show record; returns (row, errors) like Validator.validate.
+
+    The show ends at end_time, or duration_minutes after it starts, or
+    DEFAULT_SHOW_DURATION after it starts when neither is given.
+    """
+    row = {}
+    errors = {}
+    for field in ('artist_id', 'venue_id'):
+        try:
+            row[field] = int(record.get(field))
+        except (TypeError, ValueError):
+            errors[field] = 'Invalid id.'
+    try:
+        row['start_time'] = to_datetime(record.get('start_time'))
+    except ValueError:
+        errors['start_time'] = 'Invalid date.'
+        return row, errors
+    if record.get('end_time') not in (None, ''):
+        try:
+            row['end_time'] = to_datetime(record['end_time'])
+        except ValueError:
+            errors['end_time'] = 'Invalid date.'
+            return row, errors
+    elif record.get('duration_minutes') not in (None, ''):
+        try:
+            row['end_time'] = row['start_time'] + timedelta(minutes=int(record['duration_minutes']))
+        except (TypeError, ValueError):
+            errors['duration_minutes'] = 'Invalid duration.'
+            return row, errors
+    else:
+        row['end_time'] = row['start_time'] + DEFAULT_SHOW_DURATION
+    if row['end_time'] <= row['start_time']:
+        errors['end_time'] = 'The show must end after it starts.'
+    return row, errors
@@ -0,0 +1,34 @@
+""" Production entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py picks the worker class. With gevent, the default, each
+worker serves many concurrent clients on greenlets and every database query
+yields while Postgres works, so slow clients and slow reads don't tie up a
+worker; with gthread each worker is a plain thread pool.
+"""
+import logging
+
+from dbpool import make_psycopg2_green
+
+
+def green():
+    """Whether gevent has patched this process, i.e. we run in a gevent worker."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+if green():
+    make_psycopg2_green()
+
+from app import app  # noqa: E402
+
+if green() and app.extensions['instrumentation'].profiler is not None:
+    # The profiler samples OS threads, and greenlets all share one
+    logging.getLogger(__name__).warning('PROFILE_THRESHOLD_MS is ignored under gevent')
+    app.extensions['instrumentation'].profiler = None
+
+application = app